@@ -0,0 +1,147 @@
+"""
+Request Coalescing for Model Moves
+----------------------------------
+
+Every `/get_move` request for a Leon model needs one short generation. Running them one by one
+means that concurrent boards wait for each other although the model could answer all of them in
+one batched forward pass. The `MoveBatcher` collects the requests per model for a few milliseconds
+and answers them with a single batched generation.
+"""
+
+import asyncio
+import contextvars
+
+from src.UI.backend.metrics import batch_sizes, current_trace, stage_durations
+
+
+class MoveBatcher:
+    """
+    Coalesces concurrent move requests for the same model into one batched generation.
+
+    Every model gets its own queue and background task. The task waits for a first request, then
+    collects further requests for up to `max_wait_ms` milliseconds or until `max_batch_size` requests
+    are queued. It runs `predict_batch` once for the whole batch in a worker thread, so the event loop
+    keeps accepting requests, and resolves the future of every caller with its own prediction.
+    The time every request waited in the queue and the stage timings of its batch are added to the
+    trace of the caller.
+
+    Attributes:
+    - predict_batch (Callable[[str, list[str]], list[str]]): Returns one prediction per input string for the given model name.
+    - max_batch_size (int): Maximum number of requests answered by one generation. Default is 16.
+    - max_wait_ms (float): Maximum time in milliseconds to wait for more requests after the first one. Default is 5.
+
+    Example:
+        >>> batcher = MoveBatcher(predict_batch, max_batch_size=32, max_wait_ms=2)
+        >>> prediction = await batcher.submit("GPT2 19k", "Pe2e4- Pe7e5-")
+    """
+
+    def __init__(self, predict_batch, max_batch_size=16, max_wait_ms=5.0):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.queues = {}
+        self.workers = {}
+
+    async def submit(self, model_name, input_string):
+        """
+        Queues an input string for the given model and waits for its prediction.
+
+        Args:
+        model_name (str): The name of the model that should answer.
+        input_string (str): The model input, e.g. the game history in xLAN+.
+
+        Returns:
+        str: The prediction for this input string.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.get_queue(model_name).put_nowait(
+            (input_string, future, current_trace.get(), loop.time())
+        )
+        return await future
+
+    def get_queue(self, model_name):
+        """
+        Returns the queue of a model and starts its background task on first use.
+        """
+        if model_name not in self.queues:
+            self.queues[model_name] = asyncio.Queue()
+            self.workers[model_name] = asyncio.create_task(self.run(model_name))
+        return self.queues[model_name]
+
+    async def collect_batch(self, queue):
+        """
+        Waits for the first request in the queue and collects further requests until the batch is
+        full or the waiting time is over.
+        """
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            if not queue.empty():
+                batch.append(queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        # requests whose caller is gone (e.g. client disconnected) are not generated
+        return [request for request in batch if not request[1].done()]
+
+    async def run(self, model_name):
+        """
+        Background task of a model: collects batches and resolves the futures of their callers.
+        """
+        queue = self.queues[model_name]
+        loop = asyncio.get_running_loop()
+        # the task inherited the context of its first caller, whose trace must not collect every batch
+        current_trace.set(None)
+
+        while True:
+            batch = await self.collect_batch(queue)
+            if not batch:
+                continue
+
+            start_time = loop.time()
+            for _, _, trace, submit_time in batch:
+                stage_durations.observe(start_time - submit_time, "queue_wait")
+                if trace is not None:
+                    trace["queue_wait"] = start_time - submit_time
+            batch_sizes.observe(len(batch), model_name)
+
+            # the executor does not copy the context, so the stages of the batch are traced explicitly
+            batch_trace = {}
+            context = contextvars.copy_context()
+            context.run(current_trace.set, batch_trace)
+
+            input_strings = [request[0] for request in batch]
+            try:
+                predictions = await loop.run_in_executor(
+                    None, context.run, self.predict_batch, model_name, input_strings
+                )
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future, trace, _), prediction in zip(batch, predictions):
+                if trace is not None:
+                    trace.update(batch_trace, batch_size=len(batch))
+                if not future.done():
+                    future.set_result(prediction)
+
+    async def close(self):
+        """
+        Stops the background tasks of all models.
+        """
+        for worker in self.workers.values():
+            worker.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.queues.clear()
+        self.workers.clear()
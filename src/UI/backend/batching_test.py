@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+
+from src.UI.backend.batching import MoveBatcher
+
+
+class MoveBatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def predict_batch(self, model_name, input_strings):
+        self.calls.append((model_name, list(input_strings)))
+        return [f"{model_name}:{input_string}" for input_string in input_strings]
+
+    def test_concurrent_requests_are_coalesced(self):
+        async def run():
+            batcher = MoveBatcher(self.predict_batch, max_batch_size=8, max_wait_ms=50)
+            results = await asyncio.gather(
+                *[batcher.submit("GPT2", f"game {i}") for i in range(5)]
+            )
+            await batcher.close()
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(results, [f"GPT2:game {i}" for i in range(5)])
+        self.assertEqual(len(self.calls), 1)
+
+    def test_batches_are_split_by_model_and_size(self):
+        async def run():
+            batcher = MoveBatcher(self.predict_batch, max_batch_size=2, max_wait_ms=50)
+            results = await asyncio.gather(
+                batcher.submit("GPT2", "a"),
+                batcher.submit("Mamba", "b"),
+                batcher.submit("GPT2", "c"),
+                batcher.submit("GPT2", "d"),
+            )
+            await batcher.close()
+            return results
+
+        results = asyncio.run(run())
+        self.assertEqual(results, ["GPT2:a", "Mamba:b", "GPT2:c", "GPT2:d"])
+        self.assertIn(("GPT2", ["a", "c"]), self.calls)
+        self.assertIn(("GPT2", ["d"]), self.calls)
+        self.assertIn(("Mamba", ["b"]), self.calls)
+
+    def test_errors_are_passed_to_every_caller(self):
+        def failing_predict_batch(model_name, input_strings):
+            raise ValueError("Model not found")
+
+        async def run():
+            batcher = MoveBatcher(failing_predict_batch, max_wait_ms=10)
+            results = await asyncio.gather(
+                batcher.submit("unknown", "a"),
+                batcher.submit("unknown", "b"),
+                return_exceptions=True,
+            )
+            await batcher.close()
+            return results
+
+        results = asyncio.run(run())
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
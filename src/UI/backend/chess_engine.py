@@ -4,10 +4,19 @@ import chess
 import chess.engine
 import chess.pgn
 import io
-from transformers import AutoModelForCausalLM
+import json
+import logging
+import shlex
+import threading
+from src.UI.backend.metrics import timed
+from src.UI.backend.model_registry import ModelRegistry
+from src.UI.backend.opening_book import OpeningBooks
 from src.generate_prediction import generate_prediction
+from src.generate_prediction import generate_masked_batch_predictions
 import src.notation_converter as converter
 
+logger = logging.getLogger(__name__)
+
 
 models = {
     "Mamba 350k": "Leon-LLM/R4_Mamba_350k_4E_xLANplus",
@@ -15,9 +24,20 @@ models = {
     "GPT2 71k": "Leon-LLM/R5_GPT2_71k_4E_xLANplus",
     "GPT2 19k": "Leon-LLM/R1_GPT2_19k_4E_xLANplus",
 }
+if os.environ.get("LEON_MODEL_PATHS"):
+    models = json.loads(os.environ["LEON_MODEL_PATHS"])
+
+# Models are loaded on their first request or by the warmup. Least recently used models are
+# evicted once the loaded models need more than LEON_MODEL_MEMORY_BUDGET_MB (0 = no limit).
+registry = ModelRegistry(
+    models,
+    memory_budget=int(
+        float(os.environ.get("LEON_MODEL_MEMORY_BUDGET_MB", "0")) * 1024**2
+    ),
+)
 
-for name, model_path in models.items():
-    models[name] = AutoModelForCausalLM.from_pretrained(model_path)
+# Common openings are answered from the books in LEON_OPENING_BOOK_DIR without the model
+books = OpeningBooks(os.environ.get("LEON_OPENING_BOOK_DIR"), models)
 
 
 def get_engine_path():
@@ -31,34 +51,107 @@ def get_engine_path():
         return os.path.join(ROOT_DIR, "src/stockfish/stockfish-macOS")
 
 
-engine = chess.engine.SimpleEngine.popen_uci(get_engine_path())
+def get_engine_command():
+    # LEON_ENGINE_COMMAND replaces Stockfish, e.g. by the stub engine of the load test
+    if os.environ.get("LEON_ENGINE_COMMAND"):
+        return shlex.split(os.environ["LEON_ENGINE_COMMAND"])
+    return get_engine_path()
+
+
+engine = None
+engine_pid = None
+engine_lock = threading.Lock()
+
+
+def get_engine():
+    # the engine is started on first use in every process, forked workers cannot use the parent's engine
+    global engine, engine_pid
+    with engine_lock:
+        if engine is None or engine_pid != os.getpid():
+            engine = chess.engine.SimpleEngine.popen_uci(get_engine_command())
+            engine_pid = os.getpid()
+        return engine
+
+
+def quit_engine():
+    global engine
+    with engine_lock:
+        if engine is not None and engine_pid == os.getpid():
+            engine.quit()
+        engine = None
+
+
+# Set once the warmup has finished, see `warm_up`
+warmed_up = threading.Event()
+
+
+def warm_up(start_engine=True):
+    """
+    Loads every model and runs one dummy generation with it, so that the first requests do not pay
+    for loading, allocator and kernel setup. Also loads the opening books and starts the engine.
+    Failures are logged and do not stop the warmup of the remaining models.
+    """
+    try:
+        books.ensure_loaded()
+        if start_engine:
+            get_engine()
+    except Exception:
+        logger.exception("Warmup of the opening books or the engine failed")
+    for model_name in registry.model_paths:
+        try:
+            with timed("warmup"):
+                generate_moves([chess.STARTING_FEN], get_model(model_name))
+        except Exception:
+            logger.exception(f"Warmup of {model_name} failed")
+    warmed_up.set()
 
 
 def get_stockfish_move(fen):
     board = chess.Board(fen)
-    result = engine.play(board, chess.engine.Limit(time=0.1))
+    with timed("engine"):
+        result = get_engine().play(board, chess.engine.Limit(time=0.1))
     return result.move.uci()
 
 
 def get_LLL_move(fen, history, model_name):
-    model = models.get(model_name)
-    if not model:
-        raise ValueError("Model not found")
-
-    board = chess.Board(fen)
-    input_string = process_game_history(history, fen)
+    board, input_string = prepare_LLL_request(fen, history)
+    book_move = lookup_book(model_name, input_string)
+    if book_move:
+        return book_move
+    model = get_model(model_name)
     prediction = generate_move(input_string, model)
     last_move_uci = process_prediction(prediction, board)
     return last_move_uci
 
 
+def get_model(model_name):
+    return registry.get(model_name)
+
+
+def check_model(model_name):
+    registry.check_model(model_name)
+
+
+def lookup_book(model_name, input_string):
+    with timed("opening_book"):
+        return books.lookup(model_name, input_string)
+
+
+def prepare_LLL_request(fen, history):
+    board = chess.Board(fen)
+    input_string = process_game_history(history, fen)
+    return board, input_string
+
+
 def process_game_history(history, fen):
     if len(history) > 1:
-        game = chess.pgn.read_game(io.StringIO(history))
-        board = game.board()
-        uci_moves = [board.uci(move) for move in game.mainline_moves()]
-        x_lan_sequence = converter.uci_sequence_to_xlan(" ".join(uci_moves))
-        return converter.xlan_sequence_to_xlanplus(x_lan_sequence)
+        with timed("pgn_parsing"):
+            game = chess.pgn.read_game(io.StringIO(history))
+            board = game.board()
+            uci_moves = [board.uci(move) for move in game.mainline_moves()]
+        with timed("notation_conversion"):
+            x_lan_sequence = converter.uci_sequence_to_xlan(" ".join(uci_moves))
+            return converter.xlan_sequence_to_xlanplus(x_lan_sequence)
     else:
         return fen
 
@@ -73,6 +166,128 @@ def generate_move(input_string, model):
     )[0]
 
 
+def generate_moves(input_strings, model):
+    return generate_masked_batch_predictions(
+        input_strings,
+        num_tokens_to_generate=3,
+        model=model,
+        notation="xLANplus",
+        temperature=0.01,
+        timer=timed,
+    )[0]
+
+
+def get_LLL_moves(requests, model_name):
+    results = [None] * len(requests)
+    prepared = []
+    for index, (fen, history) in enumerate(requests):
+        try:
+            board, input_string = prepare_LLL_request(fen, history)
+        except Exception as e:
+            results[index] = {"error": f"Invalid position: {e}"}
+            continue
+        book_move = lookup_book(model_name, input_string)
+        if book_move:
+            results[index] = {"move": book_move}
+        else:
+            prepared.append((index, board, input_string))
+
+    if prepared:
+        input_strings = [input_string for _, _, input_string in prepared]
+        predictions = generate_moves(input_strings, get_model(model_name))
+        for (index, board, _), prediction in zip(prepared, predictions):
+            try:
+                move = process_prediction(prediction, board)
+            except Exception:
+                move = None
+            if move:
+                results[index] = {"move": move}
+            else:
+                results[index] = {"error": "Move could not be generated"}
+    return results
+
+
+def predict_batch(model_name, input_strings):
+    return generate_moves(input_strings, get_model(model_name))
+
+
+def play_session_moves(session, moves, reply=True, stockfish=False):
+    with session.lock:
+        with timed("session_update"):
+            for move in moves:
+                session.push_move(move)
+        if not reply:
+            return None, True
+
+        if stockfish:
+            move = get_stockfish_move(session.board.fen())
+        else:
+            model = get_model(session.model_name)
+            with timed("generation"):
+                move = session.predict_move(model)
+        legal = session.is_legal(move)
+        if legal:
+            session.push_move(move)
+        return move, legal
+
+
+def stream_session_moves(session, moves, reply=True, stockfish=False, top_k=5):
+    """
+    Plays the new moves of a session and streams the reply. For a model, the best legal candidates
+    with their probabilities are yielded while they are computed, and the most probable legal move
+    is played. Stockfish answers if requested, if the session is played by Stockfish or if the model
+    finds no candidate.
+
+    Yields:
+    dict: {"type": "candidates", "candidates": [{"move": ..., "probability": ...}, ...]} events, then
+    one {"type": "move", "move": ..., "legal": ..., "source": "model" or "stockfish", "fen": ...} event.
+    """
+    with session.lock:
+        with timed("session_update"):
+            for move in moves:
+                session.push_move(move)
+        if not reply:
+            return
+        if session.board.is_game_over():
+            yield {
+                "type": "move",
+                "move": None,
+                "legal": False,
+                "source": None,
+                "fen": session.board.fen(),
+            }
+            return
+
+        candidates = []
+        if not stockfish and session.model_name != "stockfish":
+            model = get_model(session.model_name)
+            for improved_candidates in session.candidate_moves(model, top_k):
+                if improved_candidates == candidates:
+                    continue
+                candidates = improved_candidates
+                yield {
+                    "type": "candidates",
+                    "candidates": [
+                        {"move": move, "probability": probability}
+                        for move, probability in candidates
+                    ],
+                }
+
+        if candidates:
+            move, source = candidates[0][0], "model"
+        else:
+            move, source = get_stockfish_move(session.board.fen()), "stockfish"
+        session.push_move(move)
+        yield {
+            "type": "move",
+            "move": move,
+            "legal": True,
+            "source": source,
+            "fen": session.board.fen(),
+        }
+
+
 def process_prediction(prediction, board):
-    last_move = prediction.split(" ")[-1]
-    return "".join(converter.xlanplus_move_to_uci(board, last_move)[0])
+    with timed("process_prediction"):
+        last_move = prediction.split(" ")[-1]
+        return "".join(converter.xlanplus_move_to_uci(board, last_move)[0])
@@ -0,0 +1,299 @@
+"""
+Backend Load Test
+-----------------
+
+Measures the throughput and latency of the backend without network access or downloaded models.
+The load test starts `server.py` with the stub UCI engine instead of Stockfish and with randomly
+initialised tiny GPT-2 and Mamba models that use the real vocabulary of the notation. It replays
+the games of the validation PGN files ply by ply against `/get_move` from several concurrent
+clients and reports throughput, latency percentiles and error rates as JSON.
+
+The moves of random models are meaningless, so the load test measures the serving path (parsing,
+conversion, batching, generation) and not the playing strength.
+
+Usage:
+    python -m src.UI.backend.loadtest --concurrency 16 --requests 2000
+    python -m src.UI.backend.loadtest --url http://localhost:8000 --models "GPT2 19k"
+"""
+
+import argparse
+import asyncio
+import io
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import chess
+import chess.pgn
+import httpx
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+
+DEFAULT_PGN_FILES = [
+    os.path.join(ROOT_DIR, "data/validation/hard_positions/hard_pos.pgn"),
+    os.path.join(ROOT_DIR, "data/validation/board_state/board_state_positions.pgn"),
+]
+
+
+def write_stub_models(directory, notation="xLANplus", n_layer=2, n_embd=64, seed=0):
+    """
+    Saves a randomly initialised GPT-2 and Mamba model with the vocabulary of the notation.
+
+    Returns:
+    dict: Maps the model names "GPT2 stub" and "Mamba stub" to their folders.
+    """
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel, MambaConfig, MambaForCausalLM
+
+    with open(os.path.join(ROOT_DIR, "src/notation.json")) as file:
+        config = json.load(file)[notation]
+    tokens = {
+        "vocab_size": config["vocab_size"],
+        "bos_token_id": config["bos_token_id"],
+        "eos_token_id": config["eos_token_id"],
+        "pad_token_id": config["pad_token_id"],
+    }
+
+    torch.manual_seed(seed)
+    models = {
+        "GPT2 stub": GPT2LMHeadModel(
+            GPT2Config(
+                n_positions=config["n_positions"],
+                n_layer=n_layer,
+                n_head=2,
+                n_embd=n_embd,
+                **tokens,
+            )
+        ),
+        "Mamba stub": MambaForCausalLM(
+            MambaConfig(hidden_size=n_embd, num_hidden_layers=n_layer, **tokens)
+        ),
+    }
+    model_paths = {}
+    for name, model in models.items():
+        model_paths[name] = os.path.join(directory, name.replace(" ", "_"))
+        model.save_pretrained(model_paths[name])
+    return model_paths
+
+
+def load_requests(pgn_files, max_plies=60):
+    """
+    Turns every game of the PGN files into one request per ply: the position and the history up to it.
+
+    Returns:
+    list: One list of (fen, history) pairs per game, in the order of the plies.
+    """
+    games = []
+    for pgn_file in pgn_files:
+        with open(pgn_file) as file:
+            for line in file:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                game = chess.pgn.read_game(io.StringIO(line))
+                moves = list(game.mainline_moves())[:max_plies]
+                board = chess.Board()
+                requests = [(board.fen(), "")]
+                for ply in range(1, len(moves) + 1):
+                    board.push(moves[ply - 1])
+                    history = chess.Board().variation_san(moves[:ply])
+                    requests.append((board.fen(), history))
+                games.append(requests[:-1] if board.is_game_over() else requests)
+    return games
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(model_paths, port, workers=None, env=None):
+    """
+    Starts the backend with the given models and the stub engine and waits until it is warmed up.
+
+    Returns:
+    subprocess.Popen: The server process.
+    """
+    env = dict(os.environ if env is None else env)
+    env["LEON_MODEL_PATHS"] = json.dumps(model_paths)
+    env["LEON_ENGINE_COMMAND"] = f'"{sys.executable}" -m src.UI.backend.stub_engine'
+    if workers:
+        command = ["-m", "src.UI.backend.prefork", "--workers", str(workers)]
+        command += ["--port", str(port), "--log-level", "warning"]
+    else:
+        command = ["-m", "uvicorn", "src.UI.backend.server:app", "--port", str(port)]
+        command += ["--log-level", "warning"]
+    # the output of the server would mix with the report
+    process = subprocess.Popen(
+        [sys.executable, *command], cwd=ROOT_DIR, env=env, stdout=subprocess.DEVNULL
+    )
+
+    url = f"http://127.0.0.1:{port}/ready"
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise TimeoutError("Server did not start within 120 seconds")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_load(url, games, models, concurrency, num_requests, seed=0):
+    """
+    Sends `num_requests` requests to `/get_move` from `concurrency` clients. Every client replays
+    games ply by ply with a randomly chosen model.
+
+    Returns:
+    dict: The latencies in seconds, the status codes and the wall time of the run.
+    """
+    rng = random.Random(seed)
+    order = list(range(len(games)))
+    rng.shuffle(order)
+    plies = itertools.chain.from_iterable(
+        games[index] for index in itertools.cycle(order)
+    )
+    remaining = itertools.islice(plies, num_requests)
+
+    latencies = []
+    status_codes = {}
+
+    async def client(http):
+        for fen, history in remaining:
+            payload = {"fen": fen, "history": history, "model": rng.choice(models)}
+            start_time = time.perf_counter()
+            try:
+                response = await http.post(f"{url}/get_move", json=payload)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start_time)
+            status_codes[status] = status_codes.get(status, 0) + 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as http:
+        start_time = time.perf_counter()
+        await asyncio.gather(*[client(http) for _ in range(concurrency)])
+        wall_time = time.perf_counter() - start_time
+    return {
+        "latencies": latencies,
+        "status_codes": status_codes,
+        "wall_time": wall_time,
+    }
+
+
+def summarize(result, config):
+    latencies = sorted(result["latencies"])
+    errors = sum(
+        count for status, count in result["status_codes"].items() if status != "200"
+    )
+    return {
+        "config": config,
+        "requests": len(latencies),
+        "errors": errors,
+        "error_rate": errors / len(latencies) if latencies else 0.0,
+        "status_codes": result["status_codes"],
+        "duration_s": result["wall_time"],
+        "throughput_rps": len(latencies) / result["wall_time"],
+        "latency_ms": {
+            "mean": 1000 * sum(latencies) / len(latencies) if latencies else None,
+            **{
+                f"p{q}": 1000 * percentile(latencies, q) if latencies else None
+                for q in (50, 90, 95, 99)
+            },
+            "max": 1000 * latencies[-1] if latencies else None,
+        },
+    }
+
+
+def main(args):
+    games = load_requests(args.pgn or DEFAULT_PGN_FILES, args.max_plies)
+    config = {
+        "concurrency": args.concurrency,
+        "requests": args.requests,
+        "workers": args.workers,
+        "url": args.url,
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        if args.url:
+            url, models = args.url, args.models.split(",")
+        else:
+            model_paths = write_stub_models(
+                directory, n_layer=args.n_layer, n_embd=args.n_embd
+            )
+            models = args.models.split(",") if args.models else list(model_paths)
+            port = free_port()
+            server = start_server(model_paths, port, args.workers)
+            url = f"http://127.0.0.1:{port}"
+        config["models"] = models
+
+        try:
+            if args.warmup:
+                asyncio.run(run_load(url, games, models, 1, args.warmup, args.seed))
+            result = asyncio.run(
+                run_load(url, games, models, args.concurrency, args.requests, args.seed)
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    report = json.dumps(summarize(result, config), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report + "\n")
+    print(report)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the backend offline.")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Concurrent clients."
+    )
+    parser.add_argument("--requests", type=int, default=500, help="Total requests.")
+    parser.add_argument(
+        "--warmup", type=int, default=10, help="Requests sent before measuring."
+    )
+    parser.add_argument(
+        "--models",
+        default="",
+        help="Comma separated model names (default: all stub models).",
+    )
+    parser.add_argument(
+        "--url", default="", help="Test a running server instead of starting one."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="Start the server in pre-fork mode."
+    )
+    parser.add_argument("--pgn", nargs="*", help="PGN files with the games to replay.")
+    parser.add_argument("--max-plies", type=int, default=60, help="Plies per game.")
+    parser.add_argument(
+        "--n-layer", type=int, default=2, help="Layers of the stub models."
+    )
+    parser.add_argument(
+        "--n-embd", type=int, default=64, help="Width of the stub models."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the replay order.")
+    parser.add_argument(
+        "--output", default="", help="Also write the report to this file."
+    )
+    main(parser.parse_args())
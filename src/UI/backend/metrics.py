@@ -0,0 +1,162 @@
+"""
+Backend Metrics
+---------------
+
+Per-stage latency instrumentation of the inference pipeline. Every stage of a request (PGN parsing,
+notation conversion, tokenization, generation, detokenization, processing of the prediction, engine
+call, ...) is timed with `timed(stage)`. The timings are aggregated into histograms, which the
+`/metrics` endpoint renders in the Prometheus text format. If a trace is active for the current
+request, the stage timings are also collected in it, so that they can be logged per request.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the histogram buckets in seconds
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Stage timings of the current request, maps stage names to seconds
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Histogram:
+    """
+    Thread-safe histogram with one label, rendered in the Prometheus text format.
+
+    Attributes:
+    - name (str): The metric name, e.g. "leon_stage_duration_seconds".
+    - description (str): The help text of the metric.
+    - label (str): The name of the label, e.g. "stage".
+    - buckets (tuple[float]): The upper bounds of the buckets. Default is DEFAULT_BUCKETS.
+    """
+
+    def __init__(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}  # label value -> [bucket counts, sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        with self.lock:
+            series = self.series.setdefault(
+                label_value, [[0] * len(self.buckets), 0.0, 0]
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        """
+        Returns the lines of this histogram in the Prometheus text format.
+        """
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self.lock:
+            for label_value, (counts, total, count) in sorted(self.series.items()):
+                label = f'{self.label}="{label_value}"'
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(
+                        f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{label}}} {total}")
+                lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+stage_durations = Histogram(
+    "leon_stage_duration_seconds",
+    "Time spent in each stage of the inference pipeline.",
+    "stage",
+)
+request_durations = Histogram(
+    "leon_request_duration_seconds",
+    "Total time spent per request and endpoint.",
+    "endpoint",
+)
+batch_sizes = Histogram(
+    "leon_batch_size",
+    "Number of requests answered by one batched generation.",
+    "model",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+
+def record(stage, seconds):
+    """
+    Adds a stage timing to the histogram and to the trace of the current request.
+    """
+    stage_durations.observe(seconds, stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage):
+    """
+    Times the enclosed block as a stage of the inference pipeline.
+
+    Example:
+        >>> with timed("pgn_parsing"):
+        >>>     game = chess.pgn.read_game(io.StringIO(history))
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start_time)
+
+
+def render_metric(name, metric_type, description, values):
+    """
+    Renders a counter or gauge in the Prometheus text format.
+
+    Args:
+    name (str): The metric name.
+    metric_type (str): "counter" or "gauge".
+    description (str): The help text of the metric.
+    values (dict[str, float] | float): A single value, or a mapping of `label="value"` strings to values.
+
+    Returns:
+    list: The lines of the metric.
+    """
+    lines = [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+    if isinstance(values, dict):
+        lines.extend(f"{name}{{{label}}} {value}" for label, value in values.items())
+    else:
+        lines.append(f"{name} {values}")
+    return lines
+
+
+def render_histograms():
+    lines = []
+    for histogram in (stage_durations, request_durations, batch_sizes):
+        lines.extend(histogram.render())
+    return lines
@@ -0,0 +1,36 @@
+import unittest
+
+from src.UI.backend.metrics import Histogram, current_trace, stage_durations, timed
+
+
+class HistogramTest(unittest.TestCase):
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test.", "stage", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, "a")
+
+        lines = histogram.render()
+        self.assertIn('test_seconds_bucket{stage="a",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="1.0"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="a",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="a"} 4', lines)
+
+
+class TimedTest(unittest.TestCase):
+    def test_stage_is_added_to_histogram_and_trace(self):
+        trace = {}
+        token = current_trace.set(trace)
+        try:
+            with timed("test_stage"):
+                pass
+            with timed("test_stage"):
+                pass
+        finally:
+            current_trace.reset(token)
+
+        self.assertEqual(list(trace), ["test_stage"])
+        self.assertEqual(stage_durations.series["test_stage"][2], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
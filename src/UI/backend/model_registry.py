@@ -0,0 +1,179 @@
+"""
+Model Registry
+--------------
+
+Keeps track of the models served by the backend. Models are loaded on their first request (or
+all at once if eager loading is configured) instead of at import time. The registry measures the
+memory of every loaded model and evicts the least recently used models once the configured memory
+budget is exceeded.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def load_pretrained_model(model_path):
+    """
+    Default loader of the registry: loads a causal language model from Hugging Face or a local folder.
+    """
+    from transformers import AutoModelForCausalLM
+
+    return AutoModelForCausalLM.from_pretrained(model_path)
+
+
+def model_memory(model):
+    """
+    Returns the number of bytes used by the parameters and buffers of a model.
+    """
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class ModelRegistry:
+    """
+    Loads models lazily and keeps the resident models within a memory budget.
+
+    The registry is thread safe. Concurrent first requests for the same model wait for one single
+    load instead of loading the model several times. After every load the least recently used models
+    are evicted until the resident models fit into `memory_budget` again. The model that was just
+    loaded is never evicted, so a single model larger than the budget can still be served.
+
+    Attributes:
+    - model_paths (dict[str, str]): Maps the model names to their Hugging Face repository or local path.
+    - memory_budget (int): Maximum number of bytes for all resident models. None or 0 means unlimited. Default is None.
+    - loader (Callable[[str], torch.nn.Module]): Function that loads a model from its path. Default is `load_pretrained_model`.
+
+    Example:
+        >>> registry = ModelRegistry({"GPT2 19k": "Leon-LLM/R1_GPT2_19k_4E_xLANplus"}, memory_budget=2 * 1024**3)
+        >>> model = registry.get("GPT2 19k")
+        >>> print(registry.stats())
+    """
+
+    def __init__(self, model_paths, memory_budget=None, loader=load_pretrained_model):
+        self.model_paths = dict(model_paths)
+        self.memory_budget = memory_budget or None
+        self.loader = loader
+
+        self.models = OrderedDict()  # least recently used model first
+        self.model_sizes = {}
+        self.lock = threading.Lock()
+        self.load_locks = {name: threading.Lock() for name in self.model_paths}
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.load_seconds = 0.0
+        self.evictions = 0
+
+    def __contains__(self, name):
+        return name in self.model_paths
+
+    def check_model(self, name):
+        """
+        Raises a ValueError if no model with this name is configured.
+        """
+        if name not in self.model_paths:
+            raise ValueError("Model not found")
+
+    def get(self, name):
+        """
+        Returns the model with the given name and loads it if it is not resident.
+
+        Args:
+        name (str): The name of the model, e.g. "GPT2 19k".
+
+        Returns:
+        torch.nn.Module: The loaded model.
+
+        Raises:
+        ValueError: If no model with this name is configured.
+        """
+        self.check_model(name)
+        model = self.lookup(name)
+        if model is not None:
+            return model
+
+        with self.load_locks[name]:
+            # a concurrent request might have loaded the model while we were waiting
+            model = self.lookup(name, count_miss=False)
+            if model is not None:
+                return model
+            return self.load(name)
+
+    def lookup(self, name, count_miss=True):
+        """
+        Returns the model if it is resident and marks it as most recently used, otherwise None.
+        """
+        with self.lock:
+            model = self.models.get(name)
+            if model is not None:
+                self.models.move_to_end(name)
+                self.hits += 1
+            elif count_miss:
+                self.misses += 1
+            return model
+
+    def load(self, name):
+        """
+        Loads a model, registers it as most recently used and evicts models above the memory budget.
+        """
+        start_time = time.perf_counter()
+        model = self.loader(self.model_paths[name])
+        elapsed_time = time.perf_counter() - start_time
+
+        with self.lock:
+            self.models[name] = model
+            self.model_sizes[name] = model_memory(model)
+            self.loads += 1
+            self.load_seconds += elapsed_time
+            self.evict(keep=name)
+        return model
+
+    def load_all(self):
+        """
+        Loads all configured models, e.g. for eager loading at startup.
+        """
+        for name in self.model_paths:
+            self.get(name)
+
+    def evict(self, keep=None):
+        """
+        Evicts least recently used models until the resident models fit into the memory budget.
+        Must be called while holding `self.lock`.
+        """
+        if self.memory_budget is None:
+            return
+        for name in list(self.models):
+            if self.resident_memory() <= self.memory_budget:
+                break
+            if name == keep:
+                continue
+            del self.models[name]
+            del self.model_sizes[name]
+            self.evictions += 1
+
+    def resident_memory(self):
+        return sum(self.model_sizes.values())
+
+    def stats(self):
+        """
+        Returns the load and eviction metrics of the registry.
+
+        Returns:
+        dict: Counters for hits, misses, loads and evictions, the total load time in seconds, the memory
+        budget and the memory of every resident model in bytes (least recently used first).
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "load_seconds": self.load_seconds,
+                "evictions": self.evictions,
+                "memory_budget_bytes": self.memory_budget,
+                "resident_memory_bytes": self.resident_memory(),
+                "resident_models": {
+                    name: self.model_sizes[name] for name in self.models
+                },
+            }
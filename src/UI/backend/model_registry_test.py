@@ -0,0 +1,61 @@
+import threading
+import time
+import unittest
+
+import torch
+
+from src.UI.backend.model_registry import ModelRegistry, model_memory
+
+
+class ModelRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.loaded_paths = []
+        # every fake model has 100 float32 parameters = 400 bytes
+        self.registry = ModelRegistry(
+            {"A": "path/a", "B": "path/b", "C": "path/c"},
+            memory_budget=800,
+            loader=self.load,
+        )
+
+    def load(self, model_path):
+        self.loaded_paths.append(model_path)
+        time.sleep(0.01)
+        return torch.nn.Linear(10, 10, bias=False)
+
+    def test_models_are_loaded_lazily(self):
+        self.assertEqual(self.loaded_paths, [])
+        model = self.registry.get("A")
+        self.assertIs(self.registry.get("A"), model)
+        self.assertEqual(self.loaded_paths, ["path/a"])
+        self.assertEqual(model_memory(model), 400)
+
+    def test_unknown_model_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.registry.get("unknown")
+
+    def test_least_recently_used_model_is_evicted(self):
+        self.registry.get("A")
+        self.registry.get("B")
+        self.registry.get("A")
+        self.registry.get("C")
+
+        stats = self.registry.stats()
+        self.assertEqual(list(stats["resident_models"]), ["A", "C"])
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["resident_memory_bytes"], 800)
+
+    def test_concurrent_first_requests_share_one_load(self):
+        threads = [
+            threading.Thread(target=self.registry.get, args=("B",)) for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.loaded_paths, ["path/b"])
+        self.assertEqual(self.registry.stats()["loads"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
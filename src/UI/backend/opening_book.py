@@ -0,0 +1,274 @@
+"""
+Opening Book
+------------
+
+For the first plies of a game the answers of a model at the backend's near-zero temperature are
+effectively a fixed function of the game history. The opening book stores these answers for the
+most common openings of a corpus, so the backend can answer them without running the model.
+
+The book of a model is built offline: the openings of a PGN or xLAN+ corpus are counted up to
+`max_plies`, and the model answers the most common ones in large batches. Only legal answers are
+stored. The book is keyed by a hash of the model input (the xLAN+ history), because the model's
+answer depends on the move order and not only on the position. Every book records a fingerprint of
+the checkpoint it was built from and is ignored if the served checkpoint is different, so a
+retrained model never answers from a stale book.
+
+Usage:
+    python -m src.UI.backend.opening_book --model "GPT2 19k" --games games.pgn --max-plies 12 \
+        --output books/GPT2_19k.json
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import Counter
+
+import chess
+import chess.pgn
+
+import src.notation_converter as converter
+
+logger = logging.getLogger(__name__)
+
+START_FEN = chess.STARTING_FEN
+
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+
+
+def book_key(input_string):
+    """
+    Returns the key of a model input in the book: the first 8 bytes of its BLAKE2 hash as hex.
+    """
+    return hashlib.blake2b(input_string.encode(), digest_size=8).hexdigest()
+
+
+def checkpoint_version(model_path):
+    """
+    Returns a fingerprint of the weights of a checkpoint, either a local folder or a Hugging Face
+    repository (which is downloaded to the local cache if needed).
+    """
+    folder = model_path
+    if not os.path.isdir(model_path):
+        from huggingface_hub import snapshot_download
+
+        folder = snapshot_download(
+            model_path, allow_patterns=["*.safetensors", "*.bin", "*.json"]
+        )
+
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(folder)):
+        if name.endswith((".safetensors", ".bin")):
+            with open(os.path.join(folder, name), "rb") as file:
+                for chunk in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def read_games(path):
+    """
+    Yields the games of a corpus as lists of UCI moves. Files ending in ".pgn" are read as PGN,
+    all other files as one game in xLAN+ per line, like the output of `pgn_to_xlan` with
+    `xLanPlus`. Move numbers ("1.") and results ("1-0") of the lines are skipped.
+    """
+    with open(path) as file:
+        if path.endswith(".pgn"):
+            while True:
+                game = chess.pgn.read_game(file)
+                if game is None:
+                    break
+                yield [move.uci() for move in game.mainline_moves()]
+        else:
+            for line in file:
+                moves = [
+                    move
+                    for move in line.split()
+                    if not move.endswith(".") and move not in RESULTS
+                ]
+                if moves:
+                    yield converter.xlanplus_sequence_to_uci(" ".join(moves)).split()
+
+
+def count_openings(games, max_plies=12):
+    """
+    Counts how often every opening up to `max_plies` occurs in the games.
+
+    Returns:
+    tuple: A Counter of the model inputs (the xLAN+ histories, the start position as FEN) and a dict
+    mapping every model input to its position in FEN.
+    """
+    counts = Counter()
+    positions = {START_FEN: START_FEN}
+    for uci_moves in games:
+        board = chess.Board()
+        counts[START_FEN] += 1
+        moves = []
+        for uci_move in uci_moves[:max_plies]:
+            moves.append(converter.uci_move_to_xlanplus(board, uci_move))
+            board.push_uci(uci_move)
+            history = " ".join(moves)
+            counts[history] += 1
+            positions.setdefault(history, board.fen())
+    return counts, positions
+
+
+def build_book(
+    model,
+    model_name,
+    model_path,
+    games,
+    max_plies=12,
+    min_count=2,
+    max_positions=100000,
+    batch_size=256,
+):
+    """
+    Builds the opening book of a model from the openings of a corpus.
+
+    Args:
+    model (torch.nn.Module): The model.
+    model_name (str): The name of the model in the backend, e.g. "GPT2 19k".
+    model_path (str): The checkpoint of the model, used for the version of the book.
+    games (Iterable[list[str]]): The games of the corpus as UCI moves, see `read_games`.
+    max_plies (int): The number of plies covered by the book. Default is 12.
+    min_count (int): Openings that occur less often are left out. Default is 2.
+    max_positions (int): Maximum number of openings in the book. Default is 100000.
+    batch_size (int): The number of openings answered by one batched generation. Default is 256.
+
+    Returns:
+    dict: The book, ready to be saved as JSON.
+    """
+    from src.UI.backend.chess_engine import generate_moves, process_prediction
+
+    counts, positions = count_openings(games, max_plies)
+    openings = [
+        history
+        for history, count in counts.most_common(max_positions)
+        if count >= min_count
+    ]
+
+    moves = {}
+    for start in range(0, len(openings), batch_size):
+        batch = openings[start : start + batch_size]
+        predictions = generate_moves(batch, model)
+        for history, prediction in zip(batch, predictions):
+            board = chess.Board(positions[history])
+            try:
+                move = process_prediction(prediction, board)
+                legal = chess.Move.from_uci(move) in board.legal_moves
+            except ValueError:
+                legal = False
+            if legal:
+                moves[book_key(history)] = move
+        logger.info(f"Answered {start + len(batch)} of {len(openings)} openings")
+
+    return {
+        "model": model_name,
+        "checkpoint": model_path,
+        "version": checkpoint_version(model_path),
+        "max_plies": max_plies,
+        "moves": moves,
+    }
+
+
+class OpeningBooks:
+    """
+    The opening books of the served models. The books are loaded on first use, and a book is only
+    used if it was built from the checkpoint that is served.
+
+    Attributes:
+    - book_dir (str): Folder with one book per model, as written by `build_book`. None disables the books.
+    - model_paths (dict[str, str]): Maps the model names to their checkpoints.
+
+    Example:
+        >>> books = OpeningBooks("./books", {"GPT2 19k": "Leon-LLM/R1_GPT2_19k_4E_xLANplus"})
+        >>> move = books.lookup("GPT2 19k", "Pe2e4- Pe7e5-")
+    """
+
+    def __init__(self, book_dir, model_paths):
+        self.book_dir = book_dir
+        self.model_paths = model_paths
+        self.books = None
+        self.lock = threading.Lock()
+        self.hits = 0
+
+    def load(self):
+        """
+        Reads all books of `book_dir` and keeps those that match the version of their checkpoint.
+        """
+        books = {}
+        for name in sorted(os.listdir(self.book_dir)):
+            if not name.endswith(".json"):
+                continue
+            with open(os.path.join(self.book_dir, name)) as file:
+                book = json.load(file)
+            model_path = self.model_paths.get(book["model"])
+            if model_path is None:
+                continue
+            if book["version"] != checkpoint_version(model_path):
+                logger.warning(
+                    f"Ignoring the opening book {name}, it was built for another checkpoint"
+                )
+                continue
+            books[book["model"]] = book
+        return books
+
+    def ensure_loaded(self):
+        """
+        Loads the books if this has not happened yet. Loading hashes the checkpoints, so the server
+        calls this at startup instead of on the first request.
+        """
+        if self.books is None:
+            with self.lock:
+                if self.books is None:
+                    self.books = self.load() if self.book_dir else {}
+        return self.books
+
+    def lookup(self, model_name, input_string):
+        """
+        Returns the book move in UCI format for the model input, or None if it is not in the book.
+        """
+        book = self.ensure_loaded().get(model_name)
+        if book is None:
+            return None
+        move = book["moves"].get(book_key(input_string))
+        if move is not None:
+            self.hits += 1
+        return move
+
+
+if __name__ == "__main__":
+    from src.UI.backend.chess_engine import get_model, models
+
+    parser = argparse.ArgumentParser(description="Build the opening book of a model.")
+    parser.add_argument("--model", required=True, help="The name of the model.")
+    parser.add_argument("--games", nargs="+", required=True, help="PGN or xLAN+ files.")
+    parser.add_argument("--output", required=True, help="The book file to write.")
+    parser.add_argument("--max-plies", type=int, default=12, help="Plies in the book.")
+    parser.add_argument(
+        "--min-count", type=int, default=2, help="Minimum occurrences of an opening."
+    )
+    parser.add_argument(
+        "--max-positions", type=int, default=100000, help="Maximum book size."
+    )
+    parser.add_argument("--batch-size", type=int, default=256, help="Batch size.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    games = (game for path in args.games for game in read_games(path))
+    book = build_book(
+        get_model(args.model),
+        args.model,
+        models[args.model],
+        games,
+        args.max_plies,
+        args.min_count,
+        args.max_positions,
+        args.batch_size,
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as file:
+        json.dump(book, file)
+    print(f"Wrote {len(book['moves'])} book moves to {args.output}")
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.UI.backend.opening_book import (
+    START_FEN,
+    OpeningBooks,
+    book_key,
+    checkpoint_version,
+    count_openings,
+    read_games,
+)
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+
+
+class OpeningBookTest(unittest.TestCase):
+    def test_openings_are_counted_by_model_input(self):
+        counts, positions = count_openings(
+            [["e2e4", "e7e5", "g1f3"], ["e2e4", "c7c5"]], max_plies=2
+        )
+        self.assertEqual(counts[START_FEN], 2)
+        self.assertEqual(counts["Pe2e4-"], 2)
+        self.assertEqual(counts["Pe2e4- Pe7e5-"], 1)
+        self.assertNotIn("Pe2e4- Pe7e5- Ng1f3-", counts)
+        self.assertEqual(
+            positions["Pe2e4- Pc7c5-"],
+            "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+        )
+
+    def test_games_are_read_from_xlanplus_corpus(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlanplus")
+            with open(input_path, "w") as file:
+                for moves in [
+                    "1. g3 e6 2. Bg2 Qf6 3. f4 Bc5 4. e4 Qd4 5. e5 Qf2# 0-1",
+                    "1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0",
+                ]:
+                    file.write(
+                        f'[Event "Rated Blitz game"]\n[Result "{moves.split()[-1]}"]\n\n'
+                    )
+                    file.write(f"{moves}\n\n")
+            pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2, xLanPlus=True
+            ).convert_pgn()
+            with open(output_path) as file:
+                self.assertTrue(file.readline().startswith("1. Pg2g3- Pe7e6- 2. "))
+
+            self.assertEqual(
+                list(read_games(output_path)), list(read_games(input_path))
+            )
+            counts, _ = count_openings(read_games(output_path), max_plies=2)
+            self.assertEqual(counts["Pg2g3- Pe7e6-"], 1)
+            self.assertEqual(counts["Pe2e4- Pe7e5-"], 1)
+
+    def test_book_of_another_checkpoint_is_ignored(self):
+        with tempfile.TemporaryDirectory() as directory:
+            model_dir = os.path.join(directory, "model")
+            book_dir = os.path.join(directory, "books")
+            os.makedirs(model_dir)
+            os.makedirs(book_dir)
+            weights = os.path.join(model_dir, "model.safetensors")
+            with open(weights, "wb") as file:
+                file.write(b"weights")
+
+            book = {
+                "model": "GPT2",
+                "version": checkpoint_version(model_dir),
+                "max_plies": 2,
+                "moves": {book_key("Pe2e4-"): "c7c5"},
+            }
+            with open(os.path.join(book_dir, "GPT2.json"), "w") as file:
+                json.dump(book, file)
+
+            books = OpeningBooks(book_dir, {"GPT2": model_dir})
+            self.assertEqual(books.lookup("GPT2", "Pe2e4-"), "c7c5")
+            self.assertIsNone(books.lookup("GPT2", "Pd2d4-"))
+
+            with open(weights, "wb") as file:
+                file.write(b"retrained weights")
+            books = OpeningBooks(book_dir, {"GPT2": model_dir})
+            self.assertIsNone(books.lookup("GPT2", "Pe2e4-"))
+
+
+if __name__ == "__main__":
+    unittest.main()
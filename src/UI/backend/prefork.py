@@ -0,0 +1,146 @@
+"""
+Pre-fork Model Serving
+----------------------
+
+Running the backend with several uvicorn workers starts a fresh interpreter per worker, and every
+worker loads all models again, so the memory grows with the number of workers. In the pre-fork mode
+the parent process loads all models once, opens the listening socket and then forks the workers.
+Inference never writes to the weights, so the workers share their pages copy-on-write with the
+parent. All workers accept connections on the same socket and the kernel distributes the requests
+among them.
+
+Every worker keeps its own request batcher, Stockfish engine, metrics and game sessions. A game
+session is only known to the worker that created it, so sessions need a single worker (or a proxy
+with sticky connections in front of the workers).
+
+Usage:
+    python -m src.UI.backend.prefork --workers 4 --port 8000
+"""
+
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+
+import torch
+import uvicorn
+
+from src.UI.backend.chess_engine import registry, warm_up
+from src.UI.backend.server import app
+
+logger = logging.getLogger(__name__)
+
+
+def load_shared_models():
+    """
+    Loads and warms up all models in the parent process and prepares them for sharing with the
+    workers. The engine is started by every worker itself.
+    """
+    warm_up(start_engine=False)
+    for model in registry.models.values():
+        model.eval()
+        model.requires_grad_(False)
+    stats = registry.stats()
+    if len(stats["resident_models"]) < len(registry.model_paths):
+        logger.warning(
+            "Not all models fit into the memory budget, evicted models are loaded by every worker"
+        )
+    # objects that survive until the fork are never collected again, so the garbage collector
+    # does not write to (and thereby copy) their pages in the workers
+    gc.collect()
+    gc.freeze()
+
+
+def run_worker(sock, num_threads, log_level):
+    """
+    Serves the backend on the shared socket. Runs in a forked worker process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    torch.set_num_threads(num_threads)
+
+    config = uvicorn.Config(app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def fork_worker(sock, num_threads, log_level):
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            run_worker(sock, num_threads, log_level)
+        except BaseException:
+            logger.exception("Worker failed")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def serve(host="127.0.0.1", port=8000, workers=None, log_level="info"):
+    """
+    Loads the models once and serves the backend with forked workers. Workers that die are replaced
+    until the parent receives SIGINT or SIGTERM, which it forwards to the workers.
+
+    Args:
+    host (str): The host to bind. Default is "127.0.0.1".
+    port (int): The port to bind. Default is 8000.
+    workers (int): The number of worker processes. Default is the number of CPU cores.
+    log_level (str): The log level of uvicorn. Default is "info".
+    """
+    workers = workers or os.cpu_count() or 1
+    # the cores are divided among the workers instead of every worker using all of them
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    load_shared_models()
+    sock = socket.create_server((host, port), backlog=2048)
+
+    shutting_down = False
+    worker_pids = set()
+
+    def shutdown(signum, frame):
+        nonlocal shutting_down
+        shutting_down = True
+        for pid in worker_pids:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for _ in range(workers):
+        worker_pids.add(fork_worker(sock, num_threads, log_level))
+    logger.info(f"Serving on http://{host}:{port} with {workers} workers")
+
+    while worker_pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        worker_pids.discard(pid)
+        if not shutting_down:
+            logger.warning(f"Worker {pid} exited with status {status}, restarting it")
+            worker_pids.add(fork_worker(sock, num_threads, log_level))
+    sock.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serve the backend with forked workers sharing the model weights."
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="The host to bind.")
+    parser.add_argument("--port", type=int, default=8000, help="The port to bind.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("LEON_WORKERS", "0")),
+        help="The number of worker processes (default: number of CPU cores).",
+    )
+    parser.add_argument("--log-level", default="info", help="The log level.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    serve(args.host, args.port, args.workers, args.log_level)
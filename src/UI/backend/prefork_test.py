@@ -0,0 +1,65 @@
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import unittest
+
+import httpx
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from src.UI.backend.loadtest import free_port, start_server
+
+
+def child_pids(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as file:
+        return [int(child) for child in file.read().split()]
+
+
+@unittest.skipUnless(
+    sys.platform.startswith("linux"), "needs os.fork and the children of /proc"
+)
+class PreforkTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.model_dir)
+        GPT2LMHeadModel(
+            GPT2Config(vocab_size=82, n_layer=2, n_head=2, n_embd=32)
+        ).save_pretrained(self.model_dir)
+
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}/ready"
+        self.process = start_server({"Tiny GPT2": self.model_dir}, port, workers=2)
+        self.addCleanup(self.kill_server)
+
+    def kill_server(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def test_workers_share_the_socket_and_shut_down_cleanly(self):
+        workers = child_pids(self.process.pid)
+        self.assertEqual(len(workers), 2)
+
+        # with the other worker stopped, every request is answered by the remaining one
+        for stopped in workers:
+            os.kill(stopped, signal.SIGSTOP)
+            try:
+                for _ in range(3):
+                    response = httpx.get(self.url, timeout=10)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.json()["models"], ["Tiny GPT2"])
+            finally:
+                os.kill(stopped, signal.SIGCONT)
+
+        self.process.send_signal(signal.SIGTERM)
+        self.assertEqual(self.process.wait(timeout=30), 0)
+        for pid in workers:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
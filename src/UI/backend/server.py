@@ -1,14 +1,83 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from pydantic import BaseModel, ValidationError
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+import json
+import logging
 import sys
 import os
+import threading
+import time
 
 ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
 sys.path.insert(0, ROOT_DIR)
-from src.UI.backend.chess_engine import get_stockfish_move, get_LLL_move
+from src.UI.backend.chess_engine import (
+    get_stockfish_move,
+    get_LLL_moves,
+    books,
+    check_model,
+    lookup_book,
+    prepare_LLL_request,
+    play_session_moves,
+    predict_batch,
+    process_prediction,
+    quit_engine,
+    stream_session_moves,
+    registry,
+    warm_up,
+    warmed_up,
+)
+from src.UI.backend.batching import MoveBatcher
+from src.UI.backend.metrics import (
+    current_trace,
+    render_histograms,
+    render_metric,
+    request_durations,
+)
+from src.UI.backend.sessions import SessionStore
+
+logger = logging.getLogger(__name__)
+
+# Log the stage timings of every request (LEON_TRACE_REQUESTS=1)
+TRACE_REQUESTS = os.environ.get("LEON_TRACE_REQUESTS", "0") == "1"
+
+# Load and warm up all models in the background at startup (LEON_WARMUP=0 disables it)
+WARMUP = os.environ.get("LEON_WARMUP", "1") == "1"
+
+# Requests for the same model arriving within BATCH_MAX_WAIT_MS are answered by one generation
+BATCH_MAX_SIZE = int(os.environ.get("LEON_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("LEON_BATCH_MAX_WAIT_MS", "5"))
+
+batcher = MoveBatcher(
+    predict_batch, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS
+)
+
+# Items of a /get_moves request are generated in batches of this size per model
+GET_MOVES_CHUNK_SIZE = int(os.environ.get("LEON_GET_MOVES_CHUNK_SIZE", "64"))
+
+# Game sessions keep board, tokens and model cache of a game between requests
+sessions = SessionStore(
+    ttl=float(os.environ.get("LEON_SESSION_TTL_S", "1800")),
+    max_sessions=int(os.environ.get("LEON_MAX_SESSIONS", "1000")),
+    use_cache=os.environ.get("LEON_SESSION_CACHE", "1") == "1",
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the server accepts requests right away, /ready reports when the warmup is done
+    if WARMUP:
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    else:
+        warmed_up.set()
+    yield
+    await batcher.close()
+    quit_engine()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,6 +88,42 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def trace_request(request: Request, call_next):
+    """
+    Times every request and records the stage timings of its trace, see `metrics.timed`.
+
+    The middleware is a `BaseHTTPMiddleware`, so `call_next` returns as soon as the response headers
+    are sent: a `StreamingResponse`, e.g. of /get_moves with `stream`, is only timed up to then, not
+    until its last line is sent.
+    """
+    trace = {}
+    token = current_trace.set(trace)
+    start_time = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_trace.reset(token)
+    elapsed_time = time.perf_counter() - start_time
+
+    # label by route template, so that session IDs do not create new series
+    route = request.scope.get("route")
+    endpoint = f"{request.method} {route.path}" if route else "unmatched"
+    request_durations.observe(elapsed_time, endpoint)
+    if TRACE_REQUESTS:
+        logger.info(
+            json.dumps(
+                {
+                    "endpoint": endpoint,
+                    "status": response.status_code,
+                    "total": elapsed_time,
+                    **trace,
+                }
+            )
+        )
+    return response
+
+
 class Sequences(BaseModel):
     fen: str
     history: str
@@ -27,14 +132,254 @@ class Sequences(BaseModel):
 
 @app.post("/get_move")
 async def get_move(sequences: Sequences):
-    print(f"Received request {sequences}")
+    logger.debug(f"Received request {sequences}")
     if sequences.model == "stockfish":
         move = get_stockfish_move(sequences.fen)
-        print(f"Stockfish move: {move}")
+        logger.debug(f"Stockfish move: {move}")
     else:
-        move = get_LLL_move(sequences.fen, sequences.history, sequences.model)
-        print(f"LLL move: {move}")
+        check_model(sequences.model)
+        board, input_string = prepare_LLL_request(sequences.fen, sequences.history)
+        move = lookup_book(sequences.model, input_string)
+        if not move:
+            prediction = await batcher.submit(sequences.model, input_string)
+            move = process_prediction(prediction, board)
+        logger.debug(f"LLL move: {move}")
 
     if not move:
         raise HTTPException(status_code=404, detail="Move could not be generated")
     return {"move": move}
+
+
+class SequencesBatch(BaseModel):
+    items: list[Sequences]
+    stream: bool = False
+
+
+async def solve_moves(items):
+    """
+    Generates the moves for a list of requests, grouped by model and in batches of
+    GET_MOVES_CHUNK_SIZE. Yields (index, result) pairs as soon as a batch is done, where
+    result is either {"move": ...} or {"error": ...}.
+    """
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(item.model, []).append(index)
+
+    for model_name, indices in groups.items():
+        if model_name == "stockfish":
+            for index in indices:
+                try:
+                    move = await run_in_threadpool(get_stockfish_move, items[index].fen)
+                    yield index, {"move": move}
+                except Exception as e:
+                    yield index, {"error": f"Invalid position: {e}"}
+            continue
+        if model_name not in registry:
+            for index in indices:
+                yield index, {"error": "Model not found"}
+            continue
+
+        for start in range(0, len(indices), GET_MOVES_CHUNK_SIZE):
+            chunk = indices[start : start + GET_MOVES_CHUNK_SIZE]
+            requests = [(items[index].fen, items[index].history) for index in chunk]
+            try:
+                results = await run_in_threadpool(get_LLL_moves, requests, model_name)
+            except Exception as e:
+                results = [{"error": f"Generation failed: {e}"}] * len(chunk)
+            for index, result in zip(chunk, results):
+                yield index, result
+
+
+@app.post("/get_moves")
+async def get_moves(batch: SequencesBatch):
+    logger.debug(f"Received batch of {len(batch.items)} requests")
+    if batch.stream:
+        # one JSON object per line, in the order in which the moves are done
+        async def stream_results():
+            async for index, result in solve_moves(batch.items):
+                yield json.dumps({"index": index, **result}) + "\n"
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    results = [None] * len(batch.items)
+    async for index, result in solve_moves(batch.items):
+        results[index] = {"index": index, **result}
+    return {"results": results}
+
+
+class SessionRequest(BaseModel):
+    model: str
+    history: str = ""
+
+
+class SessionMoves(BaseModel):
+    moves: list[str] = []
+    reply: bool = True
+    stockfish: bool = False
+
+
+def get_session(session_id):
+    try:
+        return sessions.get(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+
+@app.post("/sessions")
+async def create_session(request: SessionRequest):
+    try:
+        check_model(request.model)
+        session = await run_in_threadpool(
+            sessions.create, request.model, request.history
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"session_id": session.session_id, "fen": session.board.fen()}
+
+
+@app.post("/sessions/{session_id}/moves")
+async def play_moves(session_id: str, request: SessionMoves):
+    session = get_session(session_id)
+    try:
+        move, legal = await run_in_threadpool(
+            play_session_moves,
+            session,
+            request.moves,
+            request.reply,
+            request.stockfish,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"move": move, "legal": legal, "fen": session.board.fen()}
+
+
+class GameStart(BaseModel):
+    model: str = ""
+    history: str = ""
+    session_id: str = ""
+
+
+class GameMoves(SessionMoves):
+    top_k: int = 5
+
+
+async def open_game(start):
+    """
+    Resumes the session of a game, or opens a new one if no session ID is given.
+    """
+    if start.session_id:
+        return sessions.get(start.session_id)
+    if start.model != "stockfish":
+        check_model(start.model)
+    return await run_in_threadpool(sessions.create, start.model, start.history)
+
+
+@app.websocket("/games")
+async def play_game(websocket: WebSocket):
+    """
+    Persistent connection for one game. The first message opens the session,
+    {"model": ..., "history": <optional PGN>}, or resumes one, {"session_id": ...}, and is answered
+    with {"type": "session", "session_id": ..., "fen": ...}. Every further message,
+    {"moves": [<new UCI moves>], "reply": true, "stockfish": false, "top_k": 5}, is answered with the
+    events of `stream_session_moves` as they are computed. Errors are sent as {"type": "error"}.
+    """
+    await websocket.accept()
+    session = None
+    try:
+        while True:
+            message = await websocket.receive_json()
+            try:
+                if session is None:
+                    session = await open_game(GameStart(**message))
+                    await websocket.send_json(
+                        {
+                            "type": "session",
+                            "session_id": session.session_id,
+                            "fen": session.board.fen(),
+                        }
+                    )
+                    continue
+
+                request = GameMoves(**message)
+                events = stream_session_moves(
+                    session,
+                    request.moves,
+                    request.reply,
+                    request.stockfish,
+                    request.top_k,
+                )
+                try:
+                    async for event in iterate_in_threadpool(events):
+                        await websocket.send_json(event)
+                finally:
+                    await run_in_threadpool(events.close)
+            except KeyError:
+                await websocket.send_json(
+                    {"type": "error", "detail": "Session not found"}
+                )
+            except (ValueError, ValidationError) as e:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.delete("/sessions/{session_id}")
+async def close_session(session_id: str):
+    sessions.close(session_id)
+    return {"session_id": session_id}
+
+
+@app.get("/models")
+async def get_models():
+    return {"models": list(registry.model_paths), **registry.stats()}
+
+
+@app.get("/ready")
+async def get_ready():
+    """
+    Readiness probe: 503 while the models are warming up, 200 afterwards.
+    """
+    if not warmed_up.is_set():
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"ready": True, "models": list(registry.stats()["resident_models"])}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Stage and request latencies, batch sizes, model registry and session metrics in the
+    Prometheus text format.
+    """
+    stats = registry.stats()
+    lines = render_histograms()
+    for name in ("hits", "misses", "loads", "evictions"):
+        lines += render_metric(
+            f"leon_model_{name}_total",
+            "counter",
+            f"Model registry {name}.",
+            stats[name],
+        )
+    lines += render_metric(
+        "leon_model_load_seconds_total",
+        "counter",
+        "Time spent loading models.",
+        stats["load_seconds"],
+    )
+    lines += render_metric(
+        "leon_model_resident_bytes",
+        "gauge",
+        "Memory of the resident models.",
+        {f'model="{name}"': size for name, size in stats["resident_models"].items()},
+    )
+    lines += render_metric(
+        "leon_opening_book_hits_total",
+        "counter",
+        "Moves answered from an opening book.",
+        books.hits,
+    )
+    lines += render_metric(
+        "leon_sessions_open", "gauge", "Open game sessions.", len(sessions)
+    )
+    return PlainTextResponse(
+        "\n".join(lines) + "\n", media_type="text/plain; version=0.0.4"
+    )
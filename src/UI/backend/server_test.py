@@ -0,0 +1,130 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import chess
+import torch
+from fastapi.testclient import TestClient
+from transformers import GPT2Config, GPT2LMHeadModel
+
+from src.UI.backend import chess_engine, server
+from src.UI.backend.model_registry import ModelRegistry
+
+START = chess.STARTING_FEN
+AFTER_E4_E5 = "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2"
+
+
+class GetMovesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        torch.manual_seed(0)
+        cls.model_dir = tempfile.mkdtemp()
+        GPT2LMHeadModel(
+            GPT2Config(vocab_size=82, n_layer=2, n_head=2, n_embd=32)
+        ).save_pretrained(cls.model_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.model_dir)
+
+    def setUp(self):
+        # the lifespan is not run, so neither the models nor the engine are warmed up
+        registry = ModelRegistry({"Tiny GPT2": self.model_dir})
+        engine_command = f"{sys.executable} -m src.UI.backend.stub_engine"
+        for patch in (
+            mock.patch.object(chess_engine, "registry", registry),
+            mock.patch.object(server, "registry", registry),
+            mock.patch.dict(os.environ, {"LEON_ENGINE_COMMAND": engine_command}),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(chess_engine.quit_engine)
+        self.client = TestClient(server.app)
+
+    def get_moves(self, items, **kwargs):
+        response = self.client.post("/get_moves", json={"items": items, **kwargs})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def assert_result_shape(self, result, index):
+        self.assertEqual(result["index"], index)
+        self.assertEqual(len(result), 2)
+        self.assertTrue("move" in result or "error" in result)
+
+    def test_results_have_one_entry_per_item(self):
+        items = [{"fen": START, "history": "", "model": "Tiny GPT2"}]
+        results = self.get_moves(items).json()["results"]
+
+        self.assertEqual(len(results), 1)
+        self.assert_result_shape(results[0], 0)
+
+    def test_batch_of_several_games(self):
+        items = [
+            {"fen": START, "history": "", "model": "Tiny GPT2"},
+            {"fen": AFTER_E4_E5, "history": "1. e4 e5", "model": "Tiny GPT2"},
+            {"fen": AFTER_E4_E5, "history": "1. e4 e5", "model": "stockfish"},
+            {"fen": "invalid", "history": "", "model": "Tiny GPT2"},
+            {"fen": "invalid", "history": "", "model": "stockfish"},
+            {"fen": START, "history": "", "model": "Unknown"},
+        ]
+        results = self.get_moves(items).json()["results"]
+
+        self.assertEqual(len(results), len(items))
+        for index, result in enumerate(results):
+            self.assert_result_shape(result, index)
+        move = chess.Move.from_uci(results[2]["move"])
+        self.assertIn(move, chess.Board(AFTER_E4_E5).legal_moves)
+        self.assertTrue(results[3]["error"].startswith("Invalid position"))
+        self.assertTrue(results[4]["error"].startswith("Invalid position"))
+        self.assertEqual(results[5]["error"], "Model not found")
+
+        # a game gets the same move in a batch as on its own
+        for index in (0, 1):
+            alone = self.get_moves([items[index]]).json()["results"][0]
+            self.assertEqual(alone, {**results[index], "index": 0})
+
+    def test_batch_is_split_into_chunks(self):
+        items = [
+            {"fen": START, "history": "", "model": "Tiny GPT2"},
+            {"fen": "invalid", "history": "", "model": "Tiny GPT2"},
+            {"fen": AFTER_E4_E5, "history": "1. e4 e5", "model": "Tiny GPT2"},
+        ]
+        results = self.get_moves(items).json()["results"]
+        with mock.patch.object(server, "GET_MOVES_CHUNK_SIZE", 2):
+            self.assertEqual(self.get_moves(items).json()["results"], results)
+
+    def test_streamed_results_cover_every_item_once(self):
+        items = [
+            {"fen": START, "history": "", "model": "Tiny GPT2"},
+            {"fen": AFTER_E4_E5, "history": "1. e4 e5", "model": "stockfish"},
+            {"fen": START, "history": "", "model": "Unknown"},
+        ]
+        response = self.get_moves(items, stream=True)
+        self.assertTrue(
+            response.headers["content-type"].startswith("application/x-ndjson")
+        )
+        results = [json.loads(line) for line in response.text.splitlines()]
+
+        self.assertEqual(sorted(result["index"] for result in results), [0, 1, 2])
+        for result in results:
+            self.assert_result_shape(result, result["index"])
+
+    def test_get_LLL_moves_returns_one_result_per_request(self):
+        requests = [(START, ""), ("invalid", ""), (AFTER_E4_E5, "1. e4 e5")]
+        results = chess_engine.get_LLL_moves(requests, "Tiny GPT2")
+
+        self.assertEqual(len(results), len(requests))
+        self.assertTrue(results[1]["error"].startswith("Invalid position"))
+        for request, result in zip(requests, results):
+            self.assertTrue("move" in result or "error" in result)
+            self.assertEqual(
+                chess_engine.get_LLL_moves([request], "Tiny GPT2"), [result]
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
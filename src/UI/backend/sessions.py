@@ -0,0 +1,233 @@
+"""
+Game Sessions
+-------------
+
+Without a session every request sends the full PGN of the game, which the backend parses,
+replays and converts to xLAN+ and tokens again before the model sees it. A game session keeps the
+board, the xLAN+ moves, the token IDs and the model cache of one game on the server. The client
+only sends the new moves, so the work per request no longer grows with the length of the game.
+Sessions that are not used for a while are evicted.
+"""
+
+import io
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import chess
+import chess.pgn
+
+import src.notation_converter as converter
+from src.generate_prediction import (
+    forward_with_cache,
+    generate_candidates,
+    generate_with_cache,
+)
+from src.tokenizer.detokenizer import detokenize_data
+from src.tokenizer.tokenizer import load_tokens, tokenize_move
+
+
+class GameSession:
+    """
+    State of one game between a client and a model.
+
+    The model cache covers `token_ids[:cached_length]` and `logits` are the logits for the token after
+    them. New moves are only appended to `token_ids`; they are run through the model with the next
+    prediction.
+
+    Attributes:
+    - session_id (str): The ID of the session.
+    - model_name (str): The name of the model playing in this session.
+    - notation (str): The notation of the model. Default is "xLANplus".
+    - use_cache (bool): Whether to keep the model cache between requests. Default is True.
+    """
+
+    def __init__(self, session_id, model_name, notation="xLANplus", use_cache=True):
+        self.session_id = session_id
+        self.model_name = model_name
+        self.notation = notation
+        self.use_cache = use_cache
+
+        self.board = chess.Board()
+        self.moves = []
+        self.token_ids = [load_tokens(notation)["paddingToken"]["STARTSEQ"]]
+        self.cache = None
+        self.logits = None
+        self.cached_length = 0
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+    def push_history(self, history):
+        """
+        Replays a game given in PGN, e.g. when a session is created in the middle of a game.
+        A game set up from a FEN starts from that position.
+        """
+        game = chess.pgn.read_game(io.StringIO(history))
+        if game is None:
+            return
+        if not self.moves:
+            self.board = game.board()
+        for move in game.mainline_moves():
+            self.push_move(move.uci())
+
+    def push_move(self, uci_move):
+        """
+        Plays a move on the board and appends its tokens to the model input.
+
+        Args:
+        uci_move (str): The move in UCI format, e.g. "e2e4".
+
+        Returns:
+        str: The move in xLAN+ format, e.g. "Pe2e4-".
+
+        Raises:
+        ValueError: If the move is not legal in the current position.
+        """
+        try:
+            move = chess.Move.from_uci(uci_move)
+        except ValueError:
+            raise ValueError(f"Invalid move: {uci_move}")
+        if move not in self.board.legal_moves:
+            raise ValueError(f"Illegal move: {uci_move}")
+
+        xlanplus_move = converter.uci_move_to_xlanplus(self.board, uci_move)
+        self.board.push(move)
+        self.moves.append(xlanplus_move)
+        self.token_ids.extend(tokenize_move(xlanplus_move, self.notation))
+        return xlanplus_move
+
+    def predict_move(self, model, temperature=0.01, num_tokens_to_generate=3):
+        """
+        Lets the model predict the next move. Only the tokens that are not covered by the model cache
+        yet are run through the model. The predicted move is not played.
+
+        Args:
+        model (torch.nn.Module): The model of this session.
+        temperature (float): The temperature setting for the generation. Default is 0.01.
+        num_tokens_to_generate (int): The number of tokens to generate. Default is 3 (one move without indicator).
+
+        Returns:
+        str: The predicted move in UCI format. It might be illegal.
+        """
+        logits, cache = self.forward(model)
+        generated_tokens = generate_with_cache(
+            model, logits, cache, num_tokens_to_generate, temperature
+        )
+        prediction = detokenize_data(
+            " ".join(map(str, generated_tokens)), notation=self.notation
+        )
+        last_move = prediction.split(" ")[-1]
+        return converter.xlanplus_move_to_uci(self.board, last_move)[0]
+
+    def candidate_moves(self, model, top_k=5):
+        """
+        Scores the legal moves with the model, see `generate_candidates`. The moves are not played.
+
+        Args:
+        model (torch.nn.Module): The model of this session.
+        top_k (int): The number of candidates. Default is 5.
+
+        Yields:
+        list: The best legal moves found so far as (UCI move, probability), most probable first.
+        """
+        logits, cache = self.forward(model)
+        candidate_tokens = {
+            move.uci(): tuple(
+                tokenize_move(
+                    converter.uci_move_to_xlan(self.board, move.uci()), self.notation
+                )
+            )
+            for move in self.board.legal_moves
+        }
+        yield from generate_candidates(model, logits, cache, candidate_tokens, top_k)
+
+    def forward(self, model):
+        """
+        Runs the tokens that are not covered by the model cache yet through the model.
+
+        Returns:
+        tuple: The logits for the next token and the cache of all tokens.
+        """
+        if not self.use_cache:
+            return forward_with_cache(model, self.token_ids)
+        new_tokens = self.token_ids[self.cached_length :]
+        if new_tokens:
+            self.logits, self.cache = forward_with_cache(model, new_tokens, self.cache)
+            self.cached_length = len(self.token_ids)
+        return self.logits, self.cache
+
+    def is_legal(self, uci_move):
+        try:
+            return chess.Move.from_uci(uci_move) in self.board.legal_moves
+        except ValueError:
+            return False
+
+
+class SessionStore:
+    """
+    Keeps the game sessions of the backend and evicts sessions that were not used for `ttl` seconds.
+    If more than `max_sessions` sessions are open, the least recently used ones are evicted as well.
+
+    Attributes:
+    - ttl (float): Time in seconds after which an unused session is evicted. Default is 1800.
+    - max_sessions (int): Maximum number of open sessions. Default is 1000.
+    - use_cache (bool): Whether sessions keep their model cache between requests. Default is True.
+    """
+
+    def __init__(self, ttl=1800, max_sessions=1000, use_cache=True):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.use_cache = use_cache
+        self.sessions = OrderedDict()  # least recently used session first
+        self.lock = threading.Lock()
+
+    def create(self, model_name, history=""):
+        """
+        Opens a new session for a model, optionally starting from a game given in PGN.
+
+        Returns:
+        GameSession: The new session.
+        """
+        session = GameSession(uuid.uuid4().hex, model_name, use_cache=self.use_cache)
+        if history:
+            session.push_history(history)
+
+        with self.lock:
+            self.evict_expired()
+            self.sessions[session.session_id] = session
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        return session
+
+    def get(self, session_id):
+        """
+        Returns an open session and marks it as used.
+
+        Raises:
+        KeyError: If the session does not exist or has expired.
+        """
+        with self.lock:
+            self.evict_expired()
+            session = self.sessions[session_id]
+            session.last_used = time.monotonic()
+            self.sessions.move_to_end(session_id)
+            return session
+
+    def close(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+
+    def evict_expired(self):
+        """
+        Evicts all sessions that were not used for `ttl` seconds. Must be called while holding `self.lock`.
+        """
+        now = time.monotonic()
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if now - session.last_used < self.ttl:
+                break
+            self.sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self.sessions)
@@ -0,0 +1,124 @@
+import io
+import unittest
+
+import chess.pgn
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, MambaConfig, MambaForCausalLM
+
+import src.notation_converter as converter
+from src.generate_prediction import forward_with_cache
+from src.tokenizer.tokenizer import tokenize_data, tokenize_move
+from src.UI.backend.sessions import GameSession, SessionStore
+
+HISTORY = "1. e4 e5 2. Nf3 Nc6 3. Bb5 a6 4. Bxc6 dxc6 5. O-O f6 6. d4 exd4 7. Nxd4 c5 8. Nb3 Qxd1 9. Rxd1"
+
+
+class GameSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.session = GameSession("test", "GPT2")
+        self.session.push_history(HISTORY)
+
+    def test_tokens_match_full_conversion(self):
+        game = chess.pgn.read_game(io.StringIO(HISTORY))
+        uci_moves = [move.uci() for move in game.mainline_moves()]
+        xlanplus = converter.xlan_sequence_to_xlanplus(
+            converter.uci_sequence_to_xlan(" ".join(uci_moves))
+        )
+        token_ids = list(map(int, tokenize_data(xlanplus, "xLANplus").split()))
+
+        self.assertEqual(" ".join(self.session.moves), xlanplus)
+        self.assertEqual(self.session.token_ids, token_ids)
+
+    def test_illegal_move_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.session.push_move("a1a8")
+
+    def test_cached_forward_matches_full_forward(self):
+        torch.manual_seed(0)
+        models = [
+            GPT2LMHeadModel(
+                GPT2Config(vocab_size=82, n_layer=2, n_head=2, n_embd=32)
+            ).eval(),
+            MambaForCausalLM(
+                MambaConfig(vocab_size=82, hidden_size=32, num_hidden_layers=2)
+            ).eval(),
+        ]
+        token_ids = self.session.token_ids
+        for model in models:
+            full_logits, _ = forward_with_cache(model, token_ids)
+            logits, cache = forward_with_cache(model, token_ids[:10])
+            logits, cache = forward_with_cache(model, token_ids[10:], cache)
+            self.assertTrue(torch.allclose(full_logits, logits, atol=1e-5))
+
+    def test_reply_without_new_moves_reuses_cache(self):
+        torch.manual_seed(0)
+        models = [
+            GPT2LMHeadModel(
+                GPT2Config(vocab_size=82, n_layer=2, n_head=2, n_embd=32)
+            ).eval(),
+            MambaForCausalLM(
+                MambaConfig(vocab_size=82, hidden_size=32, num_hidden_layers=2)
+            ).eval(),
+        ]
+        for model in models:
+            session = GameSession("test", "GPT2")
+            session.push_history(HISTORY)
+            full_logits, _ = forward_with_cache(model, session.token_ids)
+            session.predict_move(model)
+            # a reply is requested again without new moves
+            session.predict_move(model)
+            logits, _ = session.forward(model)
+            self.assertEqual(session.cached_length, len(session.token_ids))
+            self.assertTrue(torch.allclose(full_logits, logits, atol=1e-5))
+
+    def test_candidate_moves_are_the_most_probable_legal_moves(self):
+        torch.manual_seed(0)
+        models = [
+            GPT2LMHeadModel(
+                GPT2Config(vocab_size=82, n_layer=2, n_head=2, n_embd=32)
+            ).eval(),
+            MambaForCausalLM(
+                MambaConfig(vocab_size=82, hidden_size=32, num_hidden_layers=2)
+            ).eval(),
+        ]
+        start = len(self.session.token_ids) - 1
+        for model in models:
+            log_probabilities = {}
+            for move in self.session.board.legal_moves:
+                xlan_move = converter.uci_move_to_xlan(self.session.board, move.uci())
+                move_tokens = tokenize_move(xlan_move, "xLANplus")
+                input_ids = torch.tensor([self.session.token_ids + move_tokens[:3]])
+                with torch.no_grad():
+                    logits = torch.log_softmax(model(input_ids).logits[0], dim=-1)
+                log_probabilities[move.uci()] = sum(
+                    logits[start + i, token].item()
+                    for i, token in enumerate(move_tokens[:3])
+                )
+            expected = sorted(log_probabilities, key=log_probabilities.get)[::-1][:3]
+
+            session = GameSession("test", "GPT2")
+            session.push_history(HISTORY)
+            candidates = list(session.candidate_moves(model, top_k=3))[-1]
+            self.assertEqual([move for move, _ in candidates], expected)
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_expired_sessions_are_evicted(self):
+        store = SessionStore(ttl=0)
+        session = store.create("GPT2")
+        with self.assertRaises(KeyError):
+            store.get(session.session_id)
+
+    def test_least_recently_used_session_is_evicted(self):
+        store = SessionStore(max_sessions=2)
+        first = store.create("GPT2")
+        second = store.create("GPT2")
+        store.get(first.session_id)
+        store.create("GPT2")
+        self.assertIs(store.get(first.session_id), first)
+        with self.assertRaises(KeyError):
+            store.get(second.session_id)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+Startup Benchmark
+-----------------
+
+Measures how long it takes to import the chess game and the backend and how long the backend needs
+until it accepts requests and until it is warmed up. Every import is measured in a fresh
+interpreter, together with the heavy modules (torch, transformers, IPython, ...) that the import
+pulled in. The server is started with the stub engine and tiny stub models of the load test, so the
+benchmark runs offline.
+
+The report is printed as JSON. With `--max-import-seconds` and `--max-ready-seconds` the benchmark
+exits with an error once startup regresses beyond these limits.
+
+Usage:
+    python -m src.UI.backend.startup_benchmark
+    python -m src.UI.backend.startup_benchmark --max-import-seconds 1 --max-ready-seconds 30
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from src.UI.backend.loadtest import ROOT_DIR, free_port, write_stub_models
+
+DEFAULT_MODULES = ["src.chess_game", "src.generate_prediction", "src.UI.backend.server"]
+
+# Modules that take seconds to import and must not be imported at import time
+HEAVY_MODULES = ["torch", "transformers", "IPython", "ipywidgets", "dotenv"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start_time = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start_time
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "heavy_modules": heavy}}))
+"""
+
+
+def measure_import(module):
+    """
+    Imports a module in a fresh interpreter.
+
+    Returns:
+    dict: The import time in seconds and the heavy modules that were imported with it.
+    """
+    script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_server_startup(model_paths, timeout=300):
+    """
+    Starts the backend and polls `/ready`.
+
+    Returns:
+    dict: Seconds until the server answered its first request and until it was ready.
+    """
+    env = dict(os.environ)
+    env["LEON_MODEL_PATHS"] = json.dumps(model_paths)
+    env["LEON_ENGINE_COMMAND"] = f'"{sys.executable}" -m src.UI.backend.stub_engine'
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/ready"
+
+    start_time = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.UI.backend.server:app"]
+        + ["--port", str(port), "--log-level", "warning"],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    result = {"listening_seconds": None, "ready_seconds": None}
+    try:
+        while time.perf_counter() - start_time < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                status_code = httpx.get(url, timeout=1).status_code
+            except httpx.HTTPError:
+                status_code = None
+            elapsed_time = time.perf_counter() - start_time
+            if status_code is not None and result["listening_seconds"] is None:
+                result["listening_seconds"] = elapsed_time
+            if status_code == 200:
+                result["ready_seconds"] = elapsed_time
+                return result
+            time.sleep(0.05)
+        raise TimeoutError(f"Server was not ready within {timeout} seconds")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(args):
+    report = {"imports": {module: measure_import(module) for module in args.modules}}
+    if not args.skip_server:
+        with tempfile.TemporaryDirectory() as directory:
+            report["server"] = measure_server_startup(write_stub_models(directory))
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    for module, result in report["imports"].items():
+        if args.max_import_seconds and result["seconds"] > args.max_import_seconds:
+            failures.append(f"Importing {module} took {result['seconds']:.2f}s")
+        if result["heavy_modules"]:
+            failures.append(f"Importing {module} imported {result['heavy_modules']}")
+    ready_seconds = report.get("server", {}).get("ready_seconds")
+    if (
+        ready_seconds
+        and args.max_ready_seconds
+        and ready_seconds > args.max_ready_seconds
+    ):
+        failures.append(f"The server was ready after {ready_seconds:.2f}s")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the startup time.")
+    parser.add_argument(
+        "--modules", nargs="+", default=DEFAULT_MODULES, help="Modules to import."
+    )
+    parser.add_argument(
+        "--skip-server", action="store_true", help="Only measure the imports."
+    )
+    parser.add_argument(
+        "--max-import-seconds", type=float, default=0, help="Limit per import."
+    )
+    parser.add_argument(
+        "--max-ready-seconds", type=float, default=0, help="Limit until ready."
+    )
+    sys.exit(main(parser.parse_args()))
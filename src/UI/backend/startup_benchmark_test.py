@@ -0,0 +1,14 @@
+import unittest
+
+from src.UI.backend.startup_benchmark import measure_import
+
+
+class StartupTest(unittest.TestCase):
+    def test_imports_do_not_load_heavy_modules(self):
+        for module in ("src.chess_game", "src.UI.backend.server"):
+            with self.subTest(module=module):
+                self.assertEqual(measure_import(module)["heavy_modules"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
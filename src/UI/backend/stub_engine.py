@@ -0,0 +1,56 @@
+"""
+Stub UCI Engine
+---------------
+
+A minimal UCI engine that answers every `go` with a random legal move. It replaces Stockfish in
+the load test and in local runs without a Stockfish binary:
+
+    LEON_ENGINE_COMMAND="python -m src.UI.backend.stub_engine" fastapi dev src/UI/backend/server.py
+"""
+
+import random
+import sys
+
+import chess
+
+
+def run(input_stream=sys.stdin, output_stream=sys.stdout, seed=None):
+    """
+    Reads UCI commands from `input_stream` until "quit" and writes the answers to `output_stream`.
+    """
+    rng = random.Random(seed)
+    board = chess.Board()
+
+    def send(line):
+        output_stream.write(line + "\n")
+        output_stream.flush()
+
+    for line in input_stream:
+        parts = line.split()
+        if not parts:
+            continue
+        command = parts[0]
+        if command == "uci":
+            send("id name Leon Stub")
+            send("uciok")
+        elif command == "isready":
+            send("readyok")
+        elif command == "ucinewgame":
+            board = chess.Board()
+        elif command == "position":
+            moves_index = parts.index("moves") if "moves" in parts else len(parts)
+            if parts[1] == "startpos":
+                board = chess.Board()
+            else:
+                board = chess.Board(" ".join(parts[2:moves_index]))
+            for move in parts[moves_index + 1 :]:
+                board.push_uci(move)
+        elif command == "go":
+            moves = list(board.legal_moves)
+            send(f"bestmove {rng.choice(moves).uci() if moves else '0000'}")
+        elif command == "quit":
+            break
+
+
+if __name__ == "__main__":
+    run()
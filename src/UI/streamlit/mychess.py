@@ -32,40 +32,77 @@ class MyChess:
         <div id="myBoard" style="width: {self.width}px"></div><br>
         <label><strong>Status:</strong></label>
         <div id="status"></div>
+        <label><strong>Candidates:</strong></label>
+        <div id="candidates"></div>
         """
 
     def game_board(self):
         sidetomove = self.__sidetomove__()
 
         engine_move = f"""
-      function makeComputerMoveFromAPI(retryWithStockfish = false) {{
-          var currentFen = game.fen();
-          var history = game.pgn();
-          var playerModel = retryWithStockfish ? 'stockfish' : '{st.session_state.selected_model}';
-          
-          fetch('http://localhost:8000/get_move', {{
-              method: 'POST',
-              headers: {{
-                  'Content-Type': 'application/json'
-              }},
-              body: JSON.stringify({{fen: currentFen, history: history, model: playerModel}})
-          }})
-          .then(response => response.json())
-          .then(data => {{
-              var move = game.move(data.move, {{sloppy: true}});
-              if (move === null) {{
-                  if (!retryWithStockfish) {{
-                      console.log('Invalid move received, trying Stockfish...');
-                      makeComputerMoveFromAPI(true);
-                  }} else {{
-                      alert('Invalid move received from Stockfish.');
+      // One connection per game: the server keeps board, tokens and model cache of the
+      // game, so only the new moves are sent. It streams the best candidate moves with
+      // their probabilities before the chosen move.
+      var socket = null
+      var syncedPlies = 0
+      var waitingForMove = false
+
+      function openGameSocket() {{
+          socket = new WebSocket('ws://localhost:8000/games');
+          socket.onopen = function () {{
+              socket.send(JSON.stringify({{model: '{st.session_state.selected_model}', history: game.pgn()}}));
+          }};
+          socket.onmessage = function (event) {{
+              var data = JSON.parse(event.data);
+              if (data.type === 'session') {{
+                  syncedPlies = game.history().length;
+                  if (waitingForMove) {{
+                      makeComputerMoveFromAPI();
                   }}
-                  return;
+              }} else if (data.type === 'candidates') {{
+                  showCandidates(data.candidates);
+              }} else if (data.type === 'move') {{
+                  applyComputerMove(data);
+              }} else if (data.type === 'error') {{
+                  console.error('Error from API:', data.detail);
               }}
-              board.position(game.fen());  // Update the board position
-              updateStatus();  // Update status after the engine move
-          }})
-          .catch(error => console.error('Error fetching move from API:', error));
+          }};
+          socket.onclose = function () {{
+              socket = null;
+          }};
+      }}
+
+      function makeComputerMoveFromAPI() {{
+          waitingForMove = true;
+          if (socket === null) {{
+              openGameSocket();
+              return;
+          }}
+          if (socket.readyState !== WebSocket.OPEN) return;  // sent once the session is open
+
+          var newMoves = game.history({{verbose: true}}).slice(syncedPlies).map(
+              move => move.from + move.to + (move.promotion || '')
+          );
+          syncedPlies += newMoves.length;
+          socket.send(JSON.stringify({{moves: newMoves}}));
+      }}
+
+      function showCandidates(candidates) {{
+          $candidates.html(candidates.map(
+              candidate => candidate.move + ' ' + (100 * candidate.probability).toFixed(1) + '%'
+          ).join('<br>'));
+      }}
+
+      function applyComputerMove(data) {{
+          waitingForMove = false;
+          var move = data.move === null ? null : game.move(data.move, {{sloppy: true}});
+          if (move === null) {{
+              console.log('No move received from the model.');
+              return;
+          }}
+          syncedPlies = game.history().length;
+          board.position(game.fen());  // Update the board position
+          updateStatus();  // Update status after the engine move
       }}
       """
 
@@ -78,6 +115,7 @@ class MyChess:
       var $status = $('#status')
       var $fen = $('#fen')
       var $pgn = $('#pgn')
+      var $candidates = $('#candidates')
       """
 
         game_over_ = """
@@ -52,11 +52,7 @@ import src.notation_converter as converter
 import os
 import chess.svg
 
-from IPython.display import display, clear_output
-from ipywidgets import Output
 from src.generate_prediction import generate_prediction
-from IPython.display import SVG
-from dotenv import load_dotenv
 
 
 class ChessGame:
@@ -77,6 +73,11 @@ class ChessGame:
         manual_input=True,
         mate_score=100_000,
     ):
+        # IPython, ipywidgets and dotenv are imported on construction, so that importing this module
+        # (e.g. from the backend) stays fast
+        from dotenv import load_dotenv
+        from ipywidgets import Output
+
         load_dotenv()
         self.player1_type = player1_type
         self.player2_type = player2_type
@@ -108,6 +109,8 @@ class ChessGame:
         """
         Displays the current state of the board.
         """
+        from IPython.display import clear_output, display
+
         with self.output_display:
             clear_output(wait=True)
             display(self.board)
@@ -342,6 +345,8 @@ class ChessGame:
         where the maximum token length is reached and the player can choose to continue or remove the first moves.
         Model maximum input token length is 512 tokens
         """
+        from IPython.display import display
+
         if self.show_output:
             self.start_informations()
             self.print_game_config()
@@ -421,6 +426,8 @@ class ChessGame:
         moves_string (str): A string containing moves in xLAN separated by spaces, e.g., "Pe2e4 Pe7e5 Ng1f3"
         save_to_file (str): The filename to save the board to as an SVG file.
         """
+        from IPython.display import display
+
         self.movehistory = move_sequence
         self.push_starting_sequence()
 
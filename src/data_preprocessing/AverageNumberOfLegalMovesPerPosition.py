@@ -2,6 +2,9 @@ import chess
 import chess.pgn
 import os
 
+from src.data_preprocessing.compressed_input import input_position, open_input
+from src.data_preprocessing.corpus_statistics import GameSummary, LegalMovesStatistic
+
 
 def average_legal_moves_per_game(game):
     """
@@ -31,20 +34,24 @@ import os
 def analyze_pgn_file(input_path):
     """
     Analyze a PGN file and return the average number of legal moves per game and the total number of games.
+    The PGN file can be compressed (.gz, .bz2, .xz).
+
+    This is a separate pass over the file. The conversions collect the same statistic (and more) while
+    they convert the games, see `pgn_to_xlan(..., statistics=["legal_moves"])` and `corpus_statistics`.
     """
     total_file_size = os.path.getsize(input_path)
 
-    avg_legal_moves = []
+    statistic = LegalMovesStatistic()
 
-    with open(input_path) as pgn:
+    with open_input(input_path) as pgn:
         while True:
             game = chess.pgn.read_game(pgn)
             if game is None:
                 break
-            avg_legal_moves.append(average_legal_moves_per_game(game))
+            statistic.add_game(GameSummary.from_game(game))
 
             # print progress to console
-            current_file_position = pgn.tell()
+            current_file_position = input_position(pgn)
             progress_percentage = (
                 current_file_position / total_file_size
             ) * 100
@@ -53,15 +60,16 @@ def analyze_pgn_file(input_path):
                 end="\r",
             )
 
+    summary = statistic.summary()
     return {
-        "average_moves": sum(avg_legal_moves) / len(avg_legal_moves)
-        if avg_legal_moves
-        else 0,
-        "number_of_games": len(avg_legal_moves),
+        "average_moves": summary["average_per_game"],
+        "number_of_games": summary["number_of_games"],
     }
 
 
 if __name__ == "__main__":
+    # run from the repository root:
+    # python -m src.data_preprocessing.AverageNumberOfLegalMovesPerPosition
     input_path = "./data/raw/lichess_db_standard_rated_2015-10.pgn"
     results = analyze_pgn_file(input_path)
     print(f"average number of legal moves: {results['average_moves']:.2f}")
@@ -0,0 +1,395 @@
+"""
+All Moves
+---------
+
+Generates the data of `pgn_to_xlan` with `generate_all_moves`: for every position of every game,
+the game up to the position followed by each legal move. That is about 30 times the data of the
+games themselves (see AverageNumberOfLegalMovesPerPosition), so `pgn_to_all_moves` streams it into
+output parts of limited size, which can be compressed (.gz, .bz2, .xz) and read back with
+`compressed_input.open_input`.
+
+By default the common prefixes of the sequences are written only once. Every prefix (a position
+reached by the moves of a game) gets an ID, and the sequences are written as records:
+    P {id} {parent id} {move}    defines prefix `id` as prefix `parent id` followed by `move`
+    M {id} {move}                the sequence of prefix `id` followed by the legal move `move`
+Prefix 0 is the start of the game. The legal moves of a prefix are written once, however many
+games reach it, so the openings shared by many games cost almost nothing. Every part starts with
+new IDs and can be read on its own, see `read_all_moves`.
+
+The moves are written as xLAN (or xLAN+) text, or as token IDs of a notation (see
+`pgn_to_tokens`). In the binary records, the kind is one byte ("P" or "M"), the IDs are unsigned
+32-bit little-endian integers and the move has the fixed number of tokens of the notation.
+Without deduplication every sequence is written in full: as a line of xLAN text like
+`pgn_to_xlan.game_to_xlan`, or as the tokens `STARTSEQ`, the moves and `GAMESEP` like
+`pgn_to_tokens`.
+"""
+
+import bz2
+import collections
+import glob
+import gzip
+import io
+import json
+import lzma
+import os
+import struct
+
+import chess.pgn
+
+from src.data_preprocessing.compressed_input import open_input
+from src.data_preprocessing.corpus_statistics import GameSummary
+from src.data_preprocessing.pgn_to_tokens import get_suffix_tokens, move_to_tokens
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+from src.data_preprocessing.run_manifest import get_temporary_path
+from src.tokenizer.tokenizer import load_tokens
+
+# Opens a file for writing with the given compression
+COMPRESSED_OPENERS = {
+    None: open,
+    "gz": gzip.open,
+    "bz2": bz2.open,
+    "xz": lzma.open,
+}
+
+PREFIX_RECORD = struct.Struct("<cII")
+MOVE_RECORD = struct.Struct("<cI")
+
+
+class ShardedOutput:
+    """
+    Writes binary data to a series of output parts of limited size: `{path}.part{index:04d}`,
+    followed by the extension of the compression. A part is written to a temporary file that is
+    renamed when the part is complete.
+
+    Parameters:
+        path: The path of the output without the part suffix.
+        max_part_size: The size in bytes (before compression) after which a new part is started.
+            The data of a single `write` is never split, so a part can be slightly larger.
+        compression: None, "gz", "bz2" or "xz".
+    """
+
+    def __init__(self, path, max_part_size, compression=None):
+        if compression not in COMPRESSED_OPENERS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.path = path
+        self.max_part_size = max_part_size
+        self.compression = compression
+        self.part_index = -1
+        self.file = None
+        self.part_size = 0
+        self.paths = []
+
+    def get_part_path(self, part_index):
+        extension = f".{self.compression}" if self.compression else ""
+        return f"{self.path}.part{part_index:04d}{extension}"
+
+    def needs_new_part(self):
+        """
+        Checks whether the next `write` starts a new part.
+        """
+        return self.file is None or self.part_size >= self.max_part_size
+
+    def write(self, data):
+        """
+        Writes data to the current part, after starting a new part if the current one is full.
+        """
+        if self.needs_new_part():
+            self.close_part()
+            self.part_index += 1
+            part_path = get_temporary_path(self.get_part_path(self.part_index))
+            self.file = COMPRESSED_OPENERS[self.compression](part_path, "wb")
+            self.part_size = 0
+        self.file.write(data)
+        self.part_size += len(data)
+
+    def close_part(self):
+        if self.file is not None:
+            self.file.close()
+            part_path = self.get_part_path(self.part_index)
+            os.replace(get_temporary_path(part_path), part_path)
+            self.paths.append(part_path)
+            self.file = None
+
+    def close(self):
+        """
+        Completes the last part.
+
+        Returns:
+            The paths of all parts.
+        """
+        self.close_part()
+        return self.paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.file is not None:
+            self.file.close()
+            os.remove(get_temporary_path(self.get_part_path(self.part_index)))
+
+
+class pgn_to_all_moves(pgn_to_xlan):
+    """
+    Converts a PGN file to the sequences of `generate_all_moves`, written to output parts of
+    limited size, see the module documentation. The games are read and filtered like in
+    `pgn_to_xlan`. `convert_pgn_parallel` writes one series of parts per shard,
+    `{output_path}.shard{i:04d}.part{j:04d}`, and can be resumed like `pgn_to_xlan`.
+
+    Parameters:
+        input_path: Path to the PGN file, can be compressed (.gz, .bz2, .xz)
+        output_path: Path of the output parts without the part suffix
+        max_part_size: The size in bytes (before compression) of an output part, default is 256 MB.
+        compression: The compression of the output parts: None, "gz", "bz2" or "xz".
+        notation: The notation of the token IDs to write, e.g. "xLANplus", or None to write
+            xLAN (or xLAN+ with `xLanPlus`) text. Default is None.
+        deduplicate: Whether to write the common prefixes only once. Default is True.
+        The other parameters are the ones of `pgn_to_xlan`.
+    """
+
+    def __init__(
+        self,
+        input_path,
+        output_path,
+        max_part_size=256 << 20,
+        compression=None,
+        notation=None,
+        deduplicate=True,
+        **kwargs,
+    ):
+        super().__init__(input_path, output_path, generate_all_moves=True, **kwargs)
+        self.max_part_size = max_part_size
+        self.compression = compression
+        self.notation = notation
+        self.deduplicate = deduplicate
+        self.suffix_tokens = get_suffix_tokens(notation) if notation else None
+        self.reset_prefixes()
+
+    def reset_prefixes(self):
+        """
+        Forgets the prefixes written so far, at the start of every output part.
+        """
+        self.prefix_ids = {}
+        self.expanded_prefixes = set()
+
+    def encode_move(self, board, move, index):
+        """
+        Encodes a move of the position after `index` moves, as xLAN text or as token IDs.
+        """
+        if self.notation:
+            return move_to_tokens(board, move, self.notation, self.suffix_tokens)
+        return self.move_lan_to_xlan(board.lan(move), index % 2 == 0).encode()
+
+    def prefix_record(self, prefix_id, parent_id, move):
+        if self.notation:
+            return PREFIX_RECORD.pack(b"P", prefix_id, parent_id) + move
+        return b"P %d %d %s\n" % (prefix_id, parent_id, move)
+
+    def move_record(self, prefix_id, move):
+        if self.notation:
+            return MOVE_RECORD.pack(b"M", prefix_id) + move
+        return b"M %d %s\n" % (prefix_id, move)
+
+    def game_records(self, game):
+        """
+        Returns the records of the sequences of a game that have not been written to the current
+        part yet, and the number of sequences written.
+        """
+        records = []
+        sequences = 0
+        board = game.board()
+        prefix_id = 0
+        for index, move in enumerate(game.mainline_moves()):
+            if prefix_id not in self.expanded_prefixes:
+                self.expanded_prefixes.add(prefix_id)
+                for legal_move in board.legal_moves:
+                    encoded_move = self.encode_move(board, legal_move, index)
+                    records.append(self.move_record(prefix_id, encoded_move))
+                    sequences += 1
+
+            encoded_move = self.encode_move(board, move, index)
+            child_id = self.prefix_ids.get((prefix_id, encoded_move))
+            if child_id is None:
+                child_id = len(self.prefix_ids) + 1
+                self.prefix_ids[(prefix_id, encoded_move)] = child_id
+                records.append(self.prefix_record(child_id, prefix_id, encoded_move))
+            prefix_id = child_id
+            board.push(move)
+        return b"".join(records), sequences
+
+    def game_sequences(self, game):
+        """
+        Returns every sequence of a game in full, and the number of sequences. The text is the
+        same as the output of `game_to_xlan` with `generate_all_moves`.
+        """
+        if self.notation:
+            tokens = load_tokens(self.notation)
+            start = bytes([tokens["paddingToken"]["STARTSEQ"]])
+            end = bytes([tokens["gameSeparator"]["GAMESEP"]])
+            encode_move = self.encode_move
+        else:
+            start = b""
+            end = b"\n"
+
+            def encode_move(board, move, index):
+                return self.format_move(board, move, index).encode()
+
+        sequences = []
+        prefix = start
+        board = game.board()
+        for index, move in enumerate(game.mainline_moves()):
+            for legal_move in board.legal_moves:
+                sequences.append(prefix + encode_move(board, legal_move, index) + end)
+            prefix += encode_move(board, move, index)
+            board.push(move)
+        return b"".join(sequences), len(sequences)
+
+    def write_games(self, games, output):
+        """
+        Writes the sequences of the given game texts to a `ShardedOutput`. Stops after
+        `number_of_games_to_write` sequences.
+
+        Returns:
+            The number of games processed, the number of sequences written and the number of
+            games rejected by each header filter.
+        """
+        games_processed = 0
+        sequences_written = 0
+        rejected_games = collections.Counter()
+        self.reset_prefixes()
+        for _, text in games:
+            if 0 <= self.number_of_games_to_write <= sequences_written:
+                break
+            games_processed += 1
+            reason = self.get_rejection_reason(self.parse_headers(text))
+            if reason is not None:
+                rejected_games[reason] += 1
+                continue
+            game = chess.pgn.read_game(io.StringIO(text))
+            if game is None:
+                continue
+            if self.game_statistics is not None:
+                summary = GameSummary.from_game(game)
+                summary.add_all_moves_sequences(self.get_notations())
+                self.game_statistics.add_game(summary)
+
+            if not self.deduplicate:
+                data, sequences = self.game_sequences(game)
+            else:
+                # every part starts with new prefix IDs, so that it can be read on its own
+                if output.needs_new_part():
+                    self.reset_prefixes()
+                data, sequences = self.game_records(game)
+            output.write(data)
+            sequences_written += sequences
+        return games_processed, sequences_written, rejected_games
+
+    def get_notations(self):
+        return [self.notation] if self.notation else super().get_notations()
+
+    def get_shard_path(self, shard_index):
+        return f"{self.output_path}.shard{shard_index:04d}"
+
+    def get_shard_outputs(self, shard_index):
+        return sorted(
+            glob.glob(glob.escape(self.get_shard_path(shard_index)) + ".part*")
+        )
+
+    def get_outputs(self):
+        return sorted(glob.glob(glob.escape(self.output_path) + ".part*"))
+
+    def get_run_fingerprint(self, shard_ranges, merge):
+        fingerprint = super().get_run_fingerprint(shard_ranges, merge)
+        fingerprint.pop("outputs")
+        fingerprint["output_path"] = os.path.abspath(self.output_path)
+        fingerprint.update(
+            max_part_size=self.max_part_size,
+            compression=self.compression,
+            notation=self.notation,
+            deduplicate=self.deduplicate,
+        )
+        return fingerprint
+
+    def convert_shard(self, shard_index, start, end):
+        """
+        Writes the sequences of the games that start in the given byte range to the output parts
+        of the shard. Parts of an earlier, interrupted conversion of the shard are deleted first.
+        """
+        for path in self.get_shard_outputs(shard_index):
+            os.remove(path)
+        with ShardedOutput(
+            self.get_shard_path(shard_index), self.max_part_size, self.compression
+        ) as output:
+            return self.write_games(self.read_shard_games(start, end), output)
+
+    def convert_pgn_parallel(self, num_shards=None, resume=True):
+        """
+        Converts the shards of the PGN file in parallel, each into its own series of output
+        parts, see `pgn_to_xlan.convert_pgn_parallel` with `merge=False`.
+        """
+        super().convert_pgn_parallel(num_shards=num_shards, merge=False, resume=resume)
+
+    def convert_pgn(self):
+        """
+        Converts all games of the PGN file in a single process into one series of output parts.
+        """
+        start_time = self.start_logging()
+        self.game_statistics = self.new_statistics()
+        for path in self.get_outputs():
+            os.remove(path)
+        with open_input(self.input_path, "rb") as pgn, ShardedOutput(
+            self.output_path, self.max_part_size, self.compression
+        ) as output:
+            games_processed, sequences_written, rejected_games = self.write_games(
+                self.read_game_texts(pgn), output
+            )
+        self.number_of_games_processed += games_processed
+        self.number_of_games_written += sequences_written
+        self.rejected_games.update(rejected_games)
+        print(f"\tNumber of writen sequences: {self.number_of_games_written}")
+        print(f"\tRejected games: {dict(self.rejected_games)}")
+        self.save_statistics()
+
+        if self.log:
+            self.final_logging(start_time)
+
+
+def read_all_moves(path, notation=None):
+    """
+    Reads an output part of `pgn_to_all_moves` with deduplicated prefixes and expands its records
+    into full sequences.
+
+    Parameters:
+        path: The path of the part, can be compressed.
+        notation: The notation of the token IDs in the part, or None for xLAN text.
+
+    Yields:
+        Every sequence as a list of moves: xLAN strings, or tuples of token IDs.
+    """
+    prefixes = {0: []}
+    with open_input(path, "rb") as file:
+        if notation is None:
+            for line in file:
+                kind, *fields = line.decode().split()
+                if kind == "P":
+                    prefixes[int(fields[0])] = prefixes[int(fields[1])] + [fields[2]]
+                else:
+                    yield prefixes[int(fields[0])] + [fields[1]]
+            return
+
+        with open("./src/notation.json") as notation_file:
+            move_length = json.load(notation_file)[notation]["tokens_per_ply"]
+        while kind := file.read(1):
+            if kind == b"P":
+                _, prefix_id, parent_id = PREFIX_RECORD.unpack(
+                    kind + file.read(PREFIX_RECORD.size - 1)
+                )
+                move = tuple(file.read(move_length))
+                prefixes[prefix_id] = prefixes[parent_id] + [move]
+            else:
+                _, prefix_id = MOVE_RECORD.unpack(
+                    kind + file.read(MOVE_RECORD.size - 1)
+                )
+                yield prefixes[prefix_id] + [tuple(file.read(move_length))]
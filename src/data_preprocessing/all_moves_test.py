@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+import chess.pgn
+
+from src.data_preprocessing.all_moves import pgn_to_all_moves, read_all_moves
+from src.data_preprocessing.compressed_input import open_input
+from src.data_preprocessing.pgn_to_tokens import split_token_games
+from src.data_preprocessing.pgn_to_xLan_test import write_pgn
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+
+
+def read_parts(paths):
+    data = b""
+    for path in paths:
+        with open_input(path, "rb") as file:
+            data += file.read()
+    return data
+
+
+class all_moves_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.directory.name, "games.pgn")
+        write_pgn(self.input_path, repeat=4)
+
+        # the sequences of game_to_xlan, for the games accepted by the header filters
+        converter = pgn_to_xlan(None, None, generate_all_moves=True)
+        self.expected = []
+        with open(self.input_path) as pgn:
+            while game := chess.pgn.read_game(pgn):
+                if converter.is_game_accepted(game.headers):
+                    self.expected.extend(converter.game_to_xlan(game))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def converter(self, name, **kwargs):
+        return pgn_to_all_moves(
+            self.input_path, os.path.join(self.directory.name, name), **kwargs
+        )
+
+    def test_full_sequences_match_game_to_xlan(self):
+        converter = self.converter("full", deduplicate=False, max_part_size=2000)
+        converter.convert_pgn()
+        self.assertGreater(len(converter.get_outputs()), 1)
+        lines = read_parts(converter.get_outputs()).decode().splitlines()
+        self.assertEqual(lines, self.expected)
+        self.assertEqual(converter.number_of_games_written, len(self.expected))
+
+    def test_deduplicated_parts_expand_to_all_sequences(self):
+        expected = {
+            tuple(move for move in line.split() if not move.endswith("."))
+            for line in self.expected
+        }
+        for compression in [None, "gz", "xz"]:
+            converter = self.converter(
+                f"dedup_{compression}", max_part_size=3000, compression=compression
+            )
+            converter.convert_pgn()
+            parts = converter.get_outputs()
+            self.assertGreater(len(parts), 1)
+            sequences = [
+                tuple(sequence) for path in parts for sequence in read_all_moves(path)
+            ]
+            self.assertEqual(set(sequences), expected)
+
+        full = self.converter("full", deduplicate=False)
+        full.convert_pgn()
+        deduplicated = self.converter("dedup", max_part_size=1 << 20)
+        deduplicated.convert_pgn()
+        self.assertLess(
+            os.path.getsize(deduplicated.get_outputs()[0]) * 10,
+            os.path.getsize(full.get_outputs()[0]),
+        )
+
+    def test_deduplicated_tokens_match_full_token_sequences(self):
+        full = self.converter("full", notation="xLANplus", deduplicate=False)
+        full.convert_pgn()
+        expected = set()
+        for game in split_token_games(read_parts(full.get_outputs())):
+            moves = game[1:-1]
+            expected.add(
+                tuple(tuple(moves[i : i + 4]) for i in range(0, len(moves), 4))
+            )
+        self.assertEqual(
+            len(split_token_games(read_parts(full.get_outputs()))), len(self.expected)
+        )
+
+        converter = self.converter("dedup", notation="xLANplus", max_part_size=1000)
+        converter.convert_pgn()
+        sequences = {
+            tuple(sequence)
+            for path in converter.get_outputs()
+            for sequence in read_all_moves(path, "xLANplus")
+        }
+        self.assertEqual(sequences, expected)
+
+    def test_convert_pgn_parallel_writes_parts_per_shard(self):
+        sequential = self.converter("sequential", max_part_size=1000)
+        sequential.convert_pgn()
+        expected = {
+            tuple(sequence)
+            for path in sequential.get_outputs()
+            for sequence in read_all_moves(path)
+        }
+
+        converter = self.converter("parallel", max_part_size=1000, compression="gz")
+        converter.convert_pgn_parallel(num_shards=3)
+        sequences = set()
+        for shard_index in range(3):
+            parts = converter.get_shard_outputs(shard_index)
+            self.assertTrue(parts)
+            for path in parts:
+                self.assertTrue(path.endswith(".gz"))
+                sequences.update(tuple(sequence) for sequence in read_all_moves(path))
+        self.assertEqual(sequences, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+"""
+Bounded Imap
+------------
+
+`multiprocessing.Pool.imap` returns the results in order, but its task feeder consumes the whole
+task iterable at once, and the results of finished tasks pile up in memory if they are consumed
+more slowly than they are produced. `bounded_imap` keeps at most `max_in_flight` tasks submitted
+and unconsumed, so the memory of a long run stays flat, while the workers of a long-lived pool
+never wait for a batch to be collected before they get new work.
+"""
+
+import collections
+
+
+def bounded_imap(pool, function, tasks, max_in_flight):
+    """
+    Applies a function to every task in a pool, like `pool.imap`, with at most `max_in_flight`
+    tasks submitted whose results have not been consumed yet.
+
+    Parameters:
+        pool: A multiprocessing pool.
+        function: The function applied to every task, must be picklable.
+        tasks: An iterable of single arguments, read lazily.
+        max_in_flight: The maximum number of submitted tasks whose results are not consumed yet.
+
+    Yields:
+        The results in the order of the tasks.
+    """
+    pending = collections.deque()
+    for task in tasks:
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(function, (task,)))
+    while pending:
+        yield pending.popleft().get()
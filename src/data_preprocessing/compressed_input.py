@@ -0,0 +1,189 @@
+"""
+Compressed Input
+----------------
+
+Opens plain and compressed input files (.gz, .bz2, .xz) the same way, so the preprocessing tools can
+read compressed PGN and xLAN files directly instead of decompressing them to disk first. Compressed
+files are decompressed while they are read. The progress of a file is measured in bytes of the file
+on disk, see `input_position`.
+
+Some compressed files consist of many independently compressed streams: bz2 files written by
+pbzip2 or lbzip2 and gzip files written by bgzip. Such files can be split at stream boundaries and
+decompressed in parallel. `find_stream_start` finds the next stream boundary after a byte
+position, like `pgn_to_xlan.find_game_start` finds the next game. For other compressed files the
+only boundary is the start of the file.
+"""
+
+import bz2
+import io
+import lzma
+import os
+import re
+import zlib
+
+# Maps the file extension to a function that creates a decompressor for one stream
+DECOMPRESSORS = {
+    ".gz": lambda: zlib.decompressobj(wbits=31),
+    ".bz2": bz2.BZ2Decompressor,
+    ".xz": lzma.LZMADecompressor,
+}
+
+# The start of a stream that can be decompressed on its own, for the formats that have one:
+# a bz2 stream header followed by the magic number of its first block, and a gzip header with
+# the BGZF extra field
+STREAM_STARTS = {
+    ".bz2": re.compile(rb"BZh[1-9]1AY&SY"),
+    ".gz": re.compile(rb"\x1f\x8b\x08\x04.{6}\x06\x00BC\x02\x00", re.DOTALL),
+}
+
+READ_SIZE = 1 << 20
+
+
+def get_extension(path):
+    return os.path.splitext(path)[1].lower()
+
+
+def is_compressed(path):
+    return get_extension(path) in DECOMPRESSORS
+
+
+class DecompressingReader(io.RawIOBase):
+    """
+    Reads the decompressed data of a compressed file, starting at the given byte position of the
+    file, which must be the start of a stream. Files with several streams are read to the end.
+
+    If `end` is given, `end_position` is set to the number of decompressed bytes before the first
+    stream that starts at or after `end`, as soon as this stream is reached.
+
+    Attributes:
+    - file: The compressed file.
+    - position (int): The number of decompressed bytes read.
+    - end_position (int): The decompressed position of the stream at `end`, None until it is reached.
+    - streams (list): The position in the file and the decompressed position of every stream
+      started so far.
+    """
+
+    def __init__(self, path, start=0, end=None):
+        self.file = open(path, "rb")
+        self.file.seek(start)
+        self.end = end
+        self.new_decompressor = DECOMPRESSORS[get_extension(path)]
+        self.pending = b""
+        self.produced = 0
+        self.position = 0
+        self.end_position = None
+        self.streams = []
+        self.start_stream(start)
+
+    def start_stream(self, stream_start):
+        self.decompressor = self.new_decompressor()
+        self.streams.append((stream_start, self.produced))
+        if self.end is not None and self.end_position is None:
+            if stream_start >= self.end:
+                self.end_position = self.produced
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        while not self.pending:
+            data = b""
+            if self.decompressor.eof:
+                # the next stream starts with the data after the end of the current stream
+                data = self.decompressor.unused_data
+                self.start_stream(self.file.tell() - len(data))
+            if not data:
+                data = self.file.read(READ_SIZE)
+                if not data:
+                    return 0
+            self.pending = self.decompressor.decompress(data)
+            self.produced += len(self.pending)
+
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        self.position += size
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.file.close()
+        super().close()
+
+
+def open_input(path, mode="r", start=0, end=None):
+    """
+    Opens a plain or compressed file for reading. The compression is chosen by the file extension.
+
+    Parameters:
+    - path (str): The path of the file.
+    - mode (str): "r" for text, "rb" for bytes.
+    - start (int): The byte position of the file to start reading at. For compressed files it must
+      be the start of a stream, see `find_stream_start`.
+    - end (int): For compressed files, the byte position at which `end_position` of the
+      `DecompressingReader` is recorded.
+
+    Returns:
+    - A file object. Plain files are opened with `open`, compressed files can only be read forward.
+    """
+    if not is_compressed(path):
+        file = open(path, mode)
+        file.seek(start)
+        return file
+    file = io.BufferedReader(DecompressingReader(path, start, end), READ_SIZE)
+    if "b" not in mode:
+        file = io.TextIOWrapper(file, encoding="utf-8")
+    return file
+
+
+def input_position(file):
+    """
+    Returns the position of a file opened with `open_input` in the file on disk. For compressed
+    files this is the number of compressed bytes read, which is used to report progress.
+    """
+    while not isinstance(file, (DecompressingReader, io.FileIO)):
+        file = file.buffer if hasattr(file, "buffer") else file.raw
+    if isinstance(file, DecompressingReader):
+        file = file.file
+    return file.tell()
+
+
+def get_reader(file):
+    """
+    Returns the `DecompressingReader` of a compressed file opened with `open_input`.
+    """
+    while not isinstance(file, DecompressingReader):
+        file = file.buffer if hasattr(file, "buffer") else file.raw
+    return file
+
+
+def find_stream_start(path, position):
+    """
+    Returns the position of the first stream of a compressed file that starts at or after the
+    given position, or the size of the file if there is none. Files without detectable stream
+    boundaries only have a stream at the start of the file.
+    """
+    file_size = os.path.getsize(path)
+    if position == 0:
+        return 0
+    stream_start = STREAM_STARTS.get(get_extension(path))
+    if stream_start is None:
+        return file_size
+
+    overlap = 32
+    with open(path, "rb") as file:
+        file.seek(position)
+        data_start = position
+        data = b""
+        while True:
+            chunk = file.read(READ_SIZE)
+            if not chunk:
+                return file_size
+            data = data[-overlap:] + chunk
+            match = stream_start.search(data)
+            if match:
+                return data_start - (len(data) - len(chunk)) + match.start()
+            data_start += len(chunk)
@@ -0,0 +1,102 @@
+import bz2
+import gzip
+import lzma
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+from src.data_preprocessing.compressed_input import (
+    find_stream_start,
+    get_reader,
+    input_position,
+    open_input,
+)
+
+DATA = "".join(f"line {index} " + "x" * (index % 50) + "\n" for index in range(5000))
+
+
+def bgzf_compress(data, block_size=4096):
+    """
+    Compresses data like bgzip: every block is a gzip member with the BGZF extra field.
+    """
+    members = []
+    for start in range(0, len(data), block_size):
+        block = data[start : start + block_size]
+        compressor = zlib.compressobj(wbits=-15)
+        deflated = compressor.compress(block) + compressor.flush()
+        block_size_field = 18 + len(deflated) + 8 - 1
+        members.append(
+            b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+            + struct.pack("<H", block_size_field)
+            + deflated
+            + struct.pack("<II", zlib.crc32(block), len(block))
+        )
+    return b"".join(members)
+
+
+def multi_stream_bz2_compress(data, stream_size=10000):
+    """
+    Compresses data like pbzip2: the data is split at arbitrary bytes into independent streams.
+    """
+    return b"".join(
+        bz2.compress(data[start : start + stream_size])
+        for start in range(0, len(data), stream_size)
+    )
+
+
+class compressed_input_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        data = DATA.encode()
+        self.files = {
+            "plain.txt": data,
+            "single.gz": gzip.compress(data),
+            "single.xz": lzma.compress(data),
+            "multi.bz2": multi_stream_bz2_compress(data),
+            "bgzf.gz": bgzf_compress(data),
+        }
+        for name, content in self.files.items():
+            with open(self.path(name), "wb") as file:
+                file.write(content)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_open_input_decompresses(self):
+        for name in self.files:
+            with open_input(self.path(name)) as file:
+                self.assertEqual(file.read(), DATA, name)
+            with open_input(self.path(name), "rb") as file:
+                lines = list(iter(file.readline, b""))
+                self.assertEqual(b"".join(lines), DATA.encode(), name)
+                self.assertEqual(input_position(file), len(self.files[name]), name)
+
+    def test_streams_can_be_read_in_parallel(self):
+        for name in ["multi.bz2", "bgzf.gz"]:
+            path = self.path(name)
+            size = len(self.files[name])
+            bounds = [find_stream_start(path, size * index // 7) for index in range(8)]
+            self.assertEqual(bounds[-1], size)
+            self.assertEqual(len(set(bounds)), 8, name)
+
+            parts = []
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                with open_input(path, "rb", start, end) as file:
+                    data = file.read()
+                    parts.append(data[: get_reader(file).end_position])
+            self.assertEqual(b"".join(parts), DATA.encode(), name)
+
+    def test_single_stream_files_have_one_stream(self):
+        for name in ["single.gz", "single.xz"]:
+            path = self.path(name)
+            self.assertEqual(find_stream_start(path, 0), 0)
+            self.assertEqual(find_stream_start(path, 1), len(self.files[name]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Conversion Benchmark
+--------------------
+
+Measures how many games per second are converted from PGN to xLAN, once through a python-chess game
+tree (`pgn_to_xlan.game_to_xlan`) and once while parsing with `XlanVisitor`, and checks that both
+give the same output. The report is printed as JSON; the benchmark exits with an error if the
+outputs differ.
+
+Usage:
+    python -m src.data_preprocessing.conversion_benchmark games.pgn
+    python -m src.data_preprocessing.conversion_benchmark games.pgn --games 10000 --xlan-plus
+"""
+
+import argparse
+import io
+import itertools
+import json
+import sys
+import time
+
+import chess.pgn
+
+from src.data_preprocessing.compressed_input import open_input
+from src.data_preprocessing.pgn_to_xlan import XlanVisitor, pgn_to_xlan
+
+
+def convert_with_game_tree(converter, texts):
+    results = []
+    for text in texts:
+        game = chess.pgn.read_game(io.StringIO(text))
+        results.append([xlan for xlan in converter.game_to_xlan(game) if xlan])
+    return results
+
+
+def convert_with_visitor(converter, texts):
+    results = []
+    for text in texts:
+        xlan = chess.pgn.read_game(
+            io.StringIO(text), Visitor=lambda: XlanVisitor(converter)
+        )
+        results.append([xlan] if xlan else [])
+    return results
+
+
+def main(args):
+    with open_input(args.input_path, "rb") as pgn:
+        texts = [
+            text
+            for _, text in itertools.islice(
+                pgn_to_xlan.read_game_texts(pgn), args.games
+            )
+        ]
+    converter = pgn_to_xlan(
+        args.input_path,
+        None,
+        min_number_of_moves_per_game=args.min_moves,
+        xLanPlus=args.xlan_plus,
+    )
+
+    report = {"games": len(texts)}
+    outputs = {}
+    for name, convert in [
+        ("game_tree", convert_with_game_tree),
+        ("visitor", convert_with_visitor),
+    ]:
+        start_time = time.perf_counter()
+        outputs[name] = convert(converter, texts)
+        seconds = time.perf_counter() - start_time
+        report[name] = {"seconds": seconds, "games_per_second": len(texts) / seconds}
+    report["speedup"] = report["game_tree"]["seconds"] / report["visitor"]["seconds"]
+    report["identical"] = outputs["game_tree"] == outputs["visitor"]
+    print(json.dumps(report, indent=2))
+    return 0 if report["identical"] else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the PGN conversion.")
+    parser.add_argument("input_path", help="The PGN file.")
+    parser.add_argument(
+        "--games", type=int, default=10000, help="Number of games to convert."
+    )
+    parser.add_argument(
+        "--min-moves", type=int, default=10, help="Minimum number of moves per game."
+    )
+    parser.add_argument(
+        "--xlan-plus", action="store_true", help="Convert to the xLAN+ format."
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,388 @@
+"""
+Corpus Statistics
+-----------------
+
+Collects statistics of the games of a corpus while it is converted, so that they come with every
+conversion instead of costing an extra pass over the PGN file like
+`AverageNumberOfLegalMovesPerPosition.analyze_pgn_file`. The conversion feeds every converted game
+to the statistics as a `GameSummary`, taken from the parser it already runs.
+
+A statistic is an accumulator of counters: `Statistic` subclasses count values of the games in
+`collections.Counter`s, so the statistics of the shards of a parallel conversion are merged by
+adding their counters, and they are stored with the shards in the run manifest, so a resumed
+conversion keeps the statistics of the shards it does not convert again. Additional statistics
+can be plugged in by passing a `Statistic` subclass instead of a name in `STATISTICS`.
+
+Usage:
+    converter = pgn_to_xlan(input_path, output_path, statistics=list(STATISTICS))
+    converter.convert_pgn_parallel()
+    converter.game_statistics.summary()  # also written to `{output_path}.stats.json`
+"""
+
+import collections
+import functools
+import json
+
+import chess
+
+from src.data_preprocessing.run_manifest import atomic_open
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokens_per_ply(notation):
+    with open("./src/notation.json") as file:
+        return json.load(file)[notation]["tokens_per_ply"]
+
+
+def get_sequence_length(notation, plies, result=True):
+    """
+    Returns the number of tokens of a training sequence: `STARTSEQ`, the moves, the result if the
+    sequence has one, and `GAMESEP`.
+    """
+    return get_tokens_per_ply(notation) * plies + (3 if result else 2)
+
+
+class GameSummary:
+    """
+    What the statistics see of a converted game.
+
+    Attributes:
+        headers: The tags of the game.
+        legal_moves: For every move of the main line, the number of legal moves of the position
+            before the move.
+        pieces: The piece of every move, "K" for castling.
+        moves: Every move in UCI notation.
+        sequence_lengths: For every notation, the number of tokens of the sequences written for
+            the game, counted by length.
+    """
+
+    def __init__(self, headers=None):
+        self.headers = dict(headers or {})
+        self.legal_moves = []
+        self.pieces = []
+        self.moves = []
+        self.sequence_lengths = collections.defaultdict(collections.Counter)
+
+    @classmethod
+    def from_game(cls, game):
+        """
+        Summarizes a game parsed into a game tree.
+        """
+        summary = cls(game.headers)
+        board = game.board()
+        for move in game.mainline_moves():
+            summary.add_move(board, move)
+            board.push(move)
+        return summary
+
+    @property
+    def plies(self):
+        return len(self.moves)
+
+    def add_move(self, board, move):
+        """
+        Adds a move of the main line, with the board before the move.
+        """
+        self.legal_moves.append(board.legal_moves.count())
+        if board.is_castling(move):
+            self.pieces.append("K")
+        else:
+            self.pieces.append(
+                chess.piece_symbol(board.piece_type_at(move.from_square)).upper()
+            )
+        self.moves.append(move.uci())
+
+    def add_sequence(self, notation, length, count=1):
+        self.sequence_lengths[notation][length] += count
+
+    def add_game_sequences(self, notations):
+        """
+        Adds the sequence of the whole game for every notation.
+        """
+        for notation in notations:
+            self.add_sequence(notation, get_sequence_length(notation, self.plies))
+
+    def add_all_moves_sequences(self, notations):
+        """
+        Adds the sequences of `generate_all_moves` for every notation: for every position, the
+        game up to the position followed by each legal move, without a result.
+        """
+        for notation in notations:
+            for plies, count in enumerate(self.legal_moves, start=1):
+                length = get_sequence_length(notation, plies, result=False)
+                self.add_sequence(notation, length, count)
+
+
+class Statistic:
+    """
+    Accumulates values of games in named counters. Accumulators of the same statistic are merged
+    by adding their counters, and are stored as a dictionary of counters. The keys of the counters
+    are strings, so that they are the same after a round trip through JSON.
+
+    Subclasses set `name` and implement `add_game`, and `summary` to derive their results.
+    """
+
+    name = None
+
+    def __init__(self):
+        self.counters = collections.defaultdict(collections.Counter)
+
+    def add_game(self, game):
+        """
+        Adds a converted game.
+
+        Parameters:
+            game: The `GameSummary` of the game.
+        """
+        raise NotImplementedError
+
+    def merge(self, other):
+        """
+        Adds the counters of another accumulator of the statistic, e.g. of another shard.
+        """
+        for key, counter in other.counters.items():
+            self.counters[key].update(counter)
+        return self
+
+    def to_dict(self):
+        return {key: dict(counter) for key, counter in self.counters.items()}
+
+    @classmethod
+    def from_dict(cls, state):
+        statistic = cls()
+        for key, counter in state.items():
+            statistic.counters[key].update(counter)
+        return statistic
+
+    def summary(self):
+        return {key: histogram(counter) for key, counter in self.counters.items()}
+
+
+def histogram(counter):
+    """
+    Returns the counts of a counter with integer keys, sorted by key.
+    """
+    return {int(key): counter[key] for key in sorted(counter, key=int)}
+
+
+def average(counter):
+    """
+    Returns the average of the integer keys of a counter, weighted by their counts.
+    """
+    total = sum(counter.values())
+    if not total:
+        return 0
+    return sum(int(key) * count for key, count in counter.items()) / total
+
+
+class LegalMovesStatistic(Statistic):
+    """
+    Counts the positions by their number of legal moves. `average_per_game` is the average of the
+    averages of the games, like `AverageNumberOfLegalMovesPerPosition.analyze_pgn_file`.
+    """
+
+    name = "legal_moves"
+
+    def add_game(self, game):
+        positions = self.counters["positions"]
+        for legal_moves in game.legal_moves:
+            positions[str(legal_moves)] += 1
+        games = self.counters["games"]
+        games["games"] += 1
+        if game.legal_moves:
+            games["sum_of_averages"] += sum(game.legal_moves) / len(game.legal_moves)
+
+    def summary(self):
+        games = self.counters["games"]
+        return {
+            "average_per_position": average(self.counters["positions"]),
+            "average_per_game": (
+                games["sum_of_averages"] / games["games"] if games["games"] else 0
+            ),
+            "number_of_positions": sum(self.counters["positions"].values()),
+            "number_of_games": games["games"],
+            "histogram": histogram(self.counters["positions"]),
+        }
+
+
+class GameLengthStatistic(Statistic):
+    """
+    Counts the games by their number of plies.
+    """
+
+    name = "game_length"
+
+    def add_game(self, game):
+        self.counters["plies"][str(game.plies)] += 1
+
+    def summary(self):
+        return {
+            "average": average(self.counters["plies"]),
+            "histogram": histogram(self.counters["plies"]),
+        }
+
+
+class ResultStatistic(Statistic):
+    """
+    Counts the games by their result and by their termination.
+    """
+
+    name = "results"
+
+    def add_game(self, game):
+        self.counters["results"][game.headers.get("Result", "*")] += 1
+        self.counters["terminations"][game.headers.get("Termination", "?")] += 1
+
+    def summary(self):
+        return {key: dict(counter) for key, counter in self.counters.items()}
+
+
+class EloStatistic(Statistic):
+    """
+    Counts the games by the ELO of each player and by the average ELO, in buckets of
+    `bucket_size`. Unknown ratings are counted as "?".
+    """
+
+    name = "elo"
+    bucket_size = 100
+
+    def bucket(self, elos):
+        if not elos:
+            return "?"
+        return str(int(sum(elos) / len(elos)) // self.bucket_size * self.bucket_size)
+
+    def add_game(self, game):
+        elos = []
+        for player in ["White", "Black"]:
+            elo = game.headers.get(f"{player}Elo", "?")
+            if elo.isdigit():
+                elos.append(int(elo))
+                self.counters[player.lower()][self.bucket([int(elo)])] += 1
+            else:
+                self.counters[player.lower()]["?"] += 1
+        self.counters["average"][self.bucket(elos)] += 1
+
+    def summary(self):
+        summary = {}
+        for key, counter in self.counters.items():
+            known = collections.Counter(
+                {elo: count for elo, count in counter.items() if elo != "?"}
+            )
+            summary[key] = {**histogram(known), "?": counter["?"]}
+        return summary
+
+
+class MoveStatistic(Statistic):
+    """
+    Counts the moves of the games by their piece, and by their from and to squares.
+    """
+
+    name = "moves"
+    most_common = 20
+
+    def add_game(self, game):
+        self.counters["pieces"].update(game.pieces)
+        self.counters["moves"].update(game.moves)
+
+    def summary(self):
+        return {
+            "pieces": dict(self.counters["pieces"].most_common()),
+            "most_common_moves": dict(
+                self.counters["moves"].most_common(self.most_common)
+            ),
+            "number_of_different_moves": len(self.counters["moves"]),
+        }
+
+
+class TokenLengthStatistic(Statistic):
+    """
+    Counts the sequences written for the games by their number of tokens, for every notation of
+    the conversion. The sequences of `all_moves.pgn_to_all_moves` are counted in full, as if
+    their prefixes were not deduplicated.
+    """
+
+    name = "token_length"
+
+    def add_game(self, game):
+        for notation, lengths in game.sequence_lengths.items():
+            self.counters[notation].update(
+                {str(length): count for length, count in lengths.items()}
+            )
+
+    def summary(self):
+        return {
+            notation: {
+                "average": average(counter),
+                "max": max(map(int, counter), default=0),
+                "histogram": histogram(counter),
+            }
+            for notation, counter in self.counters.items()
+        }
+
+
+STATISTICS = {
+    statistic.name: statistic
+    for statistic in [
+        LegalMovesStatistic,
+        GameLengthStatistic,
+        ResultStatistic,
+        EloStatistic,
+        MoveStatistic,
+        TokenLengthStatistic,
+    ]
+}
+
+
+class CorpusStatistics:
+    """
+    The statistics of a conversion.
+
+    Parameters:
+        statistics: The statistics to collect: names in `STATISTICS` or `Statistic` subclasses.
+    """
+
+    def __init__(self, statistics):
+        self.statistics = {}
+        for statistic in statistics:
+            if isinstance(statistic, str):
+                if statistic not in STATISTICS:
+                    raise ValueError(f"Unknown statistic: {statistic}")
+                statistic = STATISTICS[statistic]
+            self.statistics[statistic.name] = statistic()
+
+    def add_game(self, game):
+        """
+        Adds the `GameSummary` of a converted game to every statistic.
+        """
+        for statistic in self.statistics.values():
+            statistic.add_game(game)
+
+    def merge(self, other):
+        for name, statistic in other.statistics.items():
+            self.statistics[name].merge(statistic)
+        return self
+
+    def merge_dict(self, state):
+        """
+        Merges statistics stored with `to_dict`, e.g. the statistics of a shard in the manifest.
+        """
+        for name, statistic in self.statistics.items():
+            statistic.merge(type(statistic).from_dict(state.get(name, {})))
+        return self
+
+    def to_dict(self):
+        return {
+            name: statistic.to_dict() for name, statistic in self.statistics.items()
+        }
+
+    def summary(self):
+        return {
+            name: statistic.summary() for name, statistic in self.statistics.items()
+        }
+
+    def save(self, path):
+        """
+        Writes the summary and the counters of the statistics to a JSON file.
+        """
+        with atomic_open(path) as file:
+            json.dump({"summary": self.summary(), "counters": self.to_dict()}, file)
@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+import unittest
+
+import chess.pgn
+
+from src.data_preprocessing.AverageNumberOfLegalMovesPerPosition import (
+    average_legal_moves_per_game,
+)
+from src.data_preprocessing.all_moves import pgn_to_all_moves
+from src.data_preprocessing.corpus_statistics import (
+    STATISTICS,
+    CorpusStatistics,
+    GameSummary,
+    Statistic,
+)
+from src.data_preprocessing.pgn_to_tokens import pgn_to_tokens, read_token_games
+from src.data_preprocessing.pgn_to_xLan_test import CrashingConverter, write_pgn
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+
+
+class FirstMoveStatistic(Statistic):
+    """
+    A statistic that is not in `STATISTICS`: counts the games by their first move.
+    """
+
+    name = "first_move"
+
+    def add_game(self, game):
+        self.counters["first_move"][game.moves[0]] += 1
+
+    def summary(self):
+        return dict(self.counters["first_move"])
+
+
+class corpus_statistics_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.directory.name, "games.pgn")
+        self.output_path = os.path.join(self.directory.name, "games.xlan")
+        write_pgn(self.input_path, repeat=20)
+
+        # the games that are converted: not lost on time and long enough
+        self.games = []
+        converter = pgn_to_xlan(None, None, min_number_of_moves_per_game=2)
+        with open(self.input_path) as pgn:
+            while game := chess.pgn.read_game(pgn):
+                if converter.is_game_accepted(game.headers) and converter.is_valid_game(
+                    game.end().board()
+                ):
+                    self.games.append(game)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def converter(self, converter_class=pgn_to_xlan, **kwargs):
+        return converter_class(
+            self.input_path,
+            self.output_path,
+            min_number_of_moves_per_game=2,
+            statistics=list(STATISTICS),
+            **kwargs,
+        )
+
+    def assertStatisticsEqual(self, statistics, expected):
+        # the sum of the averages of the games is a float that depends on the order of the sum
+        statistics = json.loads(json.dumps(statistics))
+        expected = json.loads(json.dumps(expected))
+        self.assertAlmostEqual(
+            statistics["legal_moves"]["games"].pop("sum_of_averages"),
+            expected["legal_moves"]["games"].pop("sum_of_averages"),
+        )
+        self.assertEqual(statistics, expected)
+
+    def test_statistics_of_converted_games(self):
+        converter = self.converter()
+        converter.convert_pgn()
+        summary = converter.game_statistics.summary()
+
+        legal_moves = summary["legal_moves"]
+        self.assertEqual(legal_moves["number_of_games"], len(self.games))
+        self.assertAlmostEqual(
+            legal_moves["average_per_game"],
+            sum(map(average_legal_moves_per_game, self.games)) / len(self.games),
+        )
+        plies = [len(list(game.mainline_moves())) for game in self.games]
+        self.assertEqual(legal_moves["number_of_positions"], sum(plies))
+        self.assertEqual(summary["game_length"]["average"], sum(plies) / len(plies))
+        self.assertEqual(summary["results"]["results"], {"0-1": 60, "1-0": 20})
+        self.assertEqual(summary["results"]["terminations"], {"Normal": 80})
+        self.assertEqual(
+            summary["elo"]["average"], {1500: 20, 1700: 20, 1800: 20, 1900: 20, "?": 0}
+        )
+        self.assertEqual(summary["moves"]["pieces"]["Q"], 9 * 20)
+        self.assertEqual(sum(summary["moves"]["pieces"].values()), sum(plies))
+        self.assertEqual(
+            summary["token_length"]["xLAN"]["average"], 3 * sum(plies) / len(plies) + 3
+        )
+
+        with open(converter.get_statistics_path()) as file:
+            self.assertEqual(
+                json.load(file)["counters"], converter.game_statistics.to_dict()
+            )
+
+    def test_parallel_statistics_match_sequential_statistics(self):
+        converter = self.converter()
+        converter.convert_pgn()
+        expected = converter.game_statistics.to_dict()
+
+        for num_shards, merge in [(1, True), (7, True), (3, False)]:
+            converter = self.converter()
+            converter.convert_pgn_parallel(num_shards=num_shards, merge=merge)
+            self.assertStatisticsEqual(converter.game_statistics.to_dict(), expected)
+
+        # a finished conversion reports the statistics of its manifest
+        converter = self.converter()
+        converter.convert_pgn_parallel(num_shards=3, merge=False)
+        self.assertStatisticsEqual(converter.game_statistics.to_dict(), expected)
+
+    def test_resumed_conversion_keeps_statistics(self):
+        converter = self.converter()
+        converter.convert_pgn_parallel(num_shards=8)
+        expected = converter.game_statistics.to_dict()
+        os.remove(converter.get_manifest_path())
+
+        crashing_converter = self.converter(CrashingConverter)
+        crashing_converter.crash_at = converter.get_shard_ranges(8)[2][0]
+        with self.assertRaises(RuntimeError):
+            crashing_converter.convert_pgn_parallel(num_shards=8)
+
+        converter = self.converter()
+        converter.convert_pgn_parallel(num_shards=8)
+        self.assertStatisticsEqual(converter.game_statistics.to_dict(), expected)
+
+    def test_token_lengths_of_token_conversion(self):
+        converter = self.converter(pgn_to_tokens, notations=["xLAN", "xLANplus"])
+        converter.convert_pgn_parallel(num_shards=3)
+        token_length = converter.game_statistics.summary()["token_length"]
+        for notation in ["xLAN", "xLANplus"]:
+            lengths = [
+                len(game)
+                for game in read_token_games(converter.get_output_path(notation))
+            ]
+            self.assertEqual(token_length[notation]["max"], max(lengths))
+            self.assertEqual(
+                token_length[notation]["average"], sum(lengths) / len(lengths)
+            )
+
+    def test_all_moves_statistics(self):
+        converter = self.converter(
+            pgn_to_all_moves, notation="xLANplus", deduplicate=False
+        )
+        converter.convert_pgn_parallel(num_shards=3)
+        summary = converter.game_statistics.summary()
+        self.assertEqual(
+            sum(summary["token_length"]["xLANplus"]["histogram"].values()),
+            converter.number_of_games_written,
+        )
+        self.assertEqual(
+            summary["legal_moves"]["number_of_positions"],
+            sum(len(list(game.mainline_moves())) for game in self.games),
+        )
+
+    def test_custom_statistic(self):
+        converter = pgn_to_xlan(
+            self.input_path,
+            self.output_path,
+            min_number_of_moves_per_game=2,
+            statistics=["results", FirstMoveStatistic],
+        )
+        converter.convert_pgn_parallel(num_shards=3)
+        summary = converter.game_statistics.summary()
+        self.assertEqual(set(summary), {"results", "first_move"})
+        self.assertEqual(summary["first_move"], {"g2g3": 20, "e2e4": 40, "f2f3": 20})
+
+    def test_merge_round_trip(self):
+        first, second, both = (CorpusStatistics(list(STATISTICS)) for _ in range(3))
+        for index, game in enumerate(self.games):
+            summary = GameSummary.from_game(game)
+            summary.add_game_sequences(["xLAN"])
+            (first if index % 2 else second).add_game(summary)
+            both.add_game(summary)
+        merged = CorpusStatistics(list(STATISTICS))
+        merged.merge_dict(json.loads(json.dumps(first.to_dict())))
+        merged.merge(second)
+        self.assertStatisticsEqual(merged.to_dict(), both.to_dict())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,401 @@
+"""
+PGN Index
+---------
+
+Records where every game of a PGN file starts, together with a few of its header fields, in a
+sidecar file next to the PGN file (`{pgn path}.index`). With the index, the k-th game, or the games
+with particular headers, can be read without scanning the file from its start, and the file can be
+split into shards with the same number of games instead of the same number of bytes.
+
+The index is built in a single pass with `build_pgn_index` and loaded with `load_pgn_index`, which
+returns None if the index is missing or the PGN file has changed since it was built.
+`open_pgn_index` builds the index if necessary.
+
+Every game is a fixed-size record (see `RECORD`):
+    stream          the position in the file of the compressed stream the game starts in, 0 for
+                    plain files (see `compressed_input`)
+    offset          the position of the game in the decompressed data of its stream
+    length          the length of the game text in bytes
+    white/black elo the ELO ratings of the players, 0 if unknown
+    result          the index of the result in `RESULTS`
+    termination     the index of the termination header in the list of the index
+    plies           the number of moves of the main line
+The records are followed by a JSON trailer with the size and the modification time of the PGN file
+and the list of terminations, and by the length of the trailer as an 8-byte integer.
+"""
+
+import argparse
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+
+from src.data_preprocessing.compressed_input import (
+    get_reader,
+    is_compressed,
+    open_input,
+)
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+from src.data_preprocessing.run_manifest import atomic_open
+
+RECORD = struct.Struct("<QQIHHBBH")
+TRAILER_LENGTH = struct.Struct("<Q")
+
+RESULTS = ["*", "1-0", "0-1", "1/2-1/2"]
+
+# The parts of the movetext that are not moves: comments, variations, move numbers, NAGs and results
+COMMENT = re.compile(r"\{[^}]*\}|;[^\n]*")
+VARIATION = re.compile(r"\([^()]*\)")
+MOVE_NUMBER = re.compile(r"\d+\.(?:\.\.)?")
+SAN_MOVE = re.compile(
+    r"(?<!\S)(?:[KQRBN]?[a-h]?[1-8]?x?[a-h][1-8](?:=?[QRBN])?|O-O(?:-O)?|--)[+#]?"
+)
+
+
+def get_index_path(input_path):
+    """
+    Returns the path of the index of a PGN file.
+    """
+    return f"{input_path}.index"
+
+
+def get_input_fingerprint(input_path):
+    stat = os.stat(input_path)
+    return {"input_size": stat.st_size, "input_mtime_ns": stat.st_mtime_ns}
+
+
+def count_plies(text):
+    """
+    Counts the moves of the main line of a game without parsing them, like the number of
+    `mainline_moves` of python-chess.
+
+    Parameters:
+        text: The text of a game, with or without its tags.
+    """
+    movetext = "\n".join(
+        line for line in text.splitlines() if not line.lstrip().startswith("[")
+    )
+    movetext = COMMENT.sub(" ", movetext)
+    while True:
+        movetext, variations = VARIATION.subn(" ", movetext)
+        if not variations:
+            break
+    return len(SAN_MOVE.findall(MOVE_NUMBER.sub(" ", movetext)))
+
+
+def parse_elo(value):
+    return int(value) if value and value.isdigit() else 0
+
+
+class GameEntry:
+    """
+    The index entry of a game.
+
+    Attributes:
+        stream, offset, length: Where the text of the game is, see the module documentation.
+        white_elo, black_elo: The ELO ratings of the players, None if unknown.
+        result: The result header, e.g. "1-0".
+        termination: The termination header, e.g. "Normal", or None if the game has none.
+        plies: The number of moves of the main line.
+    """
+
+    def __init__(self, record, terminations):
+        (
+            self.stream,
+            self.offset,
+            self.length,
+            white_elo,
+            black_elo,
+            result,
+            termination,
+            self.plies,
+        ) = record
+        self.white_elo = white_elo or None
+        self.black_elo = black_elo or None
+        self.result = RESULTS[result]
+        self.termination = terminations[termination]
+
+    def average_elo(self):
+        """
+        Returns the average ELO of the players with a known ELO, like the ELO filter of
+        `pgn_to_xlan`, or None if both are unknown.
+        """
+        elos = [elo for elo in (self.white_elo, self.black_elo) if elo is not None]
+        return sum(elos) / len(elos) if elos else None
+
+
+def build_pgn_index(input_path, index_path=None):
+    """
+    Reads a PGN file, which can be compressed, and writes the index of its games. Games are split
+    like in `pgn_to_xlan`, see `pgn_to_xlan.starts_game`.
+
+    Parameters:
+        input_path: The path of the PGN file.
+        index_path: The path of the index, default is `get_index_path(input_path)`.
+
+    Returns:
+        The `PgnIndex` of the file.
+    """
+    index_path = index_path or get_index_path(input_path)
+    fingerprint = get_input_fingerprint(input_path)
+    terminations = {None: 0}
+    number_of_games = 0
+    with open_input(input_path, "rb") as pgn, atomic_open(index_path, "wb") as index:
+        streams = get_reader(pgn).streams if is_compressed(input_path) else [(0, 0)]
+        for position, text in pgn_to_xlan.read_game_texts(pgn):
+            # the last stream that starts at or before the game
+            stream, stream_position = streams[
+                bisect.bisect_right(streams, position, key=lambda stream: stream[1]) - 1
+            ]
+            headers = pgn_to_xlan.parse_headers(text)
+            termination = headers.get("Termination")
+            if termination not in terminations:
+                if len(terminations) > 255:
+                    raise ValueError(f"Too many terminations in {input_path}")
+                terminations[termination] = len(terminations)
+            result = headers.get("Result", "*")
+            index.write(
+                RECORD.pack(
+                    stream,
+                    position - stream_position,
+                    len(text.encode("utf-8")),
+                    parse_elo(headers.get("WhiteElo")),
+                    parse_elo(headers.get("BlackElo")),
+                    RESULTS.index(result) if result in RESULTS else 0,
+                    terminations[termination],
+                    count_plies(text),
+                )
+            )
+            number_of_games += 1
+
+        trailer = json.dumps(
+            {
+                **fingerprint,
+                "number_of_games": number_of_games,
+                "terminations": list(terminations),
+            }
+        ).encode()
+        index.write(trailer)
+        index.write(TRAILER_LENGTH.pack(len(trailer)))
+    return PgnIndex(input_path, index_path)
+
+
+def load_pgn_index(input_path, index_path=None):
+    """
+    Loads the index of a PGN file.
+
+    Returns:
+        The `PgnIndex` of the file, or None if there is no index or the file has changed since the
+        index was built.
+    """
+    index_path = index_path or get_index_path(input_path)
+    if not os.path.exists(index_path):
+        return None
+    index = PgnIndex(input_path, index_path)
+    if not index.is_current():
+        index.close()
+        return None
+    return index
+
+
+def open_pgn_index(input_path, index_path=None):
+    """
+    Loads the index of a PGN file, or builds it if it is missing or out of date.
+    """
+    index = load_pgn_index(input_path, index_path)
+    if index is None:
+        index = build_pgn_index(input_path, index_path)
+    return index
+
+
+class PgnIndex:
+    """
+    The index of the games of a PGN file, see the module documentation. The records are memory
+    mapped, so that the index of a large file is not read into memory at once.
+
+    Parameters:
+        input_path: The path of the PGN file.
+        index_path: The path of the index, default is `get_index_path(input_path)`.
+    """
+
+    def __init__(self, input_path, index_path=None):
+        self.input_path = input_path
+        self.index_path = index_path or get_index_path(input_path)
+        with open(self.index_path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (trailer_length,) = TRAILER_LENGTH.unpack_from(
+            self.data, len(self.data) - TRAILER_LENGTH.size
+        )
+        self.records_size = len(self.data) - TRAILER_LENGTH.size - trailer_length
+        self.trailer = json.loads(self.data[self.records_size : -TRAILER_LENGTH.size])
+        self.terminations = self.trailer["terminations"]
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def is_current(self):
+        """
+        Checks whether the PGN file is unchanged since the index was built.
+        """
+        fingerprint = get_input_fingerprint(self.input_path)
+        return all(self.trailer[key] == value for key, value in fingerprint.items())
+
+    def __len__(self):
+        return self.trailer["number_of_games"]
+
+    def __getitem__(self, game_index):
+        """
+        Returns the `GameEntry` of the game with the given number, counted from 0.
+        """
+        if not 0 <= game_index < len(self):
+            raise IndexError(f"Game {game_index} is not in the index")
+        return GameEntry(
+            RECORD.unpack_from(self.data, game_index * RECORD.size), self.terminations
+        )
+
+    def __iter__(self):
+        for record in RECORD.iter_unpack(memoryview(self.data)[: self.records_size]):
+            yield GameEntry(record, self.terminations)
+
+    def select(
+        self,
+        elo_min=None,
+        elo_max=None,
+        results=None,
+        terminations=None,
+        min_plies=None,
+        max_plies=None,
+        predicate=None,
+    ):
+        """
+        Finds the games that match all of the given conditions.
+
+        Parameters:
+            elo_min, elo_max: The range of the average ELO of the players, see
+                `GameEntry.average_elo`. Games without ELO do not match if one of them is set.
+            results: The results to match, e.g. ["1-0", "0-1"].
+            terminations: The terminations to match, e.g. ["Normal"].
+            min_plies, max_plies: The range of the number of moves of the main line.
+            predicate: A function that takes a `GameEntry` and returns whether the game matches.
+
+        Returns:
+            The numbers of the matching games, in the order of the file.
+        """
+        game_indices = []
+        for game_index, entry in enumerate(self):
+            if elo_min is not None or elo_max is not None:
+                average_elo = entry.average_elo()
+                if average_elo is None:
+                    continue
+                if elo_min is not None and average_elo < elo_min:
+                    continue
+                if elo_max is not None and average_elo > elo_max:
+                    continue
+            if results is not None and entry.result not in results:
+                continue
+            if terminations is not None and entry.termination not in terminations:
+                continue
+            if min_plies is not None and entry.plies < min_plies:
+                continue
+            if max_plies is not None and entry.plies > max_plies:
+                continue
+            if predicate is not None and not predicate(entry):
+                continue
+            game_indices.append(game_index)
+        return game_indices
+
+    def read_games(self, game_indices):
+        """
+        Reads the texts of the given games. Games of a compressed file are read from the start of
+        their stream, so games in the same stream are best read in the order of the file.
+
+        Parameters:
+            game_indices: The numbers of the games, e.g. from `select`.
+
+        Yields:
+            The number and the text of every game.
+        """
+        pgn = None
+        stream = None
+        try:
+            for game_index in game_indices:
+                entry = self[game_index]
+                if not is_compressed(self.input_path):
+                    if pgn is None:
+                        pgn = open(self.input_path, "rb")
+                    pgn.seek(entry.offset)
+                else:
+                    # a compressed stream can only be read forward
+                    if stream != entry.stream or pgn.tell() > entry.offset:
+                        if pgn is not None:
+                            pgn.close()
+                        pgn = open_input(self.input_path, "rb", entry.stream)
+                        stream = entry.stream
+                    pgn.read(entry.offset - pgn.tell())
+                yield game_index, pgn.read(entry.length).decode("utf-8")
+        finally:
+            if pgn is not None:
+                pgn.close()
+
+    def read_game(self, game_index):
+        """
+        Returns the text of the game with the given number.
+        """
+        for _, text in self.read_games([game_index]):
+            return text
+
+    def get_game_position(self, game_index):
+        """
+        Returns the byte position in the PGN file at which a shard starting with the given game
+        has to start, see `get_shard_ranges`.
+        """
+        if game_index >= len(self):
+            return os.path.getsize(self.input_path)
+        entry = self[game_index]
+        return entry.stream if is_compressed(self.input_path) else entry.offset
+
+    def find_game(self, position):
+        """
+        Returns the number of the first game of a plain PGN file that starts at or after the given
+        byte position.
+        """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle].offset < position:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_shard_ranges(self, num_shards):
+        """
+        Splits the PGN file into byte ranges with the same number of games, one per shard, like
+        `pgn_to_xlan.get_shard_ranges` splits it into ranges of the same size. A compressed file
+        can only be split at the start of a stream, so its ranges are aligned to the stream of
+        their first game and can hold different numbers of games.
+        """
+        bounds = [
+            self.get_game_position(len(self) * index // num_shards)
+            for index in range(num_shards)
+        ] + [os.path.getsize(self.input_path)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the index of the games of a PGN file."
+    )
+    parser.add_argument("input_path", help="Path to the PGN file, can be compressed.")
+    args = parser.parse_args()
+
+    with build_pgn_index(args.input_path) as index:
+        print(f"Indexed {len(index)} games in {index.index_path}")
@@ -0,0 +1,144 @@
+import gzip
+import io
+import os
+import random
+import tempfile
+import unittest
+
+import chess.pgn
+
+from src.data_preprocessing.compressed_input_test import (
+    bgzf_compress,
+    multi_stream_bz2_compress,
+)
+from src.data_preprocessing.pgn_index import (
+    build_pgn_index,
+    count_plies,
+    get_index_path,
+    load_pgn_index,
+    open_pgn_index,
+)
+from src.data_preprocessing.pgn_to_xLan_test import random_game_texts, write_pgn
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+
+
+class pgn_index_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.directory.name, "games.pgn")
+        write_pgn(self.input_path, repeat=20)
+        with open(self.input_path, "rb") as pgn:
+            self.texts = [text for _, text in pgn_to_xlan.read_game_texts(pgn)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_index_records_games(self):
+        with build_pgn_index(self.input_path) as index:
+            self.assertEqual(len(index), 100)
+            for game_index, entry in enumerate(index):
+                game = chess.pgn.read_game(io.StringIO(self.texts[game_index]))
+                self.assertEqual(entry.result, game.headers["Result"])
+                self.assertEqual(entry.termination, game.headers["Termination"])
+                self.assertEqual(entry.white_elo, int(game.headers["WhiteElo"]))
+                self.assertEqual(entry.plies, len(list(game.mainline_moves())))
+            self.assertEqual(index.read_game(42), self.texts[42])
+            self.assertEqual(
+                index[99].offset + index[99].length, os.path.getsize(self.input_path)
+            )
+
+    def test_count_plies(self):
+        for text in random_game_texts(20):
+            game = chess.pgn.read_game(io.StringIO(text))
+            self.assertEqual(count_plies(text), len(list(game.mainline_moves())))
+        self.assertEqual(
+            count_plies(
+                "1.e4 {a (b) c4} e5 (1... c5 2. Nf3) 2. Nf3 $1 Nc6?! 3. O-O+ 1-0"
+            ),
+            5,
+        )
+
+    def test_select_games(self):
+        with build_pgn_index(self.input_path) as index:
+            self.assertEqual(index.select(results=["1-0"]), list(range(4, 100, 5)))
+            self.assertEqual(
+                index.select(terminations=["Normal"], elo_min=1700, max_plies=8),
+                [game_index for game_index in range(100) if game_index % 5 >= 3],
+            )
+            selected = index.select(predicate=lambda entry: entry.plies > 10)
+            self.assertEqual(
+                [text for _, text in index.read_games(selected)],
+                [self.texts[game_index] for game_index in range(2, 100, 5)],
+            )
+
+    def test_stale_index_is_rebuilt(self):
+        build_pgn_index(self.input_path).close()
+        self.assertIsNotNone(load_pgn_index(self.input_path))
+
+        with open(self.input_path, "a") as file:
+            file.write(self.texts[0])
+        self.assertIsNone(load_pgn_index(self.input_path))
+        with open_pgn_index(self.input_path) as index:
+            self.assertEqual(len(index), 101)
+            self.assertEqual(index.read_game(100), self.texts[0])
+
+    def test_compressed_index_reads_games(self):
+        with open(self.input_path, "rb") as file:
+            data = file.read()
+        compressed_files = {
+            # streams end in the middle of games
+            "games.pgn.bz2": multi_stream_bz2_compress(data, stream_size=700),
+            "games.pgn.gz": bgzf_compress(data, block_size=1000),
+            "games.single.pgn.gz": gzip.compress(data),
+        }
+        game_indices = list(range(100))
+        random.Random(0).shuffle(game_indices)
+        for name, content in compressed_files.items():
+            compressed_path = os.path.join(self.directory.name, name)
+            with open(compressed_path, "wb") as file:
+                file.write(content)
+            with build_pgn_index(compressed_path) as index:
+                self.assertEqual(len(index), 100)
+                self.assertEqual(
+                    dict(index.read_games(game_indices)),
+                    dict(enumerate(self.texts)),
+                )
+                self.assertEqual(
+                    [text for _, text in index.read_games(range(100))], self.texts
+                )
+
+    def test_shards_by_game_count(self):
+        with build_pgn_index(self.input_path) as index:
+            for num_shards in [1, 3, 7]:
+                shard_ranges = index.get_shard_ranges(num_shards)
+                with open(self.input_path, "rb") as pgn:
+                    counts = []
+                    for start, end in shard_ranges:
+                        pgn.seek(start)
+                        counts.append(len(list(pgn_to_xlan.read_game_texts(pgn, end))))
+                self.assertEqual(sum(counts), 100)
+                self.assertLessEqual(max(counts) - min(counts), 1)
+
+        output_path = os.path.join(self.directory.name, "games.xlan")
+        converter = pgn_to_xlan(self.input_path, output_path)
+        converter.convert_pgn_parallel(num_shards=1)
+        with open(output_path) as file:
+            expected = file.read()
+        converter = pgn_to_xlan(self.input_path, output_path)
+        converter.convert_pgn_parallel(num_shards=3, shard_by_games=True)
+        with open(output_path) as file:
+            self.assertEqual(file.read(), expected)
+
+    def test_get_game_positions_uses_index(self):
+        converter = pgn_to_xlan(self.input_path, None)
+        with open(self.input_path) as pgn:
+            expected = converter.get_game_positions(pgn, 10)
+        build_pgn_index(self.input_path).close()
+        self.assertTrue(os.path.exists(get_index_path(self.input_path)))
+        with open(self.input_path) as pgn:
+            self.assertEqual(converter.get_game_positions(pgn, 10), expected)
+            self.assertEqual(len(converter.get_game_positions(pgn, 1000)), 100)
+
+
+if __name__ == "__main__":
+    unittest.main()
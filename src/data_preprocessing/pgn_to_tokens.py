@@ -0,0 +1,456 @@
+"""
+PGN to Token IDs
+----------------
+
+Converts a PGN file directly to the token IDs used for training, in a single pass. The separate
+passes of the text pipeline (PGN to xLAN text with `pgn_to_xlan`, xLAN text to tokens with
+`tokenize_file`, xLAN+ to xLANchk/xLANcap with `xlanplus_to_xlan_cap_chk`) each read and write the
+whole corpus; here the moves are tokenized while the games are parsed. Several notations can be
+written in the same pass, since they share the replay of the game on the board.
+
+Every game is written as `STARTSEQ`, the tokens of its moves, its result and `GAMESEP`, one byte
+per token ID (all vocabularies have less than 256 tokens). The games of a file can therefore be
+split at the `GAMESEP` tokens, see `read_token_games`. There is one output file per notation:
+`{output_path}.{notation}.bin`, e.g. `games.xlanplus.bin`.
+
+Usage:
+    python -m src.data_preprocessing.pgn_to_tokens games.pgn.bz2 games --notations xLAN xLANplus
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import os
+import shutil
+
+import chess
+import chess.pgn
+
+from src.data_preprocessing.corpus_statistics import GameSummary
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+from src.data_preprocessing.run_manifest import atomic_open
+from src.data_preprocessing.xlanplus_to_xlan_cap_chk import get_replacements
+from src.tokenizer.tokenizer import load_tokens
+
+# the notations that derive their move suffix from the xLAN+ suffix, see xlanplus_to_xlan_cap_chk
+SUFFIX_MODES = {"xLANchk": "chk", "xLANcap": "cap"}
+
+
+def get_suffix_tokens(notation):
+    """
+    Maps the xLAN+ suffix of a move ("-", "+", "#", "$", "!", "x") to the token ID of its suffix in
+    the given notation.
+
+    Returns:
+        A dictionary, or None if the moves of the notation have no suffix (xLAN).
+    """
+    tokens = load_tokens(notation)
+    if not tokens.get("plusTokens"):
+        return None
+    replacements = get_replacements("xlanplus", SUFFIX_MODES.get(notation)) or {}
+    return {
+        suffix: tokens["plusTokens"][replacements.get(suffix, suffix)]
+        for suffix in ["-", "+", "#", "$", "!", "x"]
+    }
+
+
+def get_move_suffix(capture, check, mate):
+    """
+    Returns the xLAN+ suffix of a move.
+    """
+    if mate:
+        return "!" if capture else "#"
+    if check:
+        return "$" if capture else "+"
+    return "x" if capture else "-"
+
+
+def move_to_tokens(board, move, notation, suffix_tokens):
+    """
+    Tokenizes a move that can be played on the board, like `TokenVisitor` tokenizes the moves of a
+    game. Castling is tokenized as a king move.
+
+    Parameters:
+        board: The board before the move.
+        move: The move.
+        notation: The notation of the tokens.
+        suffix_tokens: The suffix tokens of the notation, see `get_suffix_tokens`.
+
+    Returns:
+        The token IDs of the move as bytes.
+    """
+    tokens = load_tokens(notation)
+    if board.is_castling(move):
+        piece = "K"
+    else:
+        piece = chess.piece_symbol(
+            move.promotion or board.piece_type_at(move.from_square)
+        ).upper()
+    move_tokens = [
+        tokens["pieces"][piece],
+        tokens["squares"][chess.square_name(move.from_square)],
+        tokens["squares"][chess.square_name(move.to_square)],
+    ]
+    if suffix_tokens is not None:
+        check = board.gives_check(move)
+        mate = False
+        if check:
+            board.push(move)
+            mate = board.is_checkmate()
+            board.pop()
+        suffix = get_move_suffix(board.is_capture(move), check, mate)
+        move_tokens.append(suffix_tokens[suffix])
+    return bytes(move_tokens)
+
+
+def split_token_games(data):
+    """
+    Splits the content of a token file into its games, each ending with `GAMESEP`.
+    """
+    game_separator = bytes([load_tokens("xLAN")["gameSeparator"]["GAMESEP"]])
+    return [game + game_separator for game in data.split(game_separator)[:-1]]
+
+
+def read_token_games(path):
+    """
+    Reads the games of a token file written by `pgn_to_tokens`.
+
+    Returns:
+        A list with the token IDs of every game.
+    """
+    with open(path, "rb") as file:
+        return [list(game) for game in split_token_games(file.read())]
+
+
+class pgn_to_tokens(pgn_to_xlan):
+    """
+    Converts a PGN file to token IDs in one or more notations, see the module documentation.
+    The games are filtered like in `pgn_to_xlan`, and `convert_pgn` and `convert_pgn_parallel`
+    work the same way, with one output file per notation.
+
+    The tokens are the same as the tokens of the text pipeline, except for a castling that mates:
+    its xLAN text keeps the SAN form ("O-O#"), which the tokenizer cannot read, whereas here it is
+    tokenized like every other king move.
+
+    Parameters:
+        input_path: Path to the PGN file, can be compressed (.gz, .bz2, .xz)
+        output_path: Path of the output files without the notation and the extension
+        notations: The notations to write, keys of notation.json. Default is xLANplus.
+        The other parameters are the ones of `pgn_to_xlan`; all moves cannot be generated.
+    """
+
+    def __init__(self, input_path, output_path, notations=("xLANplus",), **kwargs):
+        if kwargs.get("generate_all_moves"):
+            raise ValueError("pgn_to_tokens cannot generate all moves.")
+        super().__init__(input_path, output_path, **kwargs)
+        self.notations = list(notations)
+        self.suffix_tokens = {
+            notation: get_suffix_tokens(notation) for notation in self.notations
+        }
+
+    def get_output_path(self, notation):
+        """
+        Returns the path of the output file of a notation.
+        """
+        return f"{self.output_path}.{notation.lower()}.bin"
+
+    def get_shard_path(self, shard_index, notation):
+        """
+        Returns the path of the output file of a shard for a notation.
+        """
+        return f"{self.get_output_path(notation)}.shard{shard_index:04d}"
+
+    def get_shard_outputs(self, shard_index):
+        return [
+            self.get_shard_path(shard_index, notation) for notation in self.notations
+        ]
+
+    def get_outputs(self):
+        return [self.get_output_path(notation) for notation in self.notations]
+
+    def get_manifest_path(self):
+        return f"{self.output_path}.manifest.json"
+
+    def get_notations(self):
+        return self.notations
+
+    def get_run_fingerprint(self, shard_ranges, merge):
+        return {
+            **super().get_run_fingerprint(shard_ranges, merge),
+            "notations": self.notations,
+        }
+
+    def convert_game_text(self, text):
+        """
+        Converts the text of a game to token IDs with `TokenVisitor`.
+
+        Returns:
+            A dictionary with the tokens of the game for every notation, as bytes, or None if
+            the game is not valid.
+        """
+        return chess.pgn.read_game(
+            io.StringIO(text), Visitor=lambda: TokenVisitor(self, self.notations)
+        )
+
+    def write_games(self, games, outfiles):
+        """
+        Converts the given game texts and writes their tokens to the output file of each notation.
+        Stops after `number_of_games_to_write` games.
+
+        Parameters:
+            games: The position and the text of every game, see `pgn_to_xlan.read_game_texts`.
+            outfiles: The output file of every notation, opened in binary mode.
+
+        Returns:
+            The number of games processed, the number of games written and the number of games
+            rejected by each header filter.
+        """
+        games_processed = 0
+        games_written = 0
+        rejected_games = collections.Counter()
+        buffers = {notation: [] for notation in self.notations}
+        for _, text in games:
+            if 0 <= self.number_of_games_to_write <= games_written:
+                break
+            games_processed += 1
+            reason = self.get_rejection_reason(self.parse_headers(text))
+            if reason is not None:
+                rejected_games[reason] += 1
+                continue
+
+            tokens = self.convert_game_text(text)
+            if tokens is None:
+                continue
+            games_written += 1
+            for notation, game_tokens in tokens.items():
+                buffers[notation].append(game_tokens)
+
+            if len(buffers[self.notations[0]]) >= self.chunk_size:
+                for notation, buffer in buffers.items():
+                    outfiles[notation].write(b"".join(buffer))
+                    buffer.clear()
+        for notation, buffer in buffers.items():
+            outfiles[notation].write(b"".join(buffer))
+        return games_processed, games_written, rejected_games
+
+    @contextlib.contextmanager
+    def open_outputs(self, get_path):
+        """
+        Opens the output file of every notation with `atomic_open`.
+
+        Parameters:
+            get_path: Returns the path of the output file of a notation.
+        """
+        with contextlib.ExitStack() as stack:
+            yield {
+                notation: stack.enter_context(atomic_open(get_path(notation), "wb"))
+                for notation in self.notations
+            }
+
+    def convert_shard(self, shard_index, start, end):
+        """
+        Converts the games that start in the given byte range and writes their tokens to the
+        output files of the shard, see `pgn_to_xlan.convert_shard`.
+        """
+        with self.open_outputs(
+            lambda notation: self.get_shard_path(shard_index, notation)
+        ) as outfiles:
+            return self.write_games(self.read_shard_games(start, end), outfiles)
+
+    def convert_range(self, byte_range):
+        """
+        Converts the games that start in the given byte range in a worker process of the
+        streaming conversion, see `pgn_to_xlan.convert_range`.
+        """
+        start, end = byte_range
+        buffers = {notation: io.BytesIO() for notation in self.notations}
+        games_processed, games_written, rejected_games = self.write_games(
+            self.read_shard_games(start, end), buffers
+        )
+        games = [
+            split_token_games(buffers[notation].getvalue())
+            for notation in self.notations
+        ]
+        return games_processed, games_written, rejected_games, games
+
+    def merge_shards(self, num_shards):
+        """
+        Concatenates the output files of the shards in order into the output file of each notation
+        and deletes them once the output files are complete. Keeps at most
+        `number_of_games_to_write` games.
+        """
+        for notation in self.notations:
+            games_written = 0
+            with atomic_open(self.get_output_path(notation), "wb") as outfile:
+                for shard_index in range(num_shards):
+                    shard_path = self.get_shard_path(shard_index, notation)
+                    with open(shard_path, "rb") as shard:
+                        if self.number_of_games_to_write == -1:
+                            shutil.copyfileobj(shard, outfile)
+                        elif games_written < self.number_of_games_to_write:
+                            games = split_token_games(shard.read())
+                            games = games[
+                                : self.number_of_games_to_write - games_written
+                            ]
+                            outfile.write(b"".join(games))
+                            games_written += len(games)
+        for shard_index in range(num_shards):
+            for shard_path in self.get_shard_outputs(shard_index):
+                os.remove(shard_path)
+
+    def convert_pgn(self):
+        """
+        Converts all games in the PGN file to token IDs in a single process and writes them to
+        the output file of each notation.
+        """
+        start_time = self.start_logging()
+        self.game_statistics = self.new_statistics()
+        with self.open_outputs(self.get_output_path) as outfiles:
+            games_processed, games_written, rejected_games = self.write_games(
+                self.read_shard_games(0, os.path.getsize(self.input_path)), outfiles
+            )
+        self.number_of_games_processed += games_processed
+        self.number_of_games_written += games_written
+        self.rejected_games.update(rejected_games)
+        print(f"\tNumber of writen games: {self.number_of_games_written}")
+        print(f"\tRejected games: {dict(self.rejected_games)}")
+        self.save_statistics()
+
+        if self.log:
+            self.final_logging(start_time)
+
+
+class TokenVisitor(chess.pgn.BaseVisitor):
+    """
+    Converts a game to token IDs in several notations while it is parsed, without building a game
+    tree or formatting the moves as text. Every move is analysed once (piece, squares, capture,
+    check and mate) and then tokenized for each notation.
+
+    Usage:
+        chess.pgn.read_game(pgn, Visitor=lambda: TokenVisitor(converter, ["xLAN", "xLANplus"]))
+
+    Parameters:
+        converter: The pgn_to_tokens instance with the settings of the conversion.
+        notations: The notations to tokenize the game in.
+    """
+
+    def __init__(self, converter, notations):
+        self.converter = converter
+        self.notations = notations
+        self.tokens = {notation: load_tokens(notation) for notation in notations}
+
+    def begin_game(self):
+        self.games = {
+            notation: [self.tokens[notation]["paddingToken"]["STARTSEQ"]]
+            for notation in self.notations
+        }
+        self.result_token = "*"
+        self.board = None
+        self.pending_move = None
+        self.summary = None
+        if self.converter.game_statistics is not None:
+            self.summary = GameSummary()
+
+    def visit_header(self, tagname, tagvalue):
+        if tagname == "Result":
+            self.result_token = tagvalue
+        if self.summary is not None:
+            self.summary.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if self.summary is not None:
+            self.summary.add_move(board, move)
+        if board.is_castling(move):
+            piece = "K"
+        else:
+            piece = chess.piece_symbol(
+                move.promotion or board.piece_type_at(move.from_square)
+            ).upper()
+        self.pending_move = (move, piece, board.is_capture(move))
+
+    def visit_board(self, board):
+        self.board = board
+        if self.pending_move is not None:
+            self.add_move(*self.pending_move)
+            self.pending_move = None
+
+    def visit_result(self, result):
+        if self.result_token == "*":
+            self.result_token = result
+
+    def handle_error(self, error):
+        # like the game builder of python-chess, the rest of the game is skipped
+        pass
+
+    def add_move(self, move, piece, capture):
+        """
+        Adds the tokens of the move that has just been pushed to `self.board`.
+        """
+        check = self.board.is_check()
+        suffix = get_move_suffix(capture, check, check and self.board.is_checkmate())
+
+        from_square = chess.square_name(move.from_square)
+        to_square = chess.square_name(move.to_square)
+        for notation, game in self.games.items():
+            tokens = self.tokens[notation]
+            game.append(tokens["pieces"][piece])
+            game.append(tokens["squares"][from_square])
+            game.append(tokens["squares"][to_square])
+            suffix_tokens = self.converter.suffix_tokens[notation]
+            if suffix_tokens is not None:
+                game.append(suffix_tokens[suffix])
+
+    def result(self):
+        """
+        Returns the tokens of the game for every notation as bytes, or None if it is not a valid
+        game.
+        """
+        if self.board is None or not self.converter.is_valid_game(self.board):
+            return None
+        games = {}
+        for notation, game in self.games.items():
+            tokens = self.tokens[notation]
+            if self.result_token not in tokens["results"]:
+                return None
+            game.append(tokens["results"][self.result_token])
+            game.append(tokens["gameSeparator"]["GAMESEP"])
+            games[notation] = bytes(game)
+        if self.summary is not None:
+            for notation, game in games.items():
+                self.summary.add_sequence(notation, len(game))
+            self.converter.game_statistics.add_game(self.summary)
+        return games
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a PGN file to token IDs in one or more notations."
+    )
+    parser.add_argument("input_path", help="The PGN file, can be compressed.")
+    parser.add_argument(
+        "output_path", help="The path of the output files without the extension."
+    )
+    parser.add_argument(
+        "--notations",
+        nargs="+",
+        default=["xLANplus"],
+        help="The notations to write, e.g. xLAN xLANplus xLANchk xLANcap.",
+    )
+    parser.add_argument(
+        "--min-moves", type=int, default=10, help="Minimum number of moves per game."
+    )
+    parser.add_argument(
+        "--shards", type=int, default=None, help="Number of shards to convert."
+    )
+    args = parser.parse_args()
+
+    pgn_to_tokens(
+        args.input_path,
+        args.output_path,
+        notations=args.notations,
+        min_number_of_moves_per_game=args.min_moves,
+    ).convert_pgn_parallel(num_shards=args.shards)
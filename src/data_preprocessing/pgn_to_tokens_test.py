@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+
+from src.data_preprocessing.pgn_to_tokens import pgn_to_tokens, read_token_games
+from src.data_preprocessing.pgn_to_xLan_test import random_game_texts, write_pgn
+from src.data_preprocessing.pgn_to_xlan import pgn_to_xlan
+from src.data_preprocessing.xlanplus_to_xlan_cap_chk import get_replacements
+from src.tokenizer.tokenizer import tokenize_data
+
+NOTATIONS = ["xLAN", "xLANplus", "xLANchk", "xLANcap"]
+
+
+def tokenize_with_text_pipeline(text, notation):
+    """
+    Tokenizes a game like the separate passes do: PGN to xLAN text, xLAN+ to xLANchk or xLANcap,
+    and text to tokens.
+    """
+    converter = pgn_to_xlan(
+        None, None, min_number_of_moves_per_game=2, xLanPlus=notation != "xLAN"
+    )
+    xlan = "".join(converter.convert_game_text(text))
+    if not xlan:
+        return None
+    mode = {"xLANchk": "chk", "xLANcap": "cap"}.get(notation)
+    for old, new in (get_replacements("xlanplus", mode) or {}).items():
+        xlan = xlan.replace(old, new)
+    return [int(token) for token in tokenize_data(xlan, notation).split()]
+
+
+class pgn_to_tokens_test(unittest.TestCase):
+    def setUp(self):
+        self.converter = pgn_to_tokens(
+            None, None, notations=NOTATIONS, min_number_of_moves_per_game=2
+        )
+
+    def test_tokens_match_text_pipeline(self):
+        texts = random_game_texts(10)
+        for text in texts[:-1]:
+            tokens = self.converter.convert_game_text(text)
+            for notation in NOTATIONS:
+                self.assertEqual(
+                    list(tokens[notation]),
+                    tokenize_with_text_pipeline(text, notation),
+                    notation,
+                )
+
+    def test_castling_mate_is_tokenized_as_king_move(self):
+        converter = pgn_to_tokens(
+            None, None, notations=NOTATIONS, min_number_of_moves_per_game=0
+        )
+        tokens = converter.convert_game_text(random_game_texts(0)[-1])
+        # STARTSEQ, then the king move e1-g1 with the mate suffix
+        self.assertEqual(list(tokens["xLAN"][:4]), [75, 1, 39, 55])
+        self.assertEqual(list(tokens["xLANplus"][:5]), [75, 1, 39, 55, 78])
+        self.assertEqual(list(tokens["xLANchk"][:5]), [75, 1, 39, 55, 78])
+        self.assertEqual(list(tokens["xLANcap"][:5]), [75, 1, 39, 55, 76])
+
+    def test_convert_pgn_parallel_matches_sequential_conversion(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            write_pgn(input_path, repeat=20)
+            output_path = os.path.join(directory, "games")
+
+            converter = pgn_to_tokens(
+                input_path, output_path, NOTATIONS, min_number_of_moves_per_game=2
+            )
+            converter.convert_pgn()
+            self.assertEqual(converter.number_of_games_written, 80)
+            expected = {}
+            expected_games = read_token_games(converter.get_output_path("xLAN"))
+            self.assertEqual(len(expected_games), 80)
+            for notation in NOTATIONS:
+                path = converter.get_output_path(notation)
+                with open(path, "rb") as file:
+                    expected[notation] = file.read()
+
+            for num_shards in [1, 3, 16]:
+                pgn_to_tokens(
+                    input_path, output_path, NOTATIONS, min_number_of_moves_per_game=2
+                ).convert_pgn_parallel(num_shards=num_shards)
+                for notation in NOTATIONS:
+                    with open(converter.get_output_path(notation), "rb") as file:
+                        self.assertEqual(file.read(), expected[notation])
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["games.manifest.json", "games.pgn"]
+                + sorted(f"games.{notation.lower()}.bin" for notation in NOTATIONS),
+            )
+
+            pgn_to_tokens(
+                input_path,
+                output_path,
+                ["xLAN"],
+                min_number_of_moves_per_game=2,
+                number_of_games_to_write=30,
+            ).convert_pgn_parallel(num_shards=3)
+            games = read_token_games(converter.get_output_path("xLAN"))
+            self.assertEqual(games, expected_games[:30])
+
+
+if __name__ == "__main__":
+    unittest.main()
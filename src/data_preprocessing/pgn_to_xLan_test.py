@@ -1,7 +1,109 @@
+import bz2
+import gzip
+import json
+import os
+import random
+import tempfile
 import unittest
 import chess.pgn
 from pgn_to_xlan import pgn_to_xlan
 from io import StringIO
+from src.data_preprocessing.compressed_input_test import multi_stream_bz2_compress
+
+GAMES = [
+    ("Normal", "1. g3 e6 2. Bg2 Qf6 3. f4 Bc5 4. e4 Qd4 5. e5 Qf2# 0-1"),
+    ("Time forfeit", "1. e4 e5 2. Nf3 Nc6 0-1"),
+    (
+        "Normal",
+        "1. e4 Nc6 2. Nf3 e5 3. Bb5 a6 4. Bc4 Nd4 5. Nxe5 Qg5 6. Nxf7 Qxg2 7. Rf1 Qxe4+ 8. Be2 Nf3# 0-1",
+    ),
+    ("Normal", "1. f3 e5 2. g4 Qh4# 0-1"),
+    ("Normal", "1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# 1-0"),
+]
+
+
+def random_game_texts(number_of_games, seed=0):
+    """
+    Plays random games until they end. The last games start with castling that checks and mates.
+    """
+    rng = random.Random(seed)
+    starts = [chess.STARTING_FEN] * number_of_games + [
+        "5k2/8/8/8/8/8/8/4K2R w K - 0 1",
+        "4rkr1/4p1p1/8/8/8/8/8/4K2R w K - 0 1",
+    ]
+    texts = []
+    for fen in starts:
+        board = chess.Board(fen)
+        if fen != chess.STARTING_FEN:
+            board.push_san("O-O")
+        while not board.is_game_over():
+            board.push(rng.choice(list(board.legal_moves)))
+        texts.append(str(chess.pgn.Game.from_board(board)))
+    return texts
+
+
+def write_pgn(path, repeat=1):
+    """
+    Writes the test games in the format of the Lichess database.
+    """
+    with open(path, "w") as file:
+        for index in range(repeat):
+            for game_index, (termination, moves) in enumerate(GAMES):
+                file.write(f'[Event "Rated Blitz game"]\n')
+                file.write(f'[Site "https://lichess.org/{index}x{game_index}"]\n')
+                file.write(f'[Result "{moves.split()[-1]}"]\n')
+                file.write(f'[WhiteElo "{1500 + 100 * game_index}"]\n')
+                file.write(f'[BlackElo "{1500 + 100 * game_index}"]\n')
+                file.write(f'[Termination "{termination}"]\n\n')
+                file.write(f"{moves}\n\n")
+
+
+# games whose comments continue on lines that begin with `[`
+COMMENTED_GAMES = """[Site "https://lichess.org/comment0"]
+[Result "1-0"]
+
+1. e4 { opening
+[%clk 0:03:00] } e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0
+
+[Site "https://lichess.org/comment1"]
+[Result "1-0"]
+
+1. e4 { a comment
+[Note "inside"]
+} e5 2. Qh5 Nc6 3. Bc4 Nf6 4. Qxf7# 1-0
+
+"""
+
+
+def remove_event_tags(path, insert=""):
+    """
+    Removes the `[Event` tags of a PGN file, so its games start with another tag, and inserts a
+    text after the first game.
+    """
+    with open(path) as file:
+        text = file.read().replace('[Event "Rated Blitz game"]\n', "")
+    first_game_end = text.index("\n\n[") + 2
+    with open(path, "w") as file:
+        file.write(text[:first_game_end] + insert + text[first_game_end:])
+
+
+class CrashingConverter(pgn_to_xlan):
+    """
+    Fails in the third shard, or in the streamed shard that starts at `crash_at`, like a
+    conversion that is killed.
+    """
+
+    crash_at = None
+
+    def convert_shard(self, shard_index, start, end):
+        if shard_index == 2:
+            raise RuntimeError("killed")
+        return super().convert_shard(shard_index, start, end)
+
+    def convert_range(self, byte_range):
+        if byte_range[0] == self.crash_at:
+            raise RuntimeError("killed")
+        return super().convert_range(byte_range)
 
 
 class pgn_to_xlan_test(unittest.TestCase):
@@ -49,6 +151,280 @@ class pgn_to_xlan_test(unittest.TestCase):
             "1. Pe2-e4 Nb8-c6 2. Ng1-f3 Pe7-e5 3. Bf1-b5 Pa7-a6 4. Bb5-c4 Nc6-d4 5. Nf3xe5 Qd8-g5 6. Ne5xf7 Qg5xg2 7. Rh1-f1 Qg2xe4+ 8. Bc4-e2 Nd4-f3# 0-1",
         )
 
+    def test_convert_pgn_parallel_matches_sequential_conversion(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=20)
+
+            sequential_converter = pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            expected = []
+            with open(input_path) as pgn:
+                while game := chess.pgn.read_game(pgn):
+                    if sequential_converter.is_game_accepted(game.headers):
+                        expected.extend(sequential_converter.game_to_xlan(game))
+            expected = [game for game in expected if game]
+            self.assertEqual(len(expected), 80)
+
+            for num_shards in [1, 3, 7, 64]:
+                converter = pgn_to_xlan(
+                    input_path, output_path, min_number_of_moves_per_game=2
+                )
+                converter.convert_pgn_parallel(num_shards=num_shards)
+                with open(output_path) as file:
+                    self.assertEqual(file.read().splitlines(), expected)
+                self.assertEqual(converter.number_of_games_processed, 100)
+                self.assertEqual(
+                    sorted(os.listdir(directory)),
+                    ["games.pgn", "games.xlan", "games.xlan.manifest.json"],
+                )
+
+    def test_interrupted_conversion_resumes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=20)
+            converter = pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            converter.convert_pgn_parallel(num_shards=4)
+            with open(output_path) as file:
+                expected = file.read()
+            os.remove(output_path)
+
+            with self.assertRaises(RuntimeError):
+                CrashingConverter(
+                    input_path, output_path, min_number_of_moves_per_game=2
+                ).convert_pgn_parallel(num_shards=4, merge=False)
+            with open(converter.get_manifest_path()) as file:
+                completed = json.load(file)["completed"]
+            self.assertIn("0", completed)
+            self.assertNotIn("2", completed)
+            self.assertFalse(os.path.exists(converter.get_shard_path(2)))
+            self.assertFalse(os.path.exists(converter.get_shard_path(2) + ".tmp"))
+            first_shard_modified = os.stat(converter.get_shard_path(0)).st_mtime_ns
+
+            converter = pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            converter.convert_pgn_parallel(num_shards=4, merge=False)
+            self.assertEqual(converter.number_of_games_processed, 100)
+            self.assertEqual(
+                os.stat(converter.get_shard_path(0)).st_mtime_ns, first_shard_modified
+            )
+            converter.merge_shards(4)
+            with open(output_path) as file:
+                self.assertEqual(file.read(), expected)
+
+    def test_interrupted_streaming_conversion_resumes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=20)
+            converter = pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            converter.convert_pgn_parallel(num_shards=8)
+            with open(output_path) as file:
+                expected = file.read()
+            os.remove(output_path)
+            os.remove(converter.get_manifest_path())
+
+            crashing_converter = CrashingConverter(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            crashing_converter.crash_at = converter.get_shard_ranges(8)[2][0]
+            with self.assertRaises(RuntimeError):
+                crashing_converter.convert_pgn_parallel(num_shards=8)
+            with open(converter.get_manifest_path()) as file:
+                self.assertEqual(list(json.load(file)["completed"]), ["0", "1"])
+            self.assertFalse(os.path.exists(output_path))
+            # output of a shard that was being written when the conversion was killed
+            with open(output_path + ".tmp", "a") as file:
+                file.write("1. Pe2-e4 ")
+
+            converter = pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            converter.convert_pgn_parallel(num_shards=8)
+            with open(output_path) as file:
+                self.assertEqual(file.read(), expected)
+            self.assertEqual(converter.number_of_games_processed, 100)
+            self.assertFalse(os.path.exists(output_path + ".tmp"))
+
+            pgn_to_xlan(
+                input_path,
+                output_path,
+                min_number_of_moves_per_game=2,
+                number_of_games_to_write=30,
+            ).convert_pgn_parallel(num_shards=8, max_in_flight=1)
+            with open(output_path) as file:
+                self.assertEqual(file.read().splitlines(), expected.splitlines()[:30])
+
+    def test_shards_start_at_game_boundaries(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            write_pgn(input_path, repeat=3)
+            converter = pgn_to_xlan(input_path, "dummy_output_path")
+
+            positions = []
+            for start, end in converter.get_shard_ranges(10):
+                with open(input_path, "rb") as pgn:
+                    pgn.seek(converter.find_game_start(pgn, start))
+                    positions.extend(
+                        position for position, _ in converter.read_game_texts(pgn, end)
+                    )
+            with open(input_path, "rb") as pgn:
+                self.assertEqual(
+                    positions,
+                    [position for position, _ in converter.read_game_texts(pgn)],
+                )
+            self.assertEqual(len(positions), 15)
+
+    def test_games_without_event_tag_are_split(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=3)
+            remove_event_tags(input_path, insert=COMMENTED_GAMES)
+
+            converter = pgn_to_xlan(input_path, None, min_number_of_moves_per_game=2)
+            expected = []
+            with open(input_path) as pgn:
+                while game := chess.pgn.read_game(pgn):
+                    if converter.is_game_accepted(game.headers):
+                        expected.extend(converter.game_to_xlan(game))
+            self.assertEqual(len(expected), 14)
+
+            converter = pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            )
+            converter.convert_pgn()
+            with open(output_path) as file:
+                self.assertEqual(file.read().splitlines(), expected)
+
+            for num_shards in [3, 7]:
+                converter = pgn_to_xlan(
+                    input_path, output_path, min_number_of_moves_per_game=2
+                )
+                converter.convert_pgn_parallel(num_shards=num_shards)
+                self.assertEqual(converter.number_of_games_processed, 17)
+                with open(output_path) as file:
+                    self.assertEqual(file.read().splitlines(), expected)
+
+    def test_compressed_games_without_event_tag_are_split(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=20)
+            remove_event_tags(input_path)
+            pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            ).convert_pgn_parallel(num_shards=1)
+            with open(input_path, "rb") as file:
+                data = file.read()
+            with open(output_path) as file:
+                expected = file.read()
+            self.assertEqual(len(expected.splitlines()), 80)
+
+            # the streams start at every line of the games, also at their first tag
+            compressed_path = os.path.join(directory, "games.pgn.bz2")
+            for stream_size in range(60, 400, 14):
+                with open(compressed_path, "wb") as file:
+                    file.write(multi_stream_bz2_compress(data, stream_size))
+                converter = pgn_to_xlan(
+                    compressed_path, output_path, min_number_of_moves_per_game=2
+                )
+                converter.convert_pgn_parallel(num_shards=50)
+                with open(output_path) as file:
+                    self.assertEqual(file.read(), expected, stream_size)
+                self.assertEqual(converter.number_of_games_processed, 100)
+
+    def test_convert_compressed_pgn(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=20)
+            pgn_to_xlan(
+                input_path, output_path, min_number_of_moves_per_game=2
+            ).convert_pgn_parallel(num_shards=1)
+            with open(input_path, "rb") as file:
+                data = file.read()
+            with open(output_path) as file:
+                expected = file.read()
+
+            compressed_files = {
+                # streams end in the middle of games
+                "games.pgn.bz2": multi_stream_bz2_compress(data, stream_size=700),
+                "games.pgn.gz": gzip.compress(data),
+            }
+            for name, content in compressed_files.items():
+                compressed_path = os.path.join(directory, name)
+                with open(compressed_path, "wb") as file:
+                    file.write(content)
+                for num_shards in [1, 4, 50]:
+                    converter = pgn_to_xlan(
+                        compressed_path, output_path, min_number_of_moves_per_game=2
+                    )
+                    converter.convert_pgn_parallel(num_shards=num_shards)
+                    with open(output_path) as file:
+                        self.assertEqual(file.read(), expected)
+                    self.assertEqual(converter.number_of_games_processed, 100)
+
+                pgn_to_xlan(
+                    compressed_path, output_path, min_number_of_moves_per_game=2
+                ).convert_pgn()
+                with open(output_path) as file:
+                    self.assertEqual(file.read(), expected.rstrip("\n"))
+
+    def test_header_filters_count_rejected_games(self):
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "games.pgn")
+            output_path = os.path.join(directory, "games.xlan")
+            write_pgn(input_path, repeat=4)
+            converter = pgn_to_xlan(
+                input_path,
+                output_path,
+                min_number_of_moves_per_game=2,
+                filter_elo=True,
+                elo_min=1700,
+                elo_max=1850,
+            )
+            converter.convert_pgn_parallel(num_shards=3)
+
+            self.assertEqual(
+                converter.rejected_games, {"time forfeit": 4, "elo out of range": 8}
+            )
+            with open(output_path) as file:
+                self.assertEqual(len(file.read().splitlines()), 8)
+
+    def test_parse_headers_matches_python_chess(self):
+        text = '[Event "Rated Blitz game"]\n[WhiteElo "1500"]\n[Opening "?"]\n\n1. e4 [%eval 0.2] e5 1-0\n'
+        headers = self.converter.parse_headers(text)
+        self.assertEqual(len(headers), 3)
+        self.assertLessEqual(
+            headers.items(), dict(chess.pgn.read_game(StringIO(text)).headers).items()
+        )
+
+    def test_visitor_matches_game_to_xlan(self):
+        texts = random_game_texts(40)
+        for xLanPlus in [False, True]:
+            converter = pgn_to_xlan(
+                "dummy_input_path",
+                "dummy_output_path",
+                min_number_of_moves_per_game=0,
+                xLanPlus=xLanPlus,
+            )
+            for text in texts:
+                game = chess.pgn.read_game(StringIO(text))
+                expected = [xlan for xlan in converter.game_to_xlan(game) if xlan]
+                self.assertEqual(converter.convert_game_text(text), expected)
+            self.assertTrue(
+                expected[0].startswith("1. O-O#" if not xLanPlus else "1. OO#")
+            )
+
     def _pgn_io(self, pgn_str):
         # Utility method to convert a string to StringIO for reading PGN
         return StringIO(pgn_str)
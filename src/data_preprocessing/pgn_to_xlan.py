@@ -1,11 +1,39 @@
 import chess
 import chess.pgn
+import collections
 import datetime
+import hashlib
+import io
 import logging
 import os
+import re
+import shutil
 import time
 import multiprocessing
 
+from src.data_preprocessing.compressed_input import (
+    find_stream_start,
+    get_reader,
+    input_position,
+    is_compressed,
+    open_input,
+)
+from src.data_preprocessing.bounded_imap import bounded_imap
+from src.data_preprocessing.corpus_statistics import CorpusStatistics, GameSummary
+from src.data_preprocessing.run_manifest import (
+    RunManifest,
+    atomic_open,
+    file_checksums,
+    get_temporary_path,
+    hash_file,
+)
+
+# The size of the byte ranges the input file is split into for the streaming conversion
+STREAMING_SHARD_SIZE = 16 << 20
+
+# A line that is a single tag pair, e.g. `[Site "https://lichess.org/abc"]`
+TAG_LINE = re.compile(rb'^\[[A-Za-z0-9_]+\s+"(?:[^"\\]|\\.)*"\]\s*$')
+
 
 class pgn_to_xlan:
     """
@@ -37,12 +65,17 @@ class pgn_to_xlan:
         min_number_of_moves_per_game: Minimum number of moves in a game for it to be included in the output file, default is 10
         number_of_games: Number of games to include in the output file, default is -1 which processes all games
         chunk_size: Number of games to process at a time, to avoid memory issues, if necessary. If set to 0, all games will be processed at once.
-        generate_all_moves: Whether to generate all possible moves for each game (WARNING: generates a lot of new data!). Default is False.
+        generate_all_moves: Whether to generate all possible moves for each game (WARNING: generates a lot of new data!). Default is False. See `all_moves.pgn_to_all_moves` to stream this data into compressed, size-capped parts.
         xLanPlus: Whether to use the xLan+ format. Default is False.
         log: Whether to log the progress of the conversion. Default is False.
         filter_elo: Whether to filter games based on the ELO rating of the players. Default is False.
         elo_min: Minimum ELO rating of the players. Default is 0.
         elo_max: Maximum ELO rating of the players. Default is 4000.
+        statistics: The statistics to collect while the games are converted, names in
+            `corpus_statistics.STATISTICS` or `corpus_statistics.Statistic` subclasses. They are
+            written to `{output_path}.stats.json`. The parallel conversion collects them per shard,
+            so with `number_of_games_to_write` they cover all games of the last shard. Default is
+            None.
     """
 
     def __init__(
@@ -58,6 +91,7 @@ class pgn_to_xlan:
         filter_elo=False,
         elo_min=0,
         elo_max=4000,
+        statistics=None,
     ):
         self.input_path = input_path
         self.output_path = output_path
@@ -73,6 +107,11 @@ class pgn_to_xlan:
 
         self.number_of_games_processed = 0
         self.number_of_games_written = 0
+        # number of games rejected by each header filter
+        self.rejected_games = collections.Counter()
+        self.statistics = list(statistics or [])
+        # the statistics of the converted games, see `corpus_statistics`
+        self.game_statistics = self.new_statistics()
 
         if self.log:
             self.setup_logging()
@@ -231,7 +270,21 @@ class pgn_to_xlan:
     def get_game_positions(self, pgn, num_games):
         """
         Gets the positions of the start of each game in the PGN file.
+        If the file has an up-to-date index (see `pgn_index`), the positions are read from the
+        index instead of scanning the file.
         """
+        # imported here, pgn_index uses this module to read games
+        from src.data_preprocessing.pgn_index import load_pgn_index
+
+        index = None
+        if not is_compressed(self.input_path):
+            index = load_pgn_index(self.input_path)
+        if index is not None:
+            with index:
+                first_game = index.find_game(pgn.tell())
+                last_game = min(len(index), first_game + num_games + 1)
+                return [index[game].offset for game in range(first_game, last_game)]
+
         positions = [pgn.tell()]  # Startposition of first game
         current_game = 0
         # Search for the start of the next game
@@ -252,6 +305,77 @@ class pgn_to_xlan:
                     current_game += 1
         return positions
 
+    @staticmethod
+    def parse_headers(text):
+        """
+        Parses the tag section of a game, without parsing its moves.
+
+        Parameters:
+            text: The text of a game, starting with its tags.
+
+        Returns:
+            A dictionary with the tags of the game.
+        """
+        headers = {}
+        for line in text.splitlines():
+            line = line.strip()
+            if not line.startswith("["):
+                if line:
+                    break
+                continue
+            name, _, value = line[1:-1].partition(" ")
+            headers[name] = value.strip().removeprefix('"').removesuffix('"')
+        return headers
+
+    def get_rejection_reason(self, headers):
+        """
+        Checks the headers of a game against the filters of the conversion: games lost on time are
+        skipped and, if `filter_elo` is set, games whose average ELO is outside the ELO window.
+
+        Returns:
+            The filter that rejects the game, or None if the game is accepted.
+        """
+        if headers.get("Termination") == "Time forfeit":
+            return "time forfeit"
+        if self.filter_elo:
+            white_elo = headers.get("WhiteElo", "?")
+            black_elo = headers.get("BlackElo", "?")
+
+            if white_elo == "?" and black_elo == "?":
+                return "missing elo"
+
+            elos = [
+                int(white_elo) if white_elo != "?" else None,
+                int(black_elo) if black_elo != "?" else None,
+            ]
+            elos = [elo for elo in elos if elo is not None]
+            if not elos:
+                return "missing elo"
+
+            average_elo = sum(elos) / len(elos)
+
+            if average_elo < self.elo_min or average_elo > self.elo_max:
+                return "elo out of range"
+        return None
+
+    def is_game_accepted(self, headers):
+        """
+        Checks the headers of a game against the filters of the conversion, see `get_rejection_reason`.
+        """
+        return self.get_rejection_reason(headers) is None
+
+    def reject_game(self, headers):
+        """
+        Checks the headers of a game and counts the filter that rejects it, if any.
+
+        Returns:
+            True if the game is rejected.
+        """
+        reason = self.get_rejection_reason(headers)
+        if reason is not None:
+            self.rejected_games[reason] += 1
+        return reason is not None
+
     def read_and_process_games_from_positions(self, positions):
         """
         Reads the games from the given positions and converts them to xLAN format.
@@ -260,75 +384,668 @@ class pgn_to_xlan:
         with open(self.input_path) as pgn:
             for pos in positions:
                 pgn.seek(pos)
-                game = chess.pgn.read_game(pgn)
-                if game.headers["Termination"] == "Time forfeit":
+                if self.reject_game(chess.pgn.read_headers(pgn)):
                     continue
-                if self.filter_elo:
-                    headers = game.headers
-                    white_elo = headers.get("WhiteElo", "?")
-                    black_elo = headers.get("BlackElo", "?")
-
-                    if white_elo == "?" and black_elo == "?":
-                        continue
-
-                    elos = [
-                        int(white_elo) if white_elo != "?" else None,
-                        int(black_elo) if black_elo != "?" else None,
-                    ]
-                    elos = [elo for elo in elos if elo is not None]
-                    if not elos:
-                        continue
-
-                    average_elo = sum(elos) / len(elos)
-
-                    if average_elo < self.elo_min or average_elo > self.elo_max:
-                        continue
+                pgn.seek(pos)
+                game = chess.pgn.read_game(pgn)
                 for xlan_str in self.game_to_xlan(game):
                     if xlan_str:
                         buffer.append(xlan_str)
         return buffer
 
-    def convert_pgn_parallel(self):
+    def convert_game_text(self, text):
         """
-        Converts all games in PGN file to xLAN format and writes to output file.
-        Uses a buffer for more efficient writing to file.
-        Uses multiprocessing and chunking to process the games in chunks.
+        Converts the text of a game to the xLAN format. Unless all moves are generated, the game is
+        converted while it is parsed with `XlanVisitor`, without building a game tree.
+
+        Returns:
+            A list with the converted games, empty if the game is not valid.
         """
-        start_time = self.start_logging()
-        num_processes = multiprocessing.cpu_count()
-        writen_games = 0
-        with open(self.input_path) as pgn, open(self.output_path, "w") as outfile:
-            while True:
-                game_positions = self.get_game_positions(pgn, 100000)
+        if self.generate_all_moves:
+            game = chess.pgn.read_game(io.StringIO(text))
+            if game is None:
+                return []
+            if self.game_statistics is not None:
+                summary = GameSummary.from_game(game)
+                summary.add_all_moves_sequences(self.get_notations())
+                self.game_statistics.add_game(summary)
+            return [xlan_str for xlan_str in self.game_to_xlan(game) if xlan_str]
+        xlan_str = chess.pgn.read_game(
+            io.StringIO(text), Visitor=lambda: XlanVisitor(self)
+        )
+        return [xlan_str] if xlan_str else []
 
-                if not game_positions:
-                    break
+    @staticmethod
+    def is_tag_line(line):
+        """
+        Returns whether a line is a single tag pair. Movetext can begin with `[` too, e.g. a
+        `[%clk 0:03:00]` command of a comment that continues on the next line.
+        """
+        return line.startswith(b"[") and TAG_LINE.match(line) is not None
 
-                chunk_size = len(game_positions) // num_processes
+    @staticmethod
+    def starts_game(previous_line, line):
+        """
+        Returns whether a line starts a game: a game starts with a tag line that follows a line
+        that is not a tag line, i.e. the movetext of the previous game or an empty line. Any tag
+        can be the first tag of a game, not only `[Event`. Whether the line is inside a comment is
+        not known here, see `split_games`.
 
-                if chunk_size == 0:
+        Parameters:
+            previous_line: The line before, or None if the line is the first line of the file.
+            line: The line.
+        """
+        return pgn_to_xlan.is_tag_line(line) and not (
+            previous_line is not None and pgn_to_xlan.is_tag_line(previous_line)
+        )
+
+    @staticmethod
+    def ends_in_comment(line, in_comment=False):
+        """
+        Returns whether a `{` comment is open at the end of a line of movetext.
+
+        Parameters:
+            line: The line.
+            in_comment: Whether a comment is open at the start of the line.
+        """
+        position = 0
+        while True:
+            if in_comment:
+                position = line.find(b"}", position)
+                if position < 0:
+                    return True
+                in_comment = False
+            else:
+                comment_start = line.find(b"{", position)
+                if comment_start < 0:
+                    return False
+                # a `;` comment runs to the end of the line
+                if line.find(b";", position, comment_start) >= 0:
+                    return False
+                position = comment_start
+                in_comment = True
+            position += 1
+
+    @staticmethod
+    def find_line_start(pgn, position):
+        """
+        Returns the position of the start of the line that contains the given position.
+        """
+        while position > 0:
+            block_start = max(0, position - 4096)
+            pgn.seek(block_start)
+            line_end = pgn.read(position - block_start).rfind(b"\n")
+            if line_end >= 0:
+                return block_start + line_end + 1
+            position = block_start
+        return 0
+
+    @staticmethod
+    def find_game_start(pgn, position):
+        """
+        Returns the position of the first game that starts at or after the given position, see
+        `starts_game`. The comments before the position are not known, so a tag line inside a
+        comment is taken as a game start, like `split_games` does for the lines at its end.
+
+        Parameters:
+            pgn: The PGN file, opened in binary mode.
+            position: A byte position in the file, e.g. the start of a shard.
+        """
+        previous_line = None
+        if position > 0:
+            # read the line before the position, or the rest of the line it points into
+            pgn.seek(pgn_to_xlan.find_line_start(pgn, position - 1))
+            previous_line = pgn.readline()
+        else:
+            pgn.seek(0)
+        while True:
+            line_start = pgn.tell()
+            line = pgn.readline()
+            if not line or pgn_to_xlan.starts_game(previous_line, line):
+                return line_start
+            previous_line = line
+
+    @staticmethod
+    def read_lines(pgn):
+        """
+        Reads the lines of a file opened in binary mode.
+
+        Yields:
+            The position and the content of every line.
+        """
+        while True:
+            position = pgn.tell()
+            line = pgn.readline()
+            if not line:
+                return
+            yield position, line
+
+    @staticmethod
+    def split_games(lines, end=None):
+        """
+        Groups lines into games, see `starts_game`. A tag line inside a `{` comment does not start
+        a game. The first line must be the start of a game. Stops before the first game that
+        starts at or after `end`.
+
+        The range that starts at `end` does not know the lines before it, so the game to stop at
+        is found without the comments, like the next range finds its first game with
+        `find_game_start`. The games before it are read to their end.
+
+        Parameters:
+            lines: The position and the content of every line, see `read_lines`.
+            end: The position to stop at, or None to read all lines.
+
+        Yields:
+            The position and the text of every game.
+        """
+        game_start = None
+        game_lines = []
+        in_comment = False
+        for position, line in lines:
+            previous_line = game_lines[-1] if game_lines else None
+            if end is not None and position >= end:
+                if pgn_to_xlan.starts_game(previous_line, line):
                     break
+            if (
+                game_lines
+                and not in_comment
+                and pgn_to_xlan.starts_game(previous_line, line)
+            ):
+                yield game_start, b"".join(game_lines).decode("utf-8")
+                game_lines = []
+            if not game_lines:
+                game_start = position
+            if in_comment or not pgn_to_xlan.is_tag_line(line):
+                in_comment = pgn_to_xlan.ends_in_comment(line, in_comment)
+            game_lines.append(line)
+        if game_lines:
+            yield game_start, b"".join(game_lines).decode("utf-8")
 
-                chunks = [
-                    game_positions[i : i + chunk_size]
-                    for i in range(0, len(game_positions), chunk_size)
-                ]
+    @staticmethod
+    def read_game_texts(pgn, end=None):
+        """
+        Reads the games of a PGN file, starting at the current position of the file which must be
+        the start of a game. Stops before the first game that starts at or after `end`.
+
+        Parameters:
+            pgn: The PGN file, opened in binary mode.
+            end: The byte position to stop at, or None to read until the end of the file.
 
-                with multiprocessing.Pool(num_processes) as pool:
-                    results = pool.map(
-                        self.read_and_process_games_from_positions, chunks
+        Yields:
+            The position and the text of every game.
+        """
+        return pgn_to_xlan.split_games(pgn_to_xlan.read_lines(pgn), end)
+
+    def read_shard_games(self, start, end):
+        """
+        Reads the games that start in the given byte range of the input file.
+
+        A plain file is aligned to the next game start. A compressed file is aligned to the next
+        stream that can be decompressed on its own, see `compressed_input.find_stream_start`, and
+        its games are positioned at the stream range they start in. The last game of a range is
+        read to its end, even if it continues in the next range.
+
+        Yields:
+            The position and the text of every game.
+        """
+        if not is_compressed(self.input_path):
+            with open(self.input_path, "rb") as pgn:
+                pgn.seek(self.find_game_start(pgn, start))
+                yield from self.read_game_texts(pgn, end)
+            return
+
+        start = find_stream_start(self.input_path, start)
+        end = find_stream_start(self.input_path, end)
+        if start >= end:
+            return
+        with open_input(self.input_path, "rb", start, end) as pgn:
+            reader = get_reader(pgn)
+
+            def shard_lines():
+                # the first game of a range after the first one belongs to the previous range
+                skipping = start > 0
+                starts_game = StreamGameStarts()
+                # the games from the first game of the next range on belong to the next range,
+                # which finds it with the same rule
+                starts_next_range = None
+                for position, line in self.read_lines(pgn):
+                    in_range = (
+                        reader.end_position is None or position < reader.end_position
                     )
+                    if not in_range:
+                        if starts_next_range is None:
+                            # the next range starts with the rest of the line that crosses the
+                            # end of this range, if there is one
+                            starts_next_range = StreamGameStarts(
+                                1 if position > reader.end_position else 0
+                            )
+                        if starts_next_range(line):
+                            return
+                    if skipping:
+                        skipping = not starts_game(line)
+                        if skipping:
+                            continue
+                    yield (start if in_range else end), line
+
+            yield from self.split_games(shard_lines())
+
+    def get_shard_ranges(self, num_shards):
+        """
+        Splits the input file into byte ranges of equal size, one per shard.
+        A game belongs to the shard its first line starts in.
+        """
+        file_size = os.path.getsize(self.input_path)
+        bounds = [file_size * index // num_shards for index in range(num_shards + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
 
-                for buffer in results:
-                    outfile.write("\n".join(buffer))
-                    outfile.write("\n")
-                    writen_games += len(buffer)
-                if (
-                    self.number_of_games_to_write != -1
-                    and writen_games >= self.number_of_games_to_write
+    def get_shard_path(self, shard_index):
+        """
+        Returns the path of the output file of a shard.
+        """
+        return f"{self.output_path}.shard{shard_index:04d}"
+
+    def get_shard_outputs(self, shard_index):
+        """
+        Returns the paths of all output files of a shard.
+        """
+        return [self.get_shard_path(shard_index)]
+
+    def get_outputs(self):
+        """
+        Returns the paths of all output files of the conversion.
+        """
+        return [self.output_path]
+
+    def get_notations(self):
+        """
+        Returns the notations of the output, for the token lengths of the statistics.
+        """
+        return ["xLANplus" if self.xLanPlus else "xLAN"]
+
+    def new_statistics(self):
+        """
+        Returns empty accumulators of the statistics of the conversion, or None if no statistics
+        are collected.
+        """
+        return CorpusStatistics(self.statistics) if self.statistics else None
+
+    def get_statistics_path(self):
+        """
+        Returns the path of the statistics of the conversion.
+        """
+        return f"{self.output_path}.stats.json"
+
+    def save_statistics(self):
+        """
+        Writes the statistics of the conversion, if any are collected.
+        """
+        if self.game_statistics is not None:
+            self.game_statistics.save(self.get_statistics_path())
+            print(f"\tStatistics: {self.get_statistics_path()}")
+
+    def get_manifest_path(self):
+        """
+        Returns the path of the manifest that records the progress of `convert_pgn_parallel`.
+        """
+        return f"{self.output_path}.manifest.json"
+
+    def get_run_fingerprint(self, shard_ranges, merge):
+        """
+        Describes the input file and the settings of a parallel conversion. A manifest is only
+        used to resume a conversion with the same fingerprint.
+        """
+        stat = os.stat(self.input_path)
+        return {
+            "input_path": os.path.abspath(self.input_path),
+            "input_size": stat.st_size,
+            "input_modified": stat.st_mtime_ns,
+            "outputs": self.get_outputs(),
+            "shard_ranges": shard_ranges,
+            "merge": merge,
+            "min_number_of_moves_per_game": self.min_number_of_moves_per_game,
+            "number_of_games_to_write": self.number_of_games_to_write,
+            "generate_all_moves": self.generate_all_moves,
+            "xLanPlus": self.xLanPlus,
+            "filter_elo": self.filter_elo,
+            "elo_min": self.elo_min,
+            "elo_max": self.elo_max,
+            "statistics": (
+                sorted(self.game_statistics.statistics)
+                if self.game_statistics is not None
+                else []
+            ),
+        }
+
+    def write_games(self, games, outfile):
+        """
+        Converts the given game texts to xLAN format and writes them to the output file, one game
+        per line. The header filters run on the tags of a game before its moves are parsed, so
+        rejected games cost almost nothing. Stops after `number_of_games_to_write` games.
+
+        Parameters:
+            games: The position and the text of every game, see `read_game_texts`.
+            outfile: The output file, opened in text mode.
+
+        Returns:
+            The number of games processed, the number of games written and the number of games
+            rejected by each header filter.
+        """
+        games_processed = 0
+        games_written = 0
+        rejected_games = collections.Counter()
+        buffer = []
+        for _, text in games:
+            if (
+                self.number_of_games_to_write != -1
+                and games_written >= self.number_of_games_to_write
+            ):
+                break
+            games_processed += 1
+            reason = self.get_rejection_reason(self.parse_headers(text))
+            if reason is not None:
+                rejected_games[reason] += 1
+                continue
+            for xlan_str in self.convert_game_text(text):
+                buffer.append(xlan_str + "\n")
+                games_written += 1
+
+            if len(buffer) >= self.chunk_size:
+                outfile.write("".join(buffer))
+                buffer.clear()
+        outfile.write("".join(buffer))
+        return games_processed, games_written, rejected_games
+
+    def convert_shard(self, shard_index, start, end):
+        """
+        Converts the games that start in the given byte range to xLAN format and writes them to
+        the output file of the shard, see `write_games`. The output file only appears once the
+        shard is complete.
+
+        Returns:
+            The number of games processed, the number of games written and the number of games
+            rejected by each header filter in this shard.
+        """
+        with atomic_open(self.get_shard_path(shard_index)) as outfile:
+            return self.write_games(self.read_shard_games(start, end), outfile)
+
+    def convert_range(self, byte_range):
+        """
+        Converts the games that start in the given byte range in a worker process of the
+        streaming conversion, see `stream_shards`, and returns their output instead of writing it.
+
+        Parameters:
+            byte_range: The start and the end of the range.
+
+        Returns:
+            The number of games processed, the number of games written, the number of games
+            rejected by each header filter and, for every output file (`get_outputs`), the
+            encoded games.
+        """
+        start, end = byte_range
+        buffer = io.StringIO()
+        games_processed, games_written, rejected_games = self.write_games(
+            self.read_shard_games(start, end), buffer
+        )
+        games = buffer.getvalue().encode("utf-8").splitlines(keepends=True)
+        return games_processed, games_written, rejected_games, [games]
+
+    def run_shard(self, shard):
+        """
+        Converts a shard in a worker process, see `convert_shard`.
+
+        Parameters:
+            shard: The index, the start and the end of the shard.
+
+        Returns:
+            The index of the shard and its record for the manifest.
+        """
+        shard_index, start, end = shard
+        self.game_statistics = self.new_statistics()
+        games_processed, games_written, rejected_games = self.convert_shard(
+            shard_index, start, end
+        )
+        return shard_index, {
+            "start": start,
+            "end": end,
+            "games_processed": games_processed,
+            "games_written": games_written,
+            "rejected_games": dict(rejected_games),
+            "outputs": file_checksums(self.get_shard_outputs(shard_index)),
+            "statistics": self.game_statistics and self.game_statistics.to_dict(),
+        }
+
+    def run_range(self, byte_range):
+        """
+        Converts a byte range in a worker process of the streaming conversion, see
+        `convert_range`, and collects the statistics of its games.
+
+        Returns:
+            The result of `convert_range` and the statistics of the range.
+        """
+        self.game_statistics = self.new_statistics()
+        result = self.convert_range(byte_range)
+        return result, self.game_statistics and self.game_statistics.to_dict()
+
+    def merge_shards(self, num_shards):
+        """
+        Concatenates the output files of the shards in order into the output file and deletes them
+        once the output file is complete. Keeps at most `number_of_games_to_write` games.
+        """
+        games_written = 0
+        with atomic_open(self.output_path) as outfile:
+            for shard_index in range(num_shards):
+                with open(self.get_shard_path(shard_index)) as shard:
+                    if self.number_of_games_to_write == -1:
+                        shutil.copyfileobj(shard, outfile)
+                    else:
+                        for line in shard:
+                            if games_written >= self.number_of_games_to_write:
+                                break
+                            outfile.write(line)
+                            games_written += 1
+        for shard_index in range(num_shards):
+            os.remove(self.get_shard_path(shard_index))
+
+    def stream_shards(self, shard_ranges, manifest, num_processes, max_in_flight):
+        """
+        Converts the shards in a long-lived pool and appends their output to the output files in
+        the order of the shards as soon as it arrives. At most `max_in_flight` shards are
+        converted or waiting to be written at a time, so the memory stays flat however large the
+        input file is, and the workers get the next shard as soon as they are done.
+
+        The output is written to temporary files that replace the output files at the end. The
+        size and the checksum of the output written so far are recorded in the manifest after
+        every shard; an interrupted conversion truncates the temporary files to the last recorded
+        shard and continues from there.
+        """
+        output_paths = self.get_outputs()
+        partial_paths = [get_temporary_path(path) for path in output_paths]
+        completed = manifest.state["completed"]
+        shards_done = len(completed)
+        hashes = [hashlib.sha256() for _ in output_paths]
+        if shards_done:
+            last_shard = completed[str(shards_done - 1)]
+            sizes = last_shard["output_sizes"]
+            if all(
+                os.path.exists(path) and os.path.getsize(path) >= size
+                for path, size in zip(partial_paths, sizes)
+            ):
+                hashes = [
+                    hash_file(path, size) for path, size in zip(partial_paths, sizes)
+                ]
+            if [sha256.hexdigest() for sha256 in hashes] == last_shard[
+                "output_checksums"
+            ]:
+                for path, size in zip(partial_paths, sizes):
+                    os.truncate(path, size)
+                print(f"\tResuming after {shards_done} shards")
+            else:
+                manifest.reset()
+                shards_done = 0
+                hashes = [hashlib.sha256() for _ in output_paths]
+        games_written = sum(
+            record["games_written"] for record in manifest.state["completed"].values()
+        )
+
+        def pending_ranges():
+            for byte_range in shard_ranges[shards_done:]:
+                # no new shards once enough games are written
+                if 0 <= self.number_of_games_to_write <= games_written:
+                    return
+                yield byte_range
+
+        outfiles = [open(path, "ab" if shards_done else "wb") for path in partial_paths]
+        try:
+            with multiprocessing.Pool(num_processes) as pool:
+                results = bounded_imap(
+                    pool, self.run_range, pending_ranges(), max_in_flight
+                )
+                for shard_index, (result, statistics) in enumerate(
+                    results, start=shards_done
                 ):
-                    break
-                print(f"\tNumber of writen games: {writen_games}", end="\r")
+                    games_processed, written, rejected_games, outputs = result
+                    if self.number_of_games_to_write != -1:
+                        written = min(
+                            written, self.number_of_games_to_write - games_written
+                        )
+                        outputs = [games[:written] for games in outputs]
+                    games_written += written
+
+                    for outfile, sha256, games in zip(outfiles, hashes, outputs):
+                        data = b"".join(games)
+                        outfile.write(data)
+                        outfile.flush()
+                        os.fsync(outfile.fileno())
+                        sha256.update(data)
+                    start, end = shard_ranges[shard_index]
+                    manifest.complete(
+                        shard_index,
+                        {
+                            "start": start,
+                            "end": end,
+                            "games_processed": games_processed,
+                            "games_written": written,
+                            "rejected_games": dict(rejected_games),
+                            "output_sizes": [outfile.tell() for outfile in outfiles],
+                            "output_checksums": [
+                                sha256.hexdigest() for sha256 in hashes
+                            ],
+                            "statistics": statistics,
+                        },
+                    )
+        finally:
+            for outfile in outfiles:
+                outfile.close()
+        for partial_path, output_path in zip(partial_paths, output_paths):
+            os.replace(partial_path, output_path)
+
+    def convert_pgn_parallel(
+        self,
+        num_shards=None,
+        merge=True,
+        resume=True,
+        max_in_flight=None,
+        shard_by_games=False,
+    ):
+        """
+        Converts all games in PGN file to xLAN format and writes to output file.
+
+        The input file is split into byte ranges (shards) that are converted in parallel by a
+        long-lived pool. Every worker aligns its range to the next game start itself, so no
+        process has to scan the whole file first. By default the shards are small
+        (`STREAMING_SHARD_SIZE` bytes) and their output is written in order as it arrives, see
+        `stream_shards`.
+
+        The progress is recorded in a manifest next to the output file (`get_manifest_path`):
+        the byte range, the game counts and the output checksums of every completed shard. A
+        conversion that was interrupted resumes after the shards it has completed, if the input
+        file and the settings are unchanged. A finished conversion whose outputs are unchanged is
+        not repeated.
+
+        Parameters:
+            num_shards: Number of shards. Default is one shard per `STREAMING_SHARD_SIZE` bytes,
+                but at least one per CPU, or one per CPU if the shards are not merged.
+            merge: Whether to write the output of the shards in order into the output file. If
+                False, the output of shard i is left in `{output_path}.shard{i:04d}`.
+            resume: Whether to resume from the manifest of an earlier run. If False, all shards
+                are converted again.
+            max_in_flight: The maximum number of shards that are converted or waiting to be
+                written at a time, default is twice the number of CPUs.
+            shard_by_games: Whether to split the input file into shards with the same number of
+                games instead of the same number of bytes. Uses the index of the file, which is
+                built first if necessary, see `pgn_index.PgnIndex.get_shard_ranges`.
+        """
+        start_time = self.start_logging()
+        num_processes = multiprocessing.cpu_count()
+        if num_shards is None:
+            num_shards = num_processes
+            if merge:
+                file_size = os.path.getsize(self.input_path)
+                num_shards = max(num_shards, -(-file_size // STREAMING_SHARD_SIZE))
+        if shard_by_games:
+            from src.data_preprocessing.pgn_index import open_pgn_index
+
+            with open_pgn_index(self.input_path) as index:
+                shard_ranges = index.get_shard_ranges(num_shards)
+        else:
+            shard_ranges = self.get_shard_ranges(num_shards)
+
+        manifest = RunManifest(
+            self.get_manifest_path(), self.get_run_fingerprint(shard_ranges, merge)
+        )
+        if not resume:
+            manifest.reset()
+        finished = manifest.is_finished()
+
+        if finished:
+            print("\tThe conversion is already complete")
+        elif merge:
+            self.stream_shards(
+                shard_ranges,
+                manifest,
+                min(num_processes, num_shards),
+                max_in_flight or 2 * num_processes,
+            )
+        else:
+            pending_shards = [
+                (index, start, end)
+                for index, (start, end) in enumerate(shard_ranges)
+                if manifest.get_completed(index) is None
+            ]
+            if len(pending_shards) < num_shards:
+                print(f"\tResuming after {num_shards - len(pending_shards)} shards")
+            if pending_shards:
+                with multiprocessing.Pool(
+                    min(num_processes, len(pending_shards))
+                ) as pool:
+                    for shard_index, record in pool.imap_unordered(
+                        self.run_shard, pending_shards
+                    ):
+                        manifest.complete(shard_index, record)
+
+        # the statistics of the shards are reduced to the statistics of the conversion
+        self.game_statistics = self.new_statistics()
+        for record in manifest.state["completed"].values():
+            self.number_of_games_processed += record["games_processed"]
+            self.number_of_games_written += record["games_written"]
+            self.rejected_games.update(record["rejected_games"])
+            if self.game_statistics is not None:
+                self.game_statistics.merge_dict(record["statistics"])
+        print(f"\tNumber of writen games: {self.number_of_games_written}")
+        print(f"\tRejected games: {dict(self.rejected_games)}")
+        self.save_statistics()
+
+        if not finished:
+            if merge:
+                manifest.finish(self.get_outputs())
+            else:
+                manifest.finish(
+                    [
+                        path
+                        for index in range(num_shards)
+                        for path in self.get_shard_outputs(index)
+                    ]
+                )
 
         if self.log:
             self.final_logging(start_time)
@@ -339,49 +1056,43 @@ class pgn_to_xlan:
         Uses a buffer for more efficient writing to file.
         """
         start_time = self.start_logging()
+        self.game_statistics = self.new_statistics()
 
         buffer = []
         games_processed = 0
 
-        with open(self.input_path) as pgn, open(self.output_path, "w") as outfile:
+        with open_input(self.input_path, "rb") as pgn, atomic_open(
+            self.output_path
+        ) as outfile:
             total_file_size = os.path.getsize(self.input_path)
 
-            while (self.number_of_games_to_write < 0) or (
-                games_processed < self.number_of_games_to_write
-            ):
-                game = chess.pgn.read_game(pgn)
-
-                # check for end of file
-                if not game:
+            for _, text in self.read_game_texts(pgn):
+                if 0 <= self.number_of_games_to_write <= games_processed:
                     break
 
-                if game.headers["Termination"] == "Time forfeit":
+                # skip the moves of games rejected by their headers
+                if self.reject_game(self.parse_headers(text)):
                     if self.log:
                         logging.debug(
-                            f"\tgame #{self.number_of_games_processed} is a time forfeit"
+                            f"\tgame #{self.number_of_games_processed} is rejected"
                         )
                     continue
-                else:
-                    logging.debug(
-                        f"\tgame #{self.number_of_games_processed} is not a time forfeit"
-                    )
 
                 self.number_of_games_processed += 1
 
-                # print progress to console
-                current_file_position = pgn.tell()
+                # print progress to console, in bytes of the (compressed) input file
+                current_file_position = input_position(pgn)
                 progress_percentage = (current_file_position / total_file_size) * 100
                 print(
                     f"\tProcessed: {progress_percentage:.2f}% of the input file",
                     end="\r",
                 )
-                self.progression_logging(game)
+                self.progression_logging(text)
 
-                for lan_str in self.game_to_xlan(game):
-                    if lan_str:
-                        buffer.append(lan_str)
-                        games_processed += 1
-                        self.number_of_games_written += 1
+                for lan_str in self.convert_game_text(text):
+                    buffer.append(lan_str)
+                    games_processed += 1
+                    self.number_of_games_written += 1
 
                 # Write the buffer to the file if it reaches chunk size
                 if len(buffer) == self.chunk_size:
@@ -392,6 +1103,7 @@ class pgn_to_xlan:
             if buffer:
                 outfile.write("\n".join(buffer))
                 buffer.clear()
+        self.save_statistics()
 
         if self.log:
             self.final_logging(start_time)
@@ -493,17 +1205,19 @@ class pgn_to_xlan:
                 logging.info(
                     f"Percentage of games written = {self.number_of_games_written / self.number_of_games_processed * 100:.2f}%"
                 )
+            for reason, count in self.rejected_games.items():
+                logging.info(f"Number of games rejected ({reason}) = {count}")
 
     def progression_logging(self, game):
         """
         Logs the progression of the conversion.
 
         Parameters:
-            game: The game currently being processed.
+            game: The PGN text of the game currently being processed.
         """
         if self.log:
             logging.debug(f"\tprocessing game #{self.number_of_games_processed}")
-            logging.debug(f"\tgame before conversion: {game.mainline_moves()}")
+            logging.debug(f"\tgame before conversion: {game}")
 
     def start_logging(self):
         """
@@ -531,3 +1245,150 @@ class pgn_to_xlan:
             logging.debug(f"\tprocessed_game: {processed_game}")
             logging.debug(f"\tboard.fullmove_number: {board.fullmove_number}")
             logging.debug(f"\tboard.outcome(): {board.outcome()}")
+
+
+class StreamGameStarts:
+    """
+    Decides which lines start a game, for a range of a compressed file that starts at a stream
+    and does not know the lines before it. The first line of the stream can be the rest of a
+    line, so the line before the first two lines is not known: they only start a game if they are
+    an `[Event` tag. The other lines start a game by `pgn_to_xlan.starts_game`.
+
+    Called with every line of the stream in order, returns whether the line starts a game.
+
+    Parameters:
+        line_number: The number of lines of the stream before the first line it is called with.
+    """
+
+    def __init__(self, line_number=0):
+        self.line_number = line_number
+        self.previous_line = None
+
+    def __call__(self, line):
+        if self.line_number < 2:
+            starts = line.startswith(b"[Event") and pgn_to_xlan.is_tag_line(line)
+        else:
+            starts = pgn_to_xlan.starts_game(self.previous_line, line)
+        self.line_number += 1
+        self.previous_line = line
+        return starts
+
+
+class XlanVisitor(chess.pgn.BaseVisitor):
+    """
+    Converts a game to the xLAN format while it is parsed, without building a game tree.
+
+    The moves are formatted from the from and to squares, the piece, the capture flag and the
+    check state of the board the parser replays the game on, without converting them to LAN
+    first. The output is the same as the output of `pgn_to_xlan.game_to_xlan`, including its
+    quirks: the check sign of a promotion follows the promoted piece ("Q+d7-d8") and a castling
+    that mates keeps its SAN form ("O-O#").
+
+    Usage:
+        chess.pgn.read_game(pgn, Visitor=lambda: XlanVisitor(converter))
+
+    Parameters:
+        converter: The pgn_to_xlan instance with the settings of the conversion.
+    """
+
+    def __init__(self, converter):
+        self.converter = converter
+
+    def begin_game(self):
+        self.moves = []
+        self.result_token = "*"
+        self.board = None
+        self.pending_move = None
+        self.summary = None
+        if self.converter.game_statistics is not None:
+            self.summary = GameSummary()
+
+    def visit_header(self, tagname, tagvalue):
+        if tagname == "Result":
+            self.result_token = tagvalue
+        if self.summary is not None:
+            self.summary.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if self.summary is not None:
+            self.summary.add_move(board, move)
+        if board.is_castling(move):
+            piece = None
+        else:
+            piece = chess.piece_symbol(
+                move.promotion or board.piece_type_at(move.from_square)
+            ).upper()
+        self.pending_move = (move, piece, board.is_capture(move))
+
+    def visit_board(self, board):
+        self.board = board
+        if self.pending_move is not None:
+            self.moves.append(self.format_move(*self.pending_move))
+            self.pending_move = None
+
+    def visit_result(self, result):
+        if self.result_token == "*":
+            self.result_token = result
+
+    def handle_error(self, error):
+        # like the game builder of python-chess, the rest of the game is skipped
+        logging.debug(f"\terror while parsing the game: {error}")
+
+    def format_move(self, move, piece, capture):
+        """
+        Formats the move that has just been pushed to `self.board`.
+        """
+        index = len(self.moves)
+        turn_white = index % 2 == 0
+        check = self.board.is_check()
+        mate = check and self.board.is_checkmate()
+        from_square = chess.square_name(move.from_square)
+        to_square = chess.square_name(move.to_square)
+
+        if piece is None:
+            kingside = chess.square_file(move.to_square) > chess.square_file(
+                move.from_square
+            )
+            if mate:
+                xlan = "O-O#" if kingside else "O-O-O#"
+                if self.converter.xLanPlus:
+                    xlan = xlan.replace("-", "")
+            else:
+                xlan = self.converter.convert_castling(
+                    "O-O" if kingside else "O-O-O", turn_white
+                )
+                if self.converter.xLanPlus:
+                    xlan += "+" if check else "-"
+                elif check:
+                    xlan += "+"
+        elif self.converter.xLanPlus:
+            if mate:
+                suffix = "!" if capture else "#"
+            elif check:
+                suffix = "$" if capture else "+"
+            else:
+                suffix = "x" if capture else "-"
+            xlan = piece + from_square + to_square + suffix
+        else:
+            check_sign = "#" if mate else "+" if check else ""
+            squares = from_square + ("x" if capture else "-") + to_square
+            if move.promotion:
+                xlan = piece + check_sign + squares
+            else:
+                xlan = piece + squares + check_sign
+
+        return f"{index // 2 + 1}. {xlan} " if turn_white else f"{xlan} "
+
+    def result(self):
+        """
+        Returns the game in the xLAN format, or an empty string if it is not a valid game.
+        """
+        if self.board is None or not self.converter.is_valid_game(self.board):
+            return ""
+        if self.summary is not None:
+            self.summary.add_game_sequences(self.converter.get_notations())
+            self.converter.game_statistics.add_game(self.summary)
+        return "".join(self.moves) + self.result_token
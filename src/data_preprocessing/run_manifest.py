@@ -0,0 +1,159 @@
+"""
+Run Manifest
+------------
+
+Records the progress of a long preprocessing run in a JSON file next to its output, so that a run
+that crashes or is killed can be resumed instead of started over. The manifest stores a
+fingerprint of the run (input file and settings), the completed steps (e.g. the shards of
+`pgn_to_xlan.convert_pgn_parallel`) with the checksums of their outputs and, once the run is
+finished, the checksums of the final outputs. A step only counts as completed if its outputs still
+have the recorded checksums.
+
+Outputs are written with `atomic_open`: to a temporary file that is renamed to the output path
+once it is complete, so a partial output is never mistaken for a complete one.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+
+def get_temporary_path(path):
+    """
+    Returns the path an output is written to before it is complete.
+    """
+    return f"{path}.tmp"
+
+
+def file_checksum(path, size=None):
+    """
+    Returns the SHA-256 checksum of a file, or of its first `size` bytes.
+    """
+    return hash_file(path, size).hexdigest()
+
+
+def hash_file(path, size=None):
+    """
+    Returns a SHA-256 hash object updated with the content of a file, or with its first `size`
+    bytes, which can be updated with data appended later.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        remaining = size
+        while remaining is None or remaining > 0:
+            block_size = CHECKSUM_BLOCK_SIZE
+            if remaining is not None:
+                block_size = min(block_size, remaining)
+                remaining -= block_size
+            block = file.read(block_size)
+            if not block:
+                break
+            sha256.update(block)
+    return sha256
+
+
+def file_checksums(paths):
+    """
+    Maps every path to the checksum of its file.
+    """
+    return {path: file_checksum(path) for path in paths}
+
+
+@contextlib.contextmanager
+def atomic_open(path, mode="w"):
+    """
+    Opens an output file for writing. The data is written to a temporary file that replaces the
+    output file when the context is left without an error, and is deleted otherwise.
+    """
+    temporary_path = get_temporary_path(path)
+    file = open(temporary_path, mode)
+    try:
+        yield file
+        file.flush()
+        os.fsync(file.fileno())
+    except BaseException:
+        file.close()
+        os.remove(temporary_path)
+        raise
+    file.close()
+    os.replace(temporary_path, path)
+
+
+class RunManifest:
+    """
+    The durable progress of a preprocessing run, see the module documentation.
+
+    A manifest written by a run with a different fingerprint, e.g. with another input file or
+    other settings, is ignored, and the run starts over.
+
+    Parameters:
+        path: The path of the manifest file.
+        fingerprint: A JSON serializable description of the input and the settings of the run.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.reset()
+        if os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            # compare in the JSON form, in which tuples have become lists
+            if state.get("fingerprint") == json.loads(json.dumps(fingerprint)):
+                self.state = state
+
+    def reset(self):
+        """
+        Forgets the progress of the run.
+        """
+        self.state = {"fingerprint": self.fingerprint, "completed": {}, "outputs": None}
+
+    @staticmethod
+    def outputs_match(outputs):
+        return all(
+            os.path.exists(path) and file_checksum(path) == checksum
+            for path, checksum in outputs.items()
+        )
+
+    def get_completed(self, key):
+        """
+        Returns the record of a completed step, or None if the step has not been completed or if
+        its outputs have changed since.
+        """
+        record = self.state["completed"].get(str(key))
+        if record is None or not self.outputs_match(record.get("outputs", {})):
+            return None
+        return record
+
+    def complete(self, key, record):
+        """
+        Records a completed step and saves the manifest.
+
+        Parameters:
+            key: The name of the step, e.g. the index of a shard.
+            record: A JSON serializable dictionary with the results of the step. The checksums of
+                its outputs are stored as `outputs`, mapping their paths to their checksums.
+        """
+        self.state["completed"][str(key)] = record
+        self.save()
+
+    def is_finished(self):
+        """
+        Checks whether the run has finished and its outputs are unchanged.
+        """
+        outputs = self.state["outputs"]
+        return outputs is not None and self.outputs_match(outputs)
+
+    def finish(self, output_paths):
+        """
+        Records the checksums of the final outputs of the run and saves the manifest.
+        """
+        self.state["outputs"] = file_checksums(output_paths)
+        self.save()
+
+    def save(self):
+        with atomic_open(self.path) as file:
+            json.dump(self.state, file, indent=2)
@@ -1,6 +1,9 @@
 import json
+import os
 import sys
 
+from src.data_preprocessing.compressed_input import is_compressed, open_input
+
 
 def get_replacements(file_ending, mode):
     if mode not in ["chk", "cap"]:
@@ -25,7 +28,7 @@ def replace_in_file(input_file_path, output_file_path, replacements, file_ending
     ### JSON ###
 
     if file_ending == "json":
-        with open(input_file_path, "r") as input_file:
+        with open_input(input_file_path) as input_file:
             data = json.load(input_file)
 
         for item in data:
@@ -46,7 +49,7 @@ def replace_in_file(input_file_path, output_file_path, replacements, file_ending
     ### TOK and XLANPLUS ###
 
     elif file_ending in ["tok", "xlanplus"]:
-        with open(input_file_path, "r") as input_file, open(
+        with open_input(input_file_path) as input_file, open(
             output_file_path, "w"
         ) as output_file:
             for line in input_file:
@@ -60,11 +63,18 @@ def replace_in_file(input_file_path, output_file_path, replacements, file_ending
 
 if __name__ == "__main__":
     if len(sys.argv) != 4:
-        print("Usage: python script.py <input_file_path> <output_file_path> <chk/cap>")
+        print(
+            "Usage: python -m src.data_preprocessing.xlanplus_to_xlan_cap_chk "
+            "<input_file_path> <output_file_path> <chk/cap>"
+        )
         sys.exit(1)
 
     input_file_path, output_file_path, mode = sys.argv[1:4]
-    file_ending = input_file_path.split(".")[-1]
+    # the file ending of a compressed file is the one before the compression
+    base_path = input_file_path
+    if is_compressed(base_path):
+        base_path = os.path.splitext(base_path)[0]
+    file_ending = base_path.split(".")[-1]
 
     replacements = get_replacements(file_ending, mode)
     if replacements is None:
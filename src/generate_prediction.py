@@ -8,12 +8,17 @@ and back. The tokenization and detokenization rely on a predefined set of tokens
 specified in a file.
 """
 
-import torch
-import torch.nn.functional as F
+import contextlib
+import copy
+import inspect
 
+from src.lazy_import import LazyModule
 from src.tokenizer.tokenizer import tokenize_data
 from src.tokenizer.detokenizer import detokenize_data
 
+torch = LazyModule("torch")
+F = LazyModule("torch.nn.functional")
+
 
 def convert_string_to_list(tokenized_string):
     """
@@ -47,7 +52,24 @@ def convert_list_to_string(token_list):
     return " ".join(map(str, token_list))
 
 
-def model_predict(model, input_ids, num_tokens_to_generate, temperature=1.0):
+def supports_attention_mask(model):
+    """
+    Checks whether the forward pass of a model takes an attention mask. GPT-2 does, Mamba does not
+    and silently ignores it, so padded batches have to be avoided for such models.
+
+    Parameters:
+    - `model` (torch.nn.Module): The model to check.
+
+    Returns:
+    - `bool`: True if the model accepts an `attention_mask` argument.
+    """
+
+    return "attention_mask" in inspect.signature(model.forward).parameters
+
+
+def model_predict(
+    model, input_ids, num_tokens_to_generate, temperature=1.0, attention_mask=None
+):
     """
     Model Predict
     -------------
@@ -59,6 +81,7 @@ def model_predict(model, input_ids, num_tokens_to_generate, temperature=1.0):
     - `input_ids` (torch.Tensor): A tensor of tokenized input IDs.
     - `num_tokens_to_generate` (int): The number of tokens to generate.
     - `temperature` (float): The temperature setting for the generation process. Default is 1.0.
+    - `attention_mask` (Optional[torch.Tensor]): Mask marking the padding positions of `input_ids`. Default is None.
 
     Returns:
     - `torch.Tensor`: The model's prediction as a tensor of output IDs.
@@ -70,9 +93,14 @@ def model_predict(model, input_ids, num_tokens_to_generate, temperature=1.0):
         >>> print(prediction)
     """
 
+    generate_kwargs = {}
+    if attention_mask is not None:
+        generate_kwargs["attention_mask"] = attention_mask
+
     with torch.no_grad():
         prediction = model.generate(
             input_ids,
+            **generate_kwargs,
             max_length=input_ids.shape[1] + num_tokens_to_generate,
             num_return_sequences=1,
             eos_token_id=74,  # If token 74 (gameSeparator) is produced, stop generating
@@ -244,6 +272,629 @@ def generate_batch_predictions(
     )
 
 
+def generate_masked_batch_predictions(
+    inputs,
+    num_tokens_to_generate,
+    model,
+    notation,
+    temperature=1.0,
+    seed=None,
+    timer=None,
+):
+    """
+    Generate Masked Batch Predictions
+    ---------------------------------
+
+    Generates predictions for inputs of different lengths in as few forward passes as possible.
+    For models that take an attention mask (GPT-2), all inputs are left padded and generated in one
+    attention-masked batch. For models that ignore the mask (Mamba), the inputs are grouped by token
+    length so that no padding is needed. In both cases the result for each input is the same as if it
+    had been generated on its own.
+
+    Parameters:
+    - `inputs` (List[str]): A list of input strings for which to generate predictions.
+    - `num_tokens_to_generate` (int): The number of tokens to generate for each prediction.
+    - `model` (torch.nn.Module): The pre-trained language model used for generating predictions.
+    - `notation` (str): The notation for which the token mappings are defined.
+    - `temperature` (float): The temperature setting for the generation process. Default is 1.0.
+    - `seed` (Optional[int]): A seed for the random number generator. Default is None.
+    - `timer` (Optional[Callable[[str], ContextManager]]): Called with the stage name ("tokenization", "generation" or "detokenization") to time each stage. Default is None.
+
+    Returns:
+    - Tuple[List[str], List[str], List[str]]: A tuple containing lists of the detokenized outputs, predicted token strings, and original tokenized strings, in the order of `inputs`.
+
+    Example:
+        >>> inputs = ["Pe2e4-", "Pd2d4- Pd7d5- Pc2c4-"]
+        >>> outputs, _, _ = generate_masked_batch_predictions(
+                inputs, num_tokens_to_generate=3, model=model, notation='xLANplus', temperature=0.01
+            )
+        >>> print(outputs)
+    """
+    original_device = next(model.parameters()).device
+    model.to("cuda" if torch.cuda.is_available() else "cpu")
+    device = next(model.parameters()).device
+
+    if seed is not None:
+        torch.manual_seed(seed)
+    if timer is None:
+
+        def timer(stage):
+            return contextlib.nullcontext()
+
+    with timer("tokenization"):
+        tokenized_strings = [
+            tokenize_data(input_data=input, notation=notation) for input in inputs
+        ]
+        token_lists = [
+            convert_string_to_list(tokenized_string)
+            for tokenized_string in tokenized_strings
+        ]
+
+    use_attention_mask = supports_attention_mask(model)
+    if use_attention_mask:
+        groups = [list(range(len(token_lists)))]
+    else:
+        groups_by_length = {}
+        for index, token_list in enumerate(token_lists):
+            groups_by_length.setdefault(len(token_list), []).append(index)
+        groups = list(groups_by_length.values())
+
+    predicted_token_strings = [None] * len(token_lists)
+    for group in groups:
+        max_length = max(len(token_lists[index]) for index in group)
+        padded_token_lists = [
+            [0] * (max_length - len(token_lists[index])) + token_lists[index]
+            for index in group
+        ]
+        input_ids = torch.tensor(padded_token_lists).to(device)
+        attention_mask = None
+        if use_attention_mask:
+            attention_mask = (input_ids != 0).long()
+
+        with timer("generation"):
+            predictions = model_predict(
+                model, input_ids, num_tokens_to_generate, temperature, attention_mask
+            ).cpu()
+
+        for index, prediction in zip(group, predictions):
+            predicted_token_strings[index] = convert_list_to_string(
+                prediction.numpy().tolist()
+            )
+
+    with timer("detokenization"):
+        detokenized_outputs = [
+            detokenize_data(tokenized_data=token_string, notation=notation)
+            for token_string in predicted_token_strings
+        ]
+
+    model.to(original_device)
+
+    return detokenized_outputs, predicted_token_strings, tokenized_strings
+
+
+def forward_with_cache(model, token_ids, cache=None):
+    """
+    Forward With Cache
+    ------------------
+
+    Runs new tokens through the model, continuing from the cache of the tokens before them. This
+    makes the work per call proportional to the number of new tokens instead of the whole sequence.
+    GPT-2 caches the attention keys and values, Mamba its recurrent state. A GPT-2 cache is not
+    modified by this function, a Mamba cache is updated in place.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `token_ids` (List[int]): The new token IDs. Must not be empty.
+    - `cache` (Optional[object]): The cache returned by a previous call, or None to start a new sequence.
+
+    Returns:
+    - Tuple[torch.Tensor, object]: The logits for the token after `token_ids` and the cache covering all tokens so far.
+
+    Example:
+        >>> logits, cache = forward_with_cache(model, [75, 6, 40, 42, 76])
+        >>> logits, cache = forward_with_cache(model, [6, 45, 43, 76], cache)
+    """
+    device = next(model.parameters()).device
+    uses_attention = supports_attention_mask(model)
+
+    # Mamba only accepts one token at a time once its state has been initialised
+    if uses_attention or cache is None:
+        chunks = [token_ids]
+    else:
+        chunks = [[token_id] for token_id in token_ids]
+
+    with torch.no_grad():
+        for chunk in chunks:
+            input_ids = torch.tensor([chunk], device=device)
+            if cache is None:
+                outputs = model(input_ids, use_cache=True)
+            elif uses_attention:
+                outputs = model(input_ids, past_key_values=cache, use_cache=True)
+            else:
+                outputs = model(input_ids, cache_params=cache, use_cache=True)
+            cache = outputs.past_key_values if uses_attention else outputs.cache_params
+
+    return outputs.logits[0, -1], cache
+
+
+def generate_with_cache(
+    model, logits, cache, num_tokens_to_generate, temperature=1.0, eos_token_id=74
+):
+    """
+    Generate With Cache
+    -------------------
+
+    Samples new tokens starting from the logits and cache returned by `forward_with_cache`.
+    The given cache is left unchanged, so it can be extended with the move that is actually played.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `logits` (torch.Tensor): The logits for the first token to generate.
+    - `cache` (object): The cache of all tokens before the first token to generate.
+    - `num_tokens_to_generate` (int): The number of tokens to generate.
+    - `temperature` (float): The temperature setting for the sampling. Default is 1.0.
+    - `eos_token_id` (int): Generation stops after this token (gameSeparator). Default is 74.
+
+    Returns:
+    - `List[int]`: The generated token IDs.
+    """
+    if not supports_attention_mask(model):
+        cache = copy.deepcopy(cache)
+
+    generated_tokens = []
+    for step in range(num_tokens_to_generate):
+        probabilities = F.softmax(logits / temperature, dim=-1)
+        token_id = torch.multinomial(probabilities, num_samples=1).item()
+        generated_tokens.append(token_id)
+        if token_id == eos_token_id or step == num_tokens_to_generate - 1:
+            break
+        logits, cache = forward_with_cache(model, [token_id], cache)
+
+    return generated_tokens
+
+
+def select_cache_rows(cache, rows):
+    """
+    Keeps only the given rows of the cache of a batch, e.g. to drop finished sequences.
+
+    Parameters:
+    - `cache` (object): A GPT-2 cache (one key and value tensor per layer) or a Mamba cache.
+    - `rows` (List[int]): The rows of the batch to keep.
+
+    Returns:
+    - `object`: The cache of the kept rows. The given cache is left unchanged.
+    """
+    if isinstance(cache, tuple):
+        return tuple(tuple(tensor[rows] for tensor in layer) for layer in cache)
+
+    cache = copy.copy(cache)
+    cache.conv_states = {
+        layer: state[rows] for layer, state in cache.conv_states.items()
+    }
+    cache.ssm_states = {layer: state[rows] for layer, state in cache.ssm_states.items()}
+    return cache
+
+
+def generate_until_finished(
+    model, token_lists, num_tokens_to_generate, add_token, temperature=1.0
+):
+    """
+    Generate Until Finished
+    -----------------------
+
+    Samples tokens for a batch of inputs one token at a time and stops every sequence as soon as
+    it is finished. Every sampled token is passed to `add_token(index, token_id)`; once it returns
+    True the sequence is dropped from the batch and from the cache, so the following forward passes
+    only run the unfinished sequences. Inputs of different lengths are generated in separate groups,
+    so no padding is needed.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `token_lists` (List[List[int]]): The token IDs of the inputs.
+    - `num_tokens_to_generate` (int): The maximum number of tokens to generate per input.
+    - `add_token` (Callable[[int, int], bool]): Called with the index of the input and the sampled token, returns True if the sequence is finished.
+    - `temperature` (float): The temperature setting for the sampling. Default is 1.0.
+
+    Returns:
+    - `List[List[int]]`: The generated token IDs of every input.
+
+    Example:
+        >>> generated = generate_until_finished(
+                model, [[75], [75]], 12, lambda index, token_id: token_id == 74
+            )
+    """
+    device = next(model.parameters()).device
+    uses_attention = supports_attention_mask(model)
+
+    groups_by_length = {}
+    for index, token_list in enumerate(token_lists):
+        groups_by_length.setdefault(len(token_list), []).append(index)
+
+    generated_tokens = [[] for _ in token_lists]
+    with torch.no_grad():
+        for group in groups_by_length.values():
+            active = list(group)
+            input_ids = torch.tensor([token_lists[index] for index in group])
+            cache = None
+            for _ in range(num_tokens_to_generate):
+                input_ids = input_ids.to(device)
+                if cache is None:
+                    outputs = model(input_ids, use_cache=True)
+                elif uses_attention:
+                    outputs = model(input_ids, past_key_values=cache, use_cache=True)
+                else:
+                    outputs = model(input_ids, cache_params=cache, use_cache=True)
+                cache = (
+                    outputs.past_key_values if uses_attention else outputs.cache_params
+                )
+
+                probabilities = F.softmax(outputs.logits[:, -1] / temperature, dim=-1)
+                token_ids = torch.multinomial(probabilities, num_samples=1)[:, 0]
+
+                unfinished = []
+                for row, (index, token_id) in enumerate(
+                    zip(active, token_ids.tolist())
+                ):
+                    generated_tokens[index].append(token_id)
+                    if not add_token(index, token_id):
+                        unfinished.append(row)
+                if not unfinished:
+                    break
+                if len(unfinished) < len(active):
+                    active = [active[row] for row in unfinished]
+                    cache = select_cache_rows(cache, unfinished)
+                    token_ids = token_ids[unfinished]
+                input_ids = token_ids.unsqueeze(1)
+
+    return generated_tokens
+
+
+def forward_batches(model, input_ids, attention_mask, max_batch_size=32):
+    """
+    Forward Batches
+    ---------------
+
+    Runs a batch of left padded inputs through the model in batches of similar length, as described
+    in `greedy_decode`. Must be called without gradients.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `input_ids` (torch.Tensor): The left padded token IDs, shape (batch, length).
+    - `attention_mask` (torch.Tensor): 1 for the tokens and 0 for the padding of `input_ids`.
+    - `max_batch_size` (int): The maximum number of inputs per forward pass. Default is 32.
+
+    Yields:
+    - Tuple[torch.Tensor, object, torch.Tensor, torch.Tensor]: The rows of the inputs in the batch, the model outputs with the cache, and the attention mask and position IDs of the batch. The mask and position IDs are None for models without an attention mask.
+    """
+    device = next(model.parameters()).device
+    uses_attention = supports_attention_mask(model)
+
+    lengths = attention_mask.sum(dim=1)
+    order = lengths.argsort(stable=True)
+    if uses_attention:
+        groups = list(order.split(max_batch_size))
+    else:
+        groups = []
+        for length in lengths.unique().tolist():
+            groups.extend(order[lengths[order] == length].split(max_batch_size))
+
+    for rows in groups:
+        length = lengths[rows].max().item()
+        batch_ids = input_ids[rows, input_ids.shape[1] - length :].to(device)
+        if uses_attention:
+            mask = attention_mask[rows, input_ids.shape[1] - length :].to(device)
+            position_ids = (mask.cumsum(dim=-1) - 1).clamp(min=0)
+            outputs = model(
+                batch_ids,
+                attention_mask=mask,
+                position_ids=position_ids,
+                use_cache=True,
+            )
+        else:
+            mask = position_ids = None
+            outputs = model(batch_ids, use_cache=True)
+        yield rows, outputs, mask, position_ids
+
+
+def greedy_decode(
+    model, input_ids, attention_mask, num_tokens_to_generate=1, max_batch_size=32
+):
+    """
+    Greedy Decode
+    -------------
+
+    Generates the most probable continuation of a batch of left padded inputs with the model cache.
+    The inputs are sorted by length and run in batches of similar length, with the padding cut to
+    the longest input of each batch. Models that take an attention mask (GPT-2) get the mask and
+    matching position IDs, for models that ignore the mask (Mamba) every batch only contains inputs
+    of the same length. In both cases the result for each input is the same as if it had been run
+    on its own.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `input_ids` (torch.Tensor): The left padded token IDs, shape (batch, length).
+    - `attention_mask` (torch.Tensor): 1 for the tokens and 0 for the padding of `input_ids`.
+    - `num_tokens_to_generate` (int): The number of tokens to generate. Default is 1.
+    - `max_batch_size` (int): The maximum number of inputs per forward pass. Default is 32.
+
+    Returns:
+    - Tuple[torch.Tensor, torch.Tensor]: The generated token IDs, shape (batch, num_tokens_to_generate), and the logits of the first generated token, shape (batch, vocab_size).
+
+    Example:
+        >>> tokens, logits = greedy_decode(model, input_ids, attention_mask, 3)
+        >>> top_tokens = logits.topk(5).indices
+    """
+    device = next(model.parameters()).device
+    generated_tokens = torch.zeros(
+        (len(input_ids), num_tokens_to_generate), dtype=torch.long
+    )
+    first_logits = None
+    with torch.no_grad():
+        for rows, outputs, mask, position_ids in forward_batches(
+            model, input_ids, attention_mask, max_batch_size
+        ):
+            for step in range(num_tokens_to_generate):
+                logits = outputs.logits[:, -1].cpu()
+                if first_logits is None:
+                    first_logits = logits.new_zeros((len(input_ids), logits.shape[-1]))
+                if step == 0:
+                    first_logits[rows] = logits
+                token_ids = logits.argmax(dim=-1)
+                generated_tokens[rows, step] = token_ids
+                if step == num_tokens_to_generate - 1:
+                    break
+
+                token_ids = token_ids.unsqueeze(1).to(device)
+                if mask is not None:
+                    mask = torch.cat([mask, mask.new_ones((len(mask), 1))], dim=-1)
+                    position_ids = position_ids[:, -1:] + 1
+                    outputs = model(
+                        token_ids,
+                        past_key_values=outputs.past_key_values,
+                        attention_mask=mask,
+                        position_ids=position_ids,
+                        use_cache=True,
+                    )
+                else:
+                    outputs = model(
+                        token_ids, cache_params=outputs.cache_params, use_cache=True
+                    )
+
+    return generated_tokens, first_logits
+
+
+def continue_batch(model, outputs, mask, position_ids, rows, token_ids):
+    """
+    Runs new tokens after the given rows of a batch from `forward_batches`, continuing from its cache.
+    Rows can be repeated, e.g. to continue one input with several moves. The cache of the batch is
+    left unchanged.
+
+    Returns:
+    - `torch.Tensor`: The log probabilities of the token after every new token, shape (rows, new tokens, vocab_size).
+    """
+    if mask is not None:
+        cache = select_cache_rows(outputs.past_key_values, rows)
+        new_mask = torch.cat([mask[rows], mask.new_ones(token_ids.shape)], dim=-1)
+        new_position_ids = (
+            position_ids[rows, -1:]
+            + 1
+            + torch.arange(token_ids.shape[1], device=token_ids.device)
+        )
+        logits = model(
+            token_ids,
+            past_key_values=cache,
+            attention_mask=new_mask,
+            position_ids=new_position_ids,
+            use_cache=True,
+        ).logits
+    else:
+        # Mamba only accepts one token at a time once its state has been initialised
+        cache = select_cache_rows(outputs.cache_params, rows)
+        logits = torch.stack(
+            [
+                model(column[:, None], cache_params=cache, use_cache=True).logits[:, -1]
+                for column in token_ids.T
+            ],
+            dim=1,
+        )
+    return F.log_softmax(logits.float(), dim=-1)
+
+
+def score_moves(
+    model,
+    input_ids,
+    attention_mask,
+    candidate_moves,
+    move_length,
+    beam_size=5,
+    max_batch_size=32,
+):
+    """
+    Score Moves
+    -----------
+
+    Computes the log probabilities of complete moves after a batch of left padded inputs. Every input
+    is run once (see `greedy_decode`), the remaining tokens of the moves continue from its cache. The
+    log probability of a move is the sum of the log probabilities of its tokens. Besides the given
+    candidate moves, e.g. the legal moves, the `beam_size` most probable moves found by a beam search
+    are scored, so a move the model prefers over all candidates is scored as well.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `input_ids` (torch.Tensor): The left padded token IDs, shape (batch, length).
+    - `attention_mask` (torch.Tensor): 1 for the tokens and 0 for the padding of `input_ids`.
+    - `candidate_moves` (List[Iterable[Tuple[int]]]): The token IDs of the candidate moves of every input.
+    - `move_length` (int): The number of tokens of a move. All candidate moves must have this length,
+      e.g. the `tokens_per_ply` of the notation.
+    - `beam_size` (int): The number of moves found by beam search. Default is 5.
+    - `max_batch_size` (int): The maximum number of inputs or moves per forward pass. Default is 32.
+
+    Returns:
+    - `List[Dict[Tuple[int], float]]`: The log probabilities of the scored moves of every input.
+
+    Raises:
+    - `ValueError`: If a candidate move does not have `move_length` tokens.
+
+    Example:
+        >>> scores = score_moves(model, input_ids, attention_mask, [{(6, 40, 42)}], 3)
+        >>> best_move = max(scores[0], key=scores[0].get)
+    """
+    for moves in candidate_moves:
+        for move in moves:
+            if len(move) != move_length:
+                raise ValueError(
+                    f"Candidate move {move} does not have {move_length} tokens"
+                )
+    device = next(model.parameters()).device
+    scores = [{} for _ in range(len(input_ids))]
+    with torch.no_grad():
+        for rows, outputs, mask, position_ids in forward_batches(
+            model, input_ids, attention_mask, max_batch_size
+        ):
+            first_log_probs = F.log_softmax(outputs.logits[:, -1].float(), dim=-1)
+
+            def continue_rows(batch_rows, token_ids):
+                if token_ids.shape[1] == 0:
+                    return None
+                return torch.cat(
+                    [
+                        continue_batch(
+                            model,
+                            outputs,
+                            mask,
+                            position_ids,
+                            batch_rows[start : start + max_batch_size],
+                            token_ids[start : start + max_batch_size],
+                        )
+                        for start in range(0, len(batch_rows), max_batch_size)
+                    ]
+                )
+
+            # beam search, every step continues all beams of all inputs from the input cache
+            beam_scores, beam_tokens = first_log_probs.topk(beam_size, dim=-1)
+            beam_tokens = beam_tokens[:, :, None]
+            beam_rows = torch.arange(len(rows), device=device).repeat_interleave(
+                beam_size
+            )
+            for _ in range(move_length - 1):
+                log_probs = continue_rows(beam_rows, beam_tokens.flatten(0, 1))[:, -1]
+                total_scores = beam_scores[:, :, None] + log_probs.view(
+                    len(rows), beam_size, -1
+                )
+                beam_scores, indices = total_scores.flatten(1).topk(beam_size, dim=-1)
+                beams = indices // log_probs.shape[-1]
+                beam_tokens = torch.cat(
+                    [
+                        beam_tokens.gather(
+                            1, beams[:, :, None].expand(-1, -1, beam_tokens.shape[2])
+                        ),
+                        (indices % log_probs.shape[-1])[:, :, None],
+                    ],
+                    dim=-1,
+                )
+            for row, tokens, move_scores in zip(
+                rows.tolist(), beam_tokens.tolist(), beam_scores.tolist()
+            ):
+                scores[row].update(zip(map(tuple, tokens), move_scores))
+
+            # candidate moves, all tokens after the first one run in one pass
+            candidate_rows = []
+            candidate_tokens = []
+            for batch_row, row in enumerate(rows.tolist()):
+                for move in candidate_moves[row]:
+                    candidate_rows.append(batch_row)
+                    candidate_tokens.append(move)
+            if not candidate_tokens:
+                continue
+            candidate_rows = torch.tensor(candidate_rows, device=device)
+            candidate_tokens = torch.tensor(candidate_tokens, device=device)
+            move_scores = first_log_probs[candidate_rows, candidate_tokens[:, 0]]
+            log_probs = continue_rows(candidate_rows, candidate_tokens[:, :-1])
+            if log_probs is not None:
+                move_scores = move_scores + log_probs.gather(
+                    2, candidate_tokens[:, 1:, None]
+                ).sum(dim=(1, 2))
+            for batch_row, tokens, move_score in zip(
+                candidate_rows.tolist(), candidate_tokens.tolist(), move_scores.tolist()
+            ):
+                scores[rows[batch_row].item()][tuple(tokens)] = move_score
+
+    return scores
+
+
+def generate_candidates(model, logits, cache, candidate_tokens, top_k=5):
+    """
+    Generate Candidates
+    -------------------
+
+    Finds the `top_k` most probable of the given candidate moves, e.g. the legal moves of a position,
+    starting from the logits and cache returned by `forward_with_cache`. The probability of a move is
+    the product of the probabilities of its three tokens (piece, from square, to square). The moves are
+    explored as a tree, most probable prefixes first, and a prefix is skipped as soon as its probability
+    cannot beat the current top k anymore. The given cache is left unchanged.
+
+    Yields the current top k after every explored piece, so the best candidates are known early.
+    The last list that is yielded is the exact top k.
+
+    Parameters:
+    - `model` (torch.nn.Module): The pre-trained language model.
+    - `logits` (torch.Tensor): The logits for the first token of the move.
+    - `cache` (object): The cache of all tokens before the move.
+    - `candidate_tokens` (Dict[object, Tuple[int, int, int]]): Maps every candidate to its piece, from and to token IDs.
+    - `top_k` (int): The number of candidates to return. Default is 5.
+
+    Yields:
+    - `List[Tuple[object, float]]`: The best candidates found so far with their probabilities, most probable first.
+
+    Example:
+        >>> logits, cache = forward_with_cache(model, token_ids)
+        >>> for candidates in generate_candidates(model, logits, cache, {"e2e4": (6, 40, 42)}):
+        >>>     print(candidates)
+    """
+    # a Mamba cache is updated in place, so every branch needs its own copy
+    in_place_cache = not supports_attention_mask(model)
+
+    def copy_cache(cache):
+        return copy.deepcopy(cache) if in_place_cache else cache
+
+    tree = {}
+    for candidate, (piece, from_square, to_square) in candidate_tokens.items():
+        tree.setdefault(piece, {}).setdefault(from_square, {})[to_square] = candidate
+
+    scored = []
+
+    def bound():
+        return scored[top_k - 1][1] if len(scored) >= top_k else 0.0
+
+    piece_probabilities = F.softmax(logits, dim=-1).tolist()
+    for piece in sorted(tree, key=lambda token: -piece_probabilities[token]):
+        if piece_probabilities[piece] <= bound():
+            break
+        logits, piece_cache = forward_with_cache(model, [piece], copy_cache(cache))
+        from_probabilities = F.softmax(logits, dim=-1).tolist()
+
+        for from_square in sorted(
+            tree[piece], key=lambda token: -from_probabilities[token]
+        ):
+            prefix_probability = (
+                piece_probabilities[piece] * from_probabilities[from_square]
+            )
+            if prefix_probability <= bound():
+                break
+            logits, _ = forward_with_cache(
+                model, [from_square], copy_cache(piece_cache)
+            )
+            to_probabilities = F.softmax(logits, dim=-1).tolist()
+            for to_square, candidate in tree[piece][from_square].items():
+                scored.append(
+                    (candidate, prefix_probability * to_probabilities[to_square])
+                )
+            scored.sort(key=lambda item: -item[1])
+            del scored[top_k:]
+
+        yield list(scored)
+
+
 def generate_beam(input, model, notation, num_tokens_to_generate=3, beam_size=10):
     """
     Generate Beam
@@ -0,0 +1,32 @@
+"""
+Lazy Imports
+------------
+
+Importing torch and transformers takes seconds. Modules that only need them to run a model import
+them lazily, so that importing such a module (e.g. for the chess logic or the backend routes) stays
+fast and the cost is paid on the first prediction instead.
+"""
+
+import importlib
+
+
+class LazyModule:
+    """
+    Stands in for a module and imports it on the first attribute access.
+
+    Example:
+        >>> torch = LazyModule("torch")
+        >>> torch.tensor([1, 2, 3])  # torch is imported here
+    """
+
+    def __init__(self, name):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attribute):
+        if self._module is None:
+            self.__dict__["_module"] = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'>"
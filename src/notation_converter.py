@@ -66,6 +66,36 @@ def uci_move_to_xlan(board, move):
     return piece.symbol().upper() + move[:4]
 
 
+def uci_move_to_xlanplus(board, move):
+    """
+    Converts a move from UCI (Universal Chess Interface) format to xLAN+ format.
+    The indicator is determined like in xlan_sequence_to_xlanplus. The board is left unchanged.
+
+    Args:
+    board (chess.Board): The position before the move.
+    move (str): The move to be converted, expected in the format of 'e2e4' or similar.
+
+    Returns:
+    str: The move in xLAN+ format, like 'Pe2e4-', or 'Qe7e8+' for a promotion giving check.
+    """
+    xlan_move = uci_move_to_xlan(board, move)
+    parsed_move = chess.Move.from_uci(move)
+    capture = board.is_capture(parsed_move)
+    board.push(parsed_move)
+    mate = board.is_checkmate()
+    check = board.is_check()
+    board.pop()
+    if check:
+        suffix = "+" if not capture else "$"
+    elif mate:
+        suffix = "#" if not capture else "!"
+    elif capture:
+        suffix = "x"
+    else:
+        suffix = "-"
+    return xlan_move + suffix
+
+
 def xlan_sequence_to_uci(moves_string):
     """
     Converts a string of moves from unique xLAN format to UCI format.
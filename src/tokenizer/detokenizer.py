@@ -13,7 +13,7 @@ The script is executed from the command line and requires three arguments:
 
 Example:
     Command line:
-        python decoder.py tokens.json tokenized_data.txt decoded_data.txt
+        python -m src.tokenizer.detokenizer tokens.json tokenized_data.txt decoded_data.txt
 
     This command will read the tokenized data from 'tokenized_data.txt', decode it using 
     the mappings specified in 'tokens.json', and then write the original (decoded) data 
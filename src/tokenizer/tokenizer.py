@@ -12,16 +12,28 @@ The script is run via the command line and requires three arguments:
 
 Example:
     Command line:
-        python tokenizer.py tokens.json input_data.txt output_tokenized.txt
+        python -m src.tokenizer.tokenizer tokens.json input_data.txt output_tokenized.txt
 
     This command will read the data from 'input_data.txt', tokenize it based on 'tokens.json', 
     and write the tokenized output to 'output_tokenized.txt'.
 """
 
+import os
 import json
+import hashlib
 import argparse
+import functools
 import multiprocessing
 
+from src.data_preprocessing.bounded_imap import bounded_imap
+from src.data_preprocessing.compressed_input import open_input
+from src.data_preprocessing.run_manifest import (
+    RunManifest,
+    atomic_open,
+    get_temporary_path,
+    hash_file,
+)
+
 
 def get_token_file(notation):
     """
@@ -46,6 +58,63 @@ def get_token_file(notation):
         raise ValueError(f"Notation '{notation}' not found in {notation_file} File.")
 
 
+@functools.lru_cache(maxsize=None)
+def load_tokens(notation):
+    """
+    Loads the token mappings of a notation once per process.
+
+    Args:
+    notation (str): The notation for which the token mappings are required. E.g. "xLAN", "xLANplus".
+
+    Returns:
+    dict: A dictionary of token categories, each containing specific tokens. Must not be modified.
+    """
+    with open(get_token_file(notation), "r") as file:
+        return json.load(file)
+
+
+@functools.lru_cache(maxsize=None)
+def token_categories(notation):
+    """
+    Maps every token ID of a notation to its category and string, like `get_buffer_for_token` of the
+    detokenizer does for a single token.
+
+    Args:
+    notation (str): The notation for which the token mappings are required. E.g. "xLAN", "xLANplus".
+
+    Returns:
+    dict: Maps token IDs to (category, string) tuples. Must not be modified.
+    """
+    categories = {}
+    for category, items in load_tokens(notation).items():
+        for buffer, token_id in items.items():
+            categories.setdefault(token_id, (category, buffer))
+    return categories
+
+
+def tokenize_move(move, notation):
+    """
+    Tokenizes a single move without scanning the move character by character.
+    Gives the same tokens as tokenize_data for this move (without the start token).
+
+    Args:
+    move (str): The move in xLAN or xLAN+ format, e.g. "Pe2e4" or "Pe2e4-".
+    notation (str): The notation for which the token mappings should be used.
+
+    Returns:
+    list: The token IDs of the move.
+    """
+    tokens = load_tokens(notation)
+    token_ids = [
+        tokens["pieces"][move[0]],
+        tokens["squares"][move[1:3]],
+        tokens["squares"][move[3:5]],
+    ]
+    if len(move) > 5:
+        token_ids.append(tokens["plusTokens"][move[5]])
+    return token_ids
+
+
 def get_token_for_buffer(buf, tokens):
     """
     Identifies the token corresponding to a buffer string, if it exists.
@@ -154,10 +223,29 @@ def worker(chunk, tokens):
     return tokenized_data
 
 
+def tokenize_task(task):
+    """
+    Called by the multiprocessing pool to tokenize a chunk of a batch.
+
+    Args:
+    task (tuple): The index of the batch, whether the chunk is the last one of the batch, the chunk and the tokens.
+
+    Returns:
+    tuple: The index of the batch, whether the chunk is the last one of the batch and the tokenized chunk.
+    """
+    batch_index, last_in_batch, chunk, tokens = task
+    return batch_index, last_in_batch, worker(chunk, tokens)
+
+
 def tokenize_data_multiprocessing(input_data, notation, out_path, batch_size=100000):
     """
     Tokenizes the input data based on the provided token mappings, using multiprocessing to speed up the process.
 
+    The progress is recorded after every batch in a manifest next to the output file (`{out_path}.manifest.json`),
+    with the size and the checksum of the output written so far. The output is written to a temporary file that
+    is renamed to `out_path` when all batches are done. If the tokenization is interrupted, it resumes after the
+    last recorded batch when it is run again with the same input data, notation and batch size.
+
     Args:
     input_data (str): The raw input data as a string.
     notation (str): The notation for which the token mappings should be used.
@@ -176,31 +264,90 @@ def tokenize_data_multiprocessing(input_data, notation, out_path, batch_size=100
     chunks = [
         "".join(lines[i : i + batch_size]) for i in range(0, len(lines), batch_size)
     ]
-    result = []
-    for chunk in enumerate(chunks):
-        lines = chunk[1].splitlines(keepends=True)
-        process_chunk_size = len(lines) // num_cores
-        process_chunks = [
-            "".join(lines[i : i + process_chunk_size])
-            for i in range(0, len(lines), process_chunk_size)
-        ]
-
-        # Initialize multiprocessing pool
-        pool = multiprocessing.Pool(processes=num_cores)
-
-        # Map the worker function to the data chunks
-        results = pool.starmap(worker, [(chunk, tokens) for chunk in process_chunks])
-
-        print(f"Chunks done {chunk[0]+1}/{len(chunks)}", end="\r")
-        # Close the pool and wait for the work to finish
-        pool.close()
-        pool.join()
-        tokenized_data = " ".join(
-            map(str, [item for sublist in results for item in sublist])
-        )
 
-        with open(out_path, "a") as out_file:
-            out_file.write(tokenized_data)
+    input_checksum = hashlib.sha256()
+    for chunk in chunks:
+        input_checksum.update(chunk.encode())
+    manifest = RunManifest(
+        f"{out_path}.manifest.json",
+        {
+            "notation": notation,
+            "batch_size": batch_size,
+            "input_checksum": input_checksum.hexdigest(),
+        },
+    )
+    if manifest.is_finished():
+        print(f"{out_path} is already complete")
+        return
+
+    # resume after the last batch whose output is unchanged
+    partial_path = get_temporary_path(out_path)
+    batches_done = len(manifest.state["completed"])
+    output_checksum = hashlib.sha256()
+    if batches_done:
+        last_batch = manifest.state["completed"][str(batches_done - 1)]
+        if (
+            os.path.exists(partial_path)
+            and os.path.getsize(partial_path) >= last_batch["output_size"]
+        ):
+            output_checksum = hash_file(partial_path, last_batch["output_size"])
+        if output_checksum.hexdigest() == last_batch["output_checksum"]:
+            os.truncate(partial_path, last_batch["output_size"])
+            print(f"Resuming after {batches_done}/{len(chunks)} chunks")
+        else:
+            manifest.reset()
+            batches_done = 0
+            output_checksum = hashlib.sha256()
+    if not batches_done:
+        open(partial_path, "w").close()
+
+    def tasks():
+        for batch_index, chunk in enumerate(chunks):
+            if batch_index < batches_done:
+                continue
+            lines = chunk.splitlines(keepends=True)
+            process_chunk_size = max(1, len(lines) // num_cores)
+            process_chunks = [
+                "".join(lines[i : i + process_chunk_size])
+                for i in range(0, len(lines), process_chunk_size)
+            ]
+            for index, process_chunk in enumerate(process_chunks):
+                last_in_batch = index == len(process_chunks) - 1
+                yield batch_index, last_in_batch, process_chunk, tokens
+
+    # One pool for all batches; the results are written in order as soon as they arrive
+    written_in_batch = False
+    with multiprocessing.Pool(processes=num_cores) as pool, open(
+        partial_path, "a"
+    ) as out_file:
+        for batch_index, last_in_batch, result in bounded_imap(
+            pool, tokenize_task, tasks(), 2 * num_cores
+        ):
+            tokenized_data = " ".join(map(str, result))
+            if tokenized_data:
+                # the tokens of all chunks of a batch are separated by spaces
+                if written_in_batch:
+                    tokenized_data = " " + tokenized_data
+                out_file.write(tokenized_data)
+                output_checksum.update(tokenized_data.encode())
+                written_in_batch = True
+            if not last_in_batch:
+                continue
+
+            written_in_batch = False
+            out_file.flush()
+            os.fsync(out_file.fileno())
+            manifest.complete(
+                batch_index,
+                {
+                    "output_size": out_file.tell(),
+                    "output_checksum": output_checksum.hexdigest(),
+                },
+            )
+            print(f"Chunks done {batch_index+1}/{len(chunks)}", end="\r")
+
+    os.replace(partial_path, out_path)
+    manifest.finish([out_path])
 
 
 def tokenize_file(
@@ -211,11 +358,11 @@ def tokenize_file(
 
     Args:
     - notation (str): The notation for which the token mappings should be used.
-    - data_path (str): Path to the input data file containing raw data to be tokenized.
+    - data_path (str): Path to the input data file containing raw data to be tokenized. Can be compressed (.gz, .bz2, .xz).
     - out_path (str): Path to the output file where the tokenized data will be stored.
     - multiprocessing (bool): Whether to use multiprocessing to speed up the tokenization process.
     """
-    with open(data_path, "r") as file:
+    with open_input(data_path) as file:
         input_data = file.read()
 
     if multiprocessing:
@@ -229,7 +376,7 @@ def tokenize_file(
         tokenized_data = tokenize_data(input_data=input_data, notation=notation)
 
     if not multiprocessing:
-        with open(out_path, "w") as out_file:
+        with atomic_open(out_path) as out_file:
             out_file.write(tokenized_data)
 
 
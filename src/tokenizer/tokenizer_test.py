@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import unittest
+
+from src.tokenizer.tokenizer import tokenize_data_multiprocessing
+
+GAMES = "".join(
+    f"1. Pe2-e4 Pe7-e5 2. Ng1-f3 Nb8-c6 {result}\n"
+    for result in ["1-0", "0-1", "1/2-1/2"] * 10
+)
+
+
+class tokenizer_test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.out_path = os.path.join(self.directory.name, "games.tok")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read_output(self):
+        with open(self.out_path) as file:
+            return file.read()
+
+    def test_rerun_does_not_duplicate_output(self):
+        tokenize_data_multiprocessing(GAMES, "xLAN", self.out_path, batch_size=7)
+        expected = self.read_output()
+        self.assertEqual(len(expected.splitlines()), 30)
+
+        tokenize_data_multiprocessing(GAMES, "xLAN", self.out_path, batch_size=7)
+        self.assertEqual(self.read_output(), expected)
+
+        # a different batch size starts over instead of appending
+        tokenize_data_multiprocessing(GAMES, "xLAN", self.out_path, batch_size=4)
+        self.assertEqual(
+            [line.split() for line in self.read_output().splitlines()],
+            [line.split() for line in expected.splitlines()],
+        )
+
+    def test_interrupted_tokenization_resumes(self):
+        tokenize_data_multiprocessing(GAMES, "xLAN", self.out_path, batch_size=7)
+        expected = self.read_output()
+
+        # simulate a run that was killed while writing the fourth batch
+        manifest_path = f"{self.out_path}.manifest.json"
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        manifest["outputs"] = None
+        del manifest["completed"]["3"], manifest["completed"]["4"]
+        with open(manifest_path, "w") as file:
+            json.dump(manifest, file)
+        partial_size = manifest["completed"]["2"]["output_size"]
+        with open(f"{self.out_path}.tmp", "w") as file:
+            file.write(expected[:partial_size] + "6 39 ")
+        os.remove(self.out_path)
+
+        tokenize_data_multiprocessing(GAMES, "xLAN", self.out_path, batch_size=7)
+        self.assertEqual(self.read_output(), expected)
+        self.assertFalse(os.path.exists(f"{self.out_path}.tmp"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,7 @@ from transformers import (
 )
 from peft import PeftModel
 
+from src.data_preprocessing.pgn_to_tokens import read_token_games
 from src.validation.validate_model import ChessValidationCallback
 
 
@@ -26,7 +27,7 @@ class ChessTrainer:
     - batch_size (int): The number of games to be processed in each batch. The larger the batch size, the more memory is required.
     - learning_rate (float): The learning rate for training the LLM.
     - epochs (int): The number of times the model will see the entire dataset during training.
-    - input_file (str): Path to the text file containing tokenized Chess games.
+    - input_file (str): Path to the text file (or binary ".bin" file) containing tokenized Chess games.
     - output_dir (str): Path to the directory where the trained model will be saved.
     - save_steps (int): The number of steps between each checkpoint save. Defaults to 1000.
     - logging_steps (int): The number of steps between each logging of training metrics. Defaults to 50.
@@ -36,6 +37,7 @@ class ChessTrainer:
     - notation (str): The notation used to represent the Chess games. Defaults to "xLANplus". Options are "xLAN" and "xLANplus" and xLANc".
     - peft (PeftModel): A pretrained model to use for training. Defaults to None.
     - left_padding (bool): Whether to pad the left side of the game sequence. Defaults to False.
+    - background_validation (bool): Whether to validate in the background without pausing the training. Defaults to False.
 
     Example:
 
@@ -55,6 +57,7 @@ class ChessTrainer:
             notation="xLAN",
             peft=None,
             left_padding=False,
+            background_validation=False,
         )
 
         trainer.train()
@@ -77,6 +80,7 @@ class ChessTrainer:
         notation: str = "xLANplus",
         peft: PeftModel = None,
         left_padding: bool = False,
+        background_validation: bool = False,
     ) -> None:
         self.model_type = model_type
         self.batch_size = batch_size
@@ -93,6 +97,7 @@ class ChessTrainer:
         self.notation = notation
         self.peft = peft
         self.left_padding = left_padding
+        self.background_validation = background_validation
 
         self.notation_config = self.load_notation_config()
 
@@ -194,17 +199,21 @@ class ChessTrainer:
 
     def load_games(self) -> tuple[list[list[int]], int]:
         """
-        Loads the tokenized Chess games from the input file.
+        Loads the tokenized Chess games from the input file: a text file with one game per line, or a
+        binary token file written by `pgn_to_tokens` (".bin").
 
         Returns:
         - List[List[int]]: A list of lists containing the tokenized Chess games.
         - int: The lenght of the longest game in the dataset.
         """
 
-        with open(self.input_file, "r") as file:
-            lines = file.readlines()
+        if self.input_file.endswith(".bin"):
+            games = read_token_games(self.input_file)
+        else:
+            with open(self.input_file, "r") as file:
+                lines = file.readlines()
 
-        games = [[int(token) for token in line.split()] for line in lines]
+            games = [[int(token) for token in line.split()] for line in lines]
         max_length = max(len(game) for game in games)
         return games, max_length
 
@@ -317,6 +326,7 @@ class ChessTrainer:
                     self.weight_and_biases,
                     self.notation_config,
                     self.left_padding,
+                    background=self.background_validation,
                 )
             ],
         )
@@ -0,0 +1,145 @@
+"""
+Validation Fixtures
+-------------------
+
+The hard positions and board state positions under `data/validation/` are the same for every
+validation run. Instead of reading and tokenizing them on every validation, every fixture is loaded
+once per process: its positions are tokenized to a left padded tensor of token IDs and the legal
+moves of every position to a set of token ID tuples. A validation then only runs the model and
+looks up the predicted tokens in these sets.
+
+A fixture is identified by a hash of its file content. When the file changes it is loaded again.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import torch
+
+from src.generate_prediction import convert_string_to_list
+from src.tokenizer.tokenizer import token_categories, tokenize_data
+
+# Fixtures loaded by this process, maps (file path, notation) to ValidationFixture
+fixtures = {}
+fixtures_lock = threading.Lock()
+
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def tokenize(text, notation):
+    """
+    Returns the token IDs of a text, without the start token.
+    """
+    return convert_string_to_list(tokenize_data(input_data=text, notation=notation))[1:]
+
+
+def last_word(token_ids, notation):
+    """
+    Returns the tokens of the last word of a token sequence, i.e. of the last element of
+    `detokenize_data(...).split(" ")`. Pieces and results start a new word (unless they follow a game
+    separator, which replaces the space), all other tokens extend the current word.
+
+    Args:
+    token_ids (list[int]): The token IDs.
+    notation (str): The notation of the tokens.
+
+    Returns:
+    tuple: The token IDs of the last word.
+    """
+    categories = token_categories(notation)
+    word = []
+    previous_category = None
+    for token_id in token_ids:
+        category = categories.get(token_id, ("paddingToken",))[0]
+        if category == "paddingToken":
+            continue
+        starts_word = category not in ("squares", "plusTokens", "gameSeparator")
+        if starts_word and previous_category != "gameSeparator":
+            word = []
+        word.append(token_id)
+        previous_category = category
+    return tuple(word)
+
+
+def detokenize_word(token_ids, notation):
+    """
+    Returns the text of the tokens of a word, see `last_word`.
+    """
+    text = ""
+    for token_id in token_ids:
+        category, buffer = token_categories(notation).get(
+            token_id, ("paddingToken", "")
+        )
+        if category == "gameSeparator":
+            text += "\n"
+        elif category != "paddingToken":
+            text += buffer
+    return text
+
+
+class ValidationFixture:
+    """
+    A validation fixture tokenized for one notation.
+
+    Attributes:
+    - path (str): The JSON file of the fixture.
+    - notation (str): The notation of the positions.
+    - version (str): The SHA-256 hash of the file content.
+    - data (list[dict]): The positions of the file, each with id, board_state and legal_positions.
+    - token_lists (list[list[int]]): The token IDs of every position, starting with the start token.
+    - input_ids (torch.Tensor): The left padded token IDs of all positions.
+    - attention_mask (torch.Tensor): 1 for the tokens and 0 for the padding of `input_ids`.
+    - legal_token_ids (list[set[tuple[int]]]): The token IDs of the legal moves of every position.
+    """
+
+    def __init__(self, path, notation, version=None):
+        self.path = path
+        self.notation = notation
+        self.version = version or file_hash(path)
+        with open(path, "r") as file:
+            self.data = json.load(file)
+
+        self.token_lists = [
+            convert_string_to_list(tokenize_data(position["board_state"], notation))
+            for position in self.data
+        ]
+        max_length = max(map(len, self.token_lists))
+        self.input_ids = torch.tensor(
+            [
+                [0] * (max_length - len(token_list)) + token_list
+                for token_list in self.token_lists
+            ]
+        )
+        self.attention_mask = (self.input_ids != 0).long()
+        self.legal_token_ids = [
+            {tuple(tokenize(move, notation)) for move in position["legal_positions"]}
+            for position in self.data
+        ]
+
+
+def load_fixture(notation, file_type):
+    """
+    Returns the validation fixture of a notation, tokenized on first use in this process.
+
+    Args:
+    notation (str): The notation of the fixture. E.g. "xLAN", "xLANplus".
+    file_type (str): The fixture in notation.json. E.g. "hard_positions_file", "board_state_file".
+
+    Returns:
+    ValidationFixture: The fixture. Must not be modified.
+    """
+    from src.validation.validate_position import get_file_path
+
+    path = os.path.abspath(get_file_path(notation, file_type))
+    version = file_hash(path)
+    with fixtures_lock:
+        fixture = fixtures.get((path, notation))
+        if fixture is None or fixture.version != version:
+            fixture = ValidationFixture(path, notation, version)
+            fixtures[(path, notation)] = fixture
+    return fixture
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, MambaConfig, MambaForCausalLM
+
+from src.generate_prediction import (
+    convert_string_to_list,
+    greedy_decode,
+    score_moves,
+)
+from src.tokenizer.detokenizer import detokenize_data
+from src.tokenizer.tokenizer import tokenize_data
+from src.validation.fixtures import detokenize_word, last_word, load_fixture
+from src.validation.validate_position import (
+    evaluate_hard_positions,
+    evaluate_legal_piece_moves,
+    predict_moves_for_all_positions,
+)
+
+
+def create_models():
+    with open("./src/notation.json") as file:
+        vocab_size = json.load(file)["xLANplus"]["vocab_size"]
+    torch.manual_seed(0)
+    models = [
+        GPT2LMHeadModel(
+            GPT2Config(vocab_size=vocab_size, n_layer=2, n_head=2, n_embd=32)
+        ),
+        MambaForCausalLM(
+            MambaConfig(vocab_size=vocab_size, hidden_size=32, num_hidden_layers=2)
+        ),
+    ]
+    return [model.eval() for model in models]
+
+
+def test_fixture_is_loaded_once():
+    fixture = load_fixture("xLANplus", "hard_positions_file")
+
+    assert load_fixture("xLANplus", "hard_positions_file") is fixture
+    assert fixture.input_ids.shape[0] == len(fixture.data)
+    assert tuple(convert_string_to_list(tokenize_data("Qd2g5x", "xLANplus"))[1:]) in (
+        fixture.legal_token_ids[0]
+    )
+
+
+def test_last_word_matches_detokenized_text():
+    for text in ["Pe2e4- Pe7e5- Ng1f3-", "Pe2e4- Pe7e5- e4e5", "Pe2e4- 1-0", "Pe2e4-"]:
+        token_ids = convert_string_to_list(tokenize_data(text, "xLANplus"))
+        for end in range(1, len(token_ids) + 1):
+            word = last_word(token_ids[:end], "xLANplus")
+            text = detokenize_data(" ".join(map(str, token_ids[:end])), "xLANplus")
+            assert detokenize_word(word, "xLANplus") == text.split(" ")[-1]
+
+
+def test_greedy_decode_matches_single_inputs():
+    fixture = load_fixture("xLANplus", "hard_positions_file")
+    for model in create_models():
+        tokens, logits = greedy_decode(
+            model, fixture.input_ids[:8], fixture.attention_mask[:8], 3
+        )
+        for index, token_list in enumerate(fixture.token_lists[:8]):
+            input_ids = torch.tensor([token_list])
+            single_tokens, single_logits = greedy_decode(
+                model, input_ids, torch.ones_like(input_ids), 3
+            )
+            assert tokens[index].tolist() == single_tokens[0].tolist()
+            assert torch.allclose(logits[index], single_logits[0], atol=1e-4)
+
+
+def test_legal_piece_moves_match_beam_search():
+    fixture = load_fixture("xLANplus", "board_state_file")
+    positions = [position["board_state"] for position in fixture.data[:10]]
+    for model in create_models():
+        _, results = evaluate_legal_piece_moves(model, notation="xLANplus")
+        beam_moves = predict_moves_for_all_positions(model, positions, "xLANplus")
+
+        for result, moves in zip(results, beam_moves):
+            number_of_legal_moves = len(result[2])
+            assert result[1][:number_of_legal_moves] == moves[:number_of_legal_moves]
+
+
+def test_score_moves_match_full_sequences():
+    fixture = load_fixture("xLANplus", "hard_positions_file")
+    for model in create_models():
+        scores = score_moves(
+            model,
+            fixture.input_ids[:6],
+            fixture.attention_mask[:6],
+            fixture.legal_token_ids[:6],
+            move_length=4,
+            beam_size=3,
+        )
+        for index, token_list in enumerate(fixture.token_lists[:6]):
+            assert fixture.legal_token_ids[index] <= scores[index].keys()
+            for move in list(scores[index])[:5]:
+                input_ids = torch.tensor([token_list + list(move)])
+                with torch.no_grad():
+                    log_probs = model(input_ids).logits[0].log_softmax(dim=-1)
+                expected = sum(
+                    log_probs[len(token_list) - 1 + step, token_id].item()
+                    for step, token_id in enumerate(move)
+                )
+                assert abs(scores[index][move] - expected) < 1e-3
+
+
+def test_score_moves_rejects_moves_of_another_length():
+    fixture = load_fixture("xLANplus", "hard_positions_file")
+    model = create_models()[0]
+    with pytest.raises(ValueError):
+        score_moves(
+            model,
+            fixture.input_ids[:2],
+            fixture.attention_mask[:2],
+            fixture.legal_token_ids[:2],
+            move_length=3,
+        )
+
+
+def test_hard_positions_are_deterministic():
+    model = create_models()[0]
+    accuracy, results = evaluate_hard_positions(model, "xLANplus", tokens_per_ply=4)
+
+    # the default number of tokens of a move is the one of the notation
+    assert evaluate_hard_positions(model, "xLANplus") == (accuracy, results)
+    for _, _, predicted_correct, top_k_accuracy, legal_probability_mass in results:
+        assert 0 <= top_k_accuracy <= 1
+        assert 0 < legal_probability_mass <= 1
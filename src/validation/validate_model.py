@@ -1,3 +1,7 @@
+import copy
+import queue
+import threading
+
 from src.validation.validate_position import evaluate_hard_positions
 from src.validation.validate_position import evaluate_legal_piece_moves
 from src.validation.validate_sequence import validate_sequence
@@ -21,7 +25,7 @@ def validate_model(
     float,
     float,
     dict[str, int],
-    list[tuple[int, str, bool]],
+    list[tuple[int, str, bool, float, float]],
     list[tuple[float, list[tuple[int, str, str, bool, str]]]],
     list[tuple[str, int, str, str]],
 ]:
@@ -49,7 +53,7 @@ def validate_model(
         legal_piece_moves_accuracy (float): The accuracy of the model on legal piece moves.
         average_correct_plies (float): The average number of correct plies.
         error_frequencies (dict): A dictionary containing the frequencies of each error.
-        hard_position_results (list): A list of tuples containing position ID, predicted move, and correctness.
+        hard_position_results (list): A list of tuples containing position ID, predicted move, correctness, top-k accuracy and legal probability mass.
         legal_piece_moves_results (list): A list of tuples containing the model's accuracy and a list of tuples with position ID, predicted moves, correct moves, correctness, piece and tag..
         sequence_results (list): A list of tuples containing game as string, number of moves until error, error type, and first illegal move.
     """
@@ -91,12 +95,23 @@ def validate_model(
     )
 
 
+def mean_column(results: list[tuple], column: int) -> float:
+    return sum(result[column] for result in results) / len(results) if results else 0
+
+
 class ChessValidationCallback(TrainerCallback):
     """
     Custom callback for the Hugging Face Trainer to perform validation of the chess model.
 
     This callback is invoked at each model log step, and it runs validation tests on the model.
 
+    With `background` the training does not wait for the validation. The weights are copied into a
+    separate validation model, which is validated in a background thread while the training goes on.
+    At most one validation runs at a time. If a validation is still running at the next log step,
+    `busy_policy` decides whether this step is not validated ("skip") or whether the training waits
+    for the running validation ("wait"). The metrics are logged on the training thread at the next
+    step, against the global step of the weights they were computed with.
+
     Attributes:
         model (torch.nn.Module): The model being trained.
         model_type (str): The type of the model being trained. "GPT2" or "Mamba".
@@ -104,6 +119,9 @@ class ChessValidationCallback(TrainerCallback):
         wandb (bool): If True, logs the validation results to Weights & Biases.
         notation_config (dict): A dictionary containing file paths for the notation configuration.
         left_padding (bool): If True, left pads the input sequences.
+        background (bool): If True, validates in a background thread without stopping the training.
+        busy_policy (str): "skip" or "wait", what to do when a background validation is still running.
+        skipped_validations (int): The number of log steps skipped because a validation was running.
     """
 
     def __init__(
@@ -114,7 +132,11 @@ class ChessValidationCallback(TrainerCallback):
         wandb: bool = True,
         notation_config: dict = None,
         left_padding: bool = False,
+        background: bool = False,
+        busy_policy: str = "skip",
     ) -> None:
+        if busy_policy not in ("skip", "wait"):
+            raise ValueError(f"Unknown busy policy {busy_policy}")
         self.model = model
         self.model_type = model_type
         self.skipvalidation = skip_validation
@@ -123,26 +145,103 @@ class ChessValidationCallback(TrainerCallback):
         self.tokens_per_ply = self.notation_config["tokens_per_ply"]
         self.notation = self.notation_config["notation"]
         self.wandb = wandb
+        self.background = background
+        self.busy_policy = busy_policy
+        self.skipped_validations = 0
+
+        self.validation_model = None
+        self.validation_thread = None
+        # (global step, results) of finished background validations
+        self.results = queue.Queue()
 
     def on_log(self, args, state, control, **kwargs) -> None:
         """
         Called when the model is saved. If validation is not skipped, it triggers the validation and logging process.
         """
-        if not self.skipvalidation:
-            # if mamba is used, the model is saved in the cache folder
-            if self.model_type == "Mamba":
-                self.model.save_pretrained("Leon-LLM-Models/.cache")
-                self.cached_model = AutoModelForCausalLM.from_pretrained(
-                    "Leon-LLM-Models/.cache"
-                )
-            self.validate_and_log()
+        if self.skipvalidation:
+            return
+        if self.background:
+            self.log_finished_validations()
+            self.start_background_validation(state.global_step)
+            return
+        # if mamba is used, the model is saved in the cache folder
+        if self.model_type == "Mamba":
+            self.model.save_pretrained("Leon-LLM-Models/.cache")
+            self.cached_model = AutoModelForCausalLM.from_pretrained(
+                "Leon-LLM-Models/.cache"
+            )
+        self.validate_and_log()
 
-    def validate_and_log(self) -> None:
+    def on_step_end(self, args, state, control, **kwargs) -> None:
         """
-        Performs validation of the model using the validate_model function and logs the results to wandb.
+        Logs the results of background validations that finished since the last step.
+        """
+        if self.background:
+            self.log_finished_validations()
+
+    def on_train_end(self, args, state, control, **kwargs) -> None:
+        """
+        Waits for a running background validation and logs its results.
+        """
+        if self.validation_thread is not None:
+            self.validation_thread.join()
+        self.log_finished_validations()
+
+    def snapshot_model(self) -> torch.nn.Module:
+        """
+        Copies the current weights of the model into the validation model. The validation model is
+        created once as a copy of the model and receives only the state dict on later snapshots.
+        """
+        if self.validation_model is None:
+            self.validation_model = copy.deepcopy(self.model)
+            self.validation_model.requires_grad_(False)
+        else:
+            self.validation_model.load_state_dict(self.model.state_dict())
+        self.validation_model.eval()
+        return self.validation_model
+
+    def start_background_validation(self, global_step: int) -> None:
+        """
+        Snapshots the weights and validates them in a background thread, unless a validation is
+        still running and the busy policy is "skip".
+        """
+        if self.validation_thread is not None and self.validation_thread.is_alive():
+            if self.busy_policy == "skip":
+                self.skipped_validations += 1
+                return
+            self.validation_thread.join()
+            self.log_finished_validations()
+
+        model = self.snapshot_model()
+        self.validation_thread = threading.Thread(
+            target=self.run_validation,
+            args=(model, global_step),
+            name="validation",
+            daemon=True,
+        )
+        self.validation_thread.start()
+
+    def run_validation(self, model: torch.nn.Module, global_step: int) -> None:
+        with torch.no_grad():
+            self.results.put((global_step, self.validate(model)))
+
+    def log_finished_validations(self) -> None:
+        """
+        Logs the results of all finished background validations against their global step.
+        """
+        while True:
+            try:
+                global_step, results = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.log_metrics(*results, global_step=global_step)
+
+    def validate(self, model: torch.nn.Module) -> tuple:
         """
-        results = validate_model(
-            self.cached_model if self.model_type == "Mamba" else self.model,
+        Performs validation of the model using the validate_model function.
+        """
+        return validate_model(
+            model,
             max_batch_size=100,
             number_of_plies_to_generate=80,
             number_of_sequences=100,
@@ -151,6 +250,14 @@ class ChessValidationCallback(TrainerCallback):
             notation=self.notation,
             left_padding=self.left_padding,
         )
+
+    def validate_and_log(self) -> None:
+        """
+        Performs validation of the model using the validate_model function and logs the results to wandb.
+        """
+        results = self.validate(
+            self.cached_model if self.model_type == "Mamba" else self.model
+        )
         self.log_metrics(*results)
 
     def log_metrics(
@@ -159,11 +266,12 @@ class ChessValidationCallback(TrainerCallback):
         legal_piece_moves_accuracy: float,
         average_correct_plies: int,
         error_frequencies: dict[str, int],
-        hard_position_results: list[tuple[int, str, bool]],
+        hard_position_results: list[tuple[int, str, bool, float, float]],
         legal_piece_moves_results: list[
             tuple[float, list[tuple[int, str, str, bool, str]]]
         ],
         sequence_results: list[tuple[str, int, str, str]],
+        global_step: int = None,
     ) -> None:
         """
         Logs the validation metrics to Weights & Biases.
@@ -173,16 +281,26 @@ class ChessValidationCallback(TrainerCallback):
             legal_piece_moves_accuracy (float): The accuracy of the model on legal piece moves.
             average_correct_plies (float): The average number of correct plies.
             error_frequencies (dict): A dictionary containing the frequencies of each error.
-            hard_position_results (list): A list of tuples containing position ID, predicted move, and correctness.
+            hard_position_results (list): A list of tuples containing position ID, predicted move, correctness, top-k accuracy and legal probability mass.
             legal_piece_moves_results (list): A list of tuples containing the model's accuracy and a list of tuples with position ID, predicted moves, correct moves, correctness, piece and tag.
             sequence_results (list): A list of tuples containing game as string, number of moves until error, error type, and first illegal move.
+            global_step (int): The training step of the validated weights. Defaults to the current step.
         """
         if self.wandb:
+            # the Trainer logs its metrics against train/global_step
+            step = {} if global_step is None else {"train/global_step": global_step}
             wandb.log(
                 {
                     "hard position accuracy": hard_position_accuracy,
                     "legal piece moves accuracy": legal_piece_moves_accuracy,
                     "average correct plies": average_correct_plies,
+                    "hard position top-k accuracy": mean_column(
+                        hard_position_results, 3
+                    ),
+                    "hard position legal probability mass": mean_column(
+                        hard_position_results, 4
+                    ),
+                    **step,
                 }
             )
 
@@ -198,6 +316,7 @@ class ChessValidationCallback(TrainerCallback):
                     "legal piece moves results table": legal_moves_table,
                     "sequence results table": sequence_table,
                     "error frequency bar chart": error_frequencies_chart,
+                    **step,
                 }
             )
 
@@ -231,7 +350,7 @@ class ChessValidationCallback(TrainerCallback):
         Creates a table of hard position results.
 
         Parameters:
-            hard_position_results (list of tuples): List containing tuples of position ID, predicted move, and correctness.
+            hard_position_results (list of tuples): List containing tuples of position ID, predicted move, correctness, top-k accuracy and legal probability mass.
 
         Returns:
             wandb.Table: A table of hard position results.
@@ -239,7 +358,13 @@ class ChessValidationCallback(TrainerCallback):
 
         hard_position_table = wandb.Table(
             data=hard_position_results,
-            columns=["Position ID", "Predicted Move", "Correctness"],
+            columns=[
+                "Position ID",
+                "Predicted Move",
+                "Correctness",
+                "Top-k Accuracy",
+                "Legal Probability Mass",
+            ],
         )
 
         return hard_position_table
@@ -0,0 +1,94 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+pytest.importorskip("wandb")
+
+from src.validation.validate_model import ChessValidationCallback
+
+
+class StubbedValidationCallback(ChessValidationCallback):
+    """
+    Validates by returning the weight of the tiny model once `release` is set, and records the
+    logged results with their global step instead of logging them to Weights & Biases.
+    """
+
+    def __init__(self, busy_policy):
+        super().__init__(
+            torch.nn.Linear(1, 1, bias=False),
+            model_type="GPT2",
+            skip_validation=False,
+            wandb=False,
+            notation_config={"notation": "xLANplus", "tokens_per_ply": 4},
+            background=True,
+            busy_policy=busy_policy,
+        )
+        self.release = threading.Event()
+        self.started = []
+        self.logged = []
+
+    def set_weight(self, value):
+        with torch.no_grad():
+            self.model.weight.fill_(value)
+
+    def validate(self, model):
+        self.started.append(model.weight.item())
+        self.release.wait()
+        return (model.weight.item(), 0.0, 0, {}, [], [], [])
+
+    def log_metrics(self, *results, global_step=None):
+        self.logged.append((global_step, results[0]))
+
+
+def state(global_step):
+    return SimpleNamespace(global_step=global_step)
+
+
+def test_busy_validation_skips_step():
+    callback = StubbedValidationCallback("skip")
+    callback.set_weight(10)
+    callback.on_log(None, state(10), None)
+    # the training goes on while the weights of step 10 are validated
+    callback.set_weight(20)
+    callback.on_log(None, state(20), None)
+
+    assert callback.skipped_validations == 1
+    callback.on_step_end(None, state(21), None)
+    assert callback.logged == []
+
+    callback.release.set()
+    callback.validation_thread.join()
+    callback.on_step_end(None, state(22), None)
+    assert callback.started == [10]
+    assert callback.logged == [(10, 10)]
+
+    callback.set_weight(30)
+    callback.on_log(None, state(30), None)
+    callback.on_train_end(None, state(31), None)
+    assert callback.logged == [(10, 10), (30, 30)]
+    assert callback.skipped_validations == 1
+
+
+def test_busy_validation_waits_for_running_validation():
+    callback = StubbedValidationCallback("wait")
+    callback.set_weight(10)
+    callback.on_log(None, state(10), None)
+    callback.set_weight(20)
+    log_step = threading.Thread(target=callback.on_log, args=(None, state(20), None))
+    log_step.start()
+
+    # the log step waits until the running validation finishes
+    log_step.join(timeout=0.2)
+    assert log_step.is_alive()
+    assert callback.logged == []
+
+    callback.release.set()
+    log_step.join()
+    assert callback.logged == [(10, 10)]
+
+    callback.on_train_end(None, state(25), None)
+    assert callback.started == [10, 20]
+    assert callback.logged == [(10, 10), (20, 20)]
+    assert callback.skipped_validations == 0
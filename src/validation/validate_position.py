@@ -1,9 +1,12 @@
 import json
+import math
 
 import torch
 import src.notation_converter as converter
 from src.generate_prediction import generate_batch_predictions
 from src.generate_prediction import generate_beam
+from src.generate_prediction import greedy_decode, score_moves
+from src.validation.fixtures import detokenize_word, load_fixture
 from src.chess_game import ChessGame
 
 
@@ -161,42 +164,70 @@ def calculate_accuracy(total_positions: int, correct_predictions: int) -> float:
 def evaluate_hard_positions(
     model: torch.nn.Module,
     notation: str = "xLANplus",
-    tokens_per_ply: int = 3,
+    tokens_per_ply: int | None = None,
     left_padding: bool = False,
-) -> tuple[float, list[tuple[int, str, bool]]]:
+    top_k: int = 5,
+) -> tuple[float, list[tuple[int, str, bool, float, float]]]:
     """
     Evaluate a chess model using a set of positions and their legal moves.
 
+    The predicted move is the most probable complete move of the model. All legal moves and the
+    `top_k` moves of a beam search are scored with their exact probability, which makes the result
+    deterministic. Besides the correctness of the predicted move, every position reports the share of
+    legal moves among the `top_k` most probable moves and the probability mass on all legal moves.
+
     Parameters:
     model (Model): The chess model to be evaluated.
     notation (str): The notation for the positions.
-    tokens_per_ply (int): Number of tokens to generate per ply.
-    left_padding (bool): Whether to left pad the input sequence.
+    tokens_per_ply (int): Number of tokens of a move. Default is the `tokens_per_ply` of the notation in notation.json.
+    left_padding (bool): Unused, the positions are always left padded with an attention mask.
+    top_k (int): Number of most probable moves for the top-k accuracy.
 
     Returns:
-    tuple: A tuple containing the model's accuracy and a list of tuples with position ID, predicted move, and correctness.
+    tuple: A tuple containing the model's accuracy and a list of tuples with position ID, predicted move, correctness, top-k accuracy and legal probability mass.
     """
-    json_path = get_file_path(notation, "hard_positions_file")
-    left_padding = True
-    data = load_data(json_path)
-    board_states = [board_state["board_state"] for board_state in data]
-    predicted_moves = generate_predictions(
-        model, board_states, notation, tokens_per_ply, left_padding
+    if tokens_per_ply is None:
+        tokens_per_ply = get_file_path(notation, "tokens_per_ply")
+    fixture = load_fixture(notation, "hard_positions_file")
+    original_device = next(model.parameters()).device
+    model.to("cuda" if torch.cuda.is_available() else "cpu")
+    scores = score_moves(
+        model,
+        fixture.input_ids,
+        fixture.attention_mask,
+        fixture.legal_token_ids,
+        tokens_per_ply,
+        beam_size=top_k,
     )
+    model.to(original_device)
 
     correct_predictions = 0
     results = []
 
-    for idx, board_state in enumerate(data):
-
-        predicted_correct = is_move_legal(
-            board_state["legal_positions"], predicted_moves[idx]
+    for idx, board_state in enumerate(fixture.data):
+        legal_moves = fixture.legal_token_ids[idx]
+        ranked_moves = sorted(scores[idx], key=scores[idx].get, reverse=True)
+        predicted_correct = ranked_moves[0] in legal_moves
+        predicted_move = detokenize_word(ranked_moves[0], notation)
+        top_k_accuracy = sum(
+            move in legal_moves for move in ranked_moves[:top_k]
+        ) / len(ranked_moves[:top_k])
+        legal_probability_mass = sum(
+            math.exp(scores[idx][move]) for move in legal_moves
+        )
+        results.append(
+            (
+                board_state["id"],
+                predicted_move,
+                predicted_correct,
+                top_k_accuracy,
+                legal_probability_mass,
+            )
         )
-        results.append((board_state["id"], predicted_moves[idx], predicted_correct))
         if predicted_correct:
             correct_predictions += 1
 
-    accuracy = calculate_accuracy(len(data), correct_predictions)
+    accuracy = calculate_accuracy(len(fixture.data), correct_predictions)
 
     return accuracy, results
 
@@ -218,28 +249,29 @@ def evaluate_legal_piece_moves(
     Returns:
         tuple: A tuple containing the model's accuracy and a list of tuples with position ID, predicted moves, correct moves, correctness, piece and tag.
     """
-    json_path = get_file_path(notation, "board_state_file")
-    data = load_data(json_path)
-    positions = [position["board_state"] for position in data]
-    predicted_moves_per_position = predict_moves_for_all_positions(
-        model, positions, notation=notation
-    )
+    fixture = load_fixture(notation, "board_state_file")
+    original_device = next(model.parameters()).device
+    model.to("cuda" if torch.cuda.is_available() else "cpu")
+    _, logits = greedy_decode(model, fixture.input_ids, fixture.attention_mask)
+    top_tokens = logits.topk(27).indices.tolist()
+    model.to(original_device)
 
     correct_predictions = 0
     results = []
-    for idx, position in enumerate(data):
+    for idx, position in enumerate(fixture.data):
         number_of_legal_moves = len(position["legal_positions"])
-        all_predicted_correct = True
-        for i in range(number_of_legal_moves):
-            predicted_correct = is_move_legal(
-                position["legal_positions"], predicted_moves_per_position[idx][i]
-            )
-            all_predicted_correct = all_predicted_correct and predicted_correct
+        all_predicted_correct = all(
+            (token_id,) in fixture.legal_token_ids[idx]
+            for token_id in top_tokens[idx][:number_of_legal_moves]
+        )
+        predicted_moves = [
+            detokenize_word([token_id], notation) for token_id in top_tokens[idx]
+        ]
 
         results.append(
             (
                 position["id"],
-                predicted_moves_per_position[idx],
+                predicted_moves,
                 position["legal_positions"],
                 all_predicted_correct,
                 position["piece"],
@@ -249,7 +281,7 @@ def evaluate_legal_piece_moves(
         if all_predicted_correct:
             correct_predictions += 1
 
-    accuracy = calculate_accuracy(len(data), correct_predictions)
+    accuracy = calculate_accuracy(len(fixture.data), correct_predictions)
     return accuracy, results
 
 
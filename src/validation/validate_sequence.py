@@ -1,9 +1,21 @@
+import multiprocessing
+
 import chess  # type: ignore
 import src.notation_converter as converter
-from src.generate_prediction import generate_batch_predictions
+from src.generate_prediction import (
+    convert_list_to_string,
+    convert_string_to_list,
+    generate_batch_predictions,
+    generate_until_finished,
+)
+from src.lazy_import import LazyModule
+from src.tokenizer.detokenizer import detokenize_data
+from src.tokenizer.tokenizer import token_categories, tokenize_data
 from IPython.display import display, clear_output
 from time import sleep
 
+torch = LazyModule("torch")
+
 
 CASTLING_MOVES = {"Ke1g1", "Ke1c1", "Ke8g8", "Ke8c8"}
 
@@ -465,6 +477,37 @@ def check_syntax(move, notation="xLAN"):
     return is_piece and is_sqare_origin and is_sqare_target
 
 
+def push_generated_move(board, move, notation="xLAN"):
+    """
+    Plays a generated move on the board if it is legal. A legal move with a wrong indicator is
+    played as well, but counts as an error.
+
+    Args:
+        board (chess.Board): The current state of the chess board.
+        move (str): The move string in xLAN-format, e.g. 'Pe2e4'.
+        notation (str): The notation used for the game sequences.
+
+    Returns:
+        bool: True if the move is correct, False otherwise.
+    """
+    plus_notation = (
+        notation == "xLANplus" or notation == "xLANchk" or notation == "xLANcap"
+    )
+    if plus_notation:
+        uci_move, indicator = converter.xlanplus_move_to_uci(board, move)
+    else:
+        uci_move = converter.xlan_move_to_uci(board, move)
+        indicator = None
+    try:
+        parsed_move = chess.Move.from_uci(uci_move)
+    except:
+        return False
+    if parsed_move not in board.legal_moves:
+        return False
+    board.push(parsed_move)
+    return checkIndicator(board, indicator, parsed_move, notation)
+
+
 def get_legal_sequence_length(debug, game_moves, notation="xLAN"):
     """
     Returns the number of plies until an error occurs. If no error occurs, the number of plies is equal to the length of the game.
@@ -482,27 +525,11 @@ def get_legal_sequence_length(debug, game_moves, notation="xLAN"):
     number_of_plies_until_error = 0
     board = chess.Board()
     move = ""
-    plus_notation = (
-        notation == "xLANplus" or notation == "xLANchk" or notation == "xLANcap"
-    )
 
     for move in game_moves:
-        if plus_notation:
-            uci_move, indicator = converter.xlanplus_move_to_uci(board, move)
-        else:
-            uci_move = converter.xlan_move_to_uci(board, move)
-            indicator = None
-        try:
-            parsed_move = chess.Move.from_uci(uci_move)
-        except:
-            break
-        if parsed_move in board.legal_moves:
-            board.push(parsed_move)
-            if not checkIndicator(board, indicator, parsed_move, notation):
-                break
-            number_of_plies_until_error += 1
-        else:  # move is not legal
+        if not push_generated_move(board, move, notation):
             break
+        number_of_plies_until_error += 1
 
         if debug:
             clear_output(wait=True)
@@ -556,7 +583,57 @@ def checkIndicator(board, indicator, move, notation="xLANplus"):
             return indicator == "-"
 
 
-def evaluate_sequence(game_sequences, token_sequences, debug=False, notation="xLAN"):
+def evaluate_game(game, token_sequence=None, debug=False, notation="xLAN"):
+    """
+    Evaluates a single generated game, see `evaluate_sequence`.
+
+    Args:
+        game (str): The game in xLAN format.
+        token_sequence (list): The token sequence of the game.
+        debug (bool): If True, the board is displayed after each move.
+        notation (str): The notation used for the game.
+
+    Return:
+        tuple: (game_as_string, number_of_moves_until_error, error_type, first_illegal_move, token_sequence).
+    """
+    game_moves = game.split()
+
+    (
+        error_move,
+        number_of_plies_until_error,
+        board,
+    ) = get_legal_sequence_length(debug, game_moves, notation)
+    if debug:
+        print(f"error_move: {error_move}")
+        print(f"number_of_plies_until_error: {number_of_plies_until_error}")
+        print(f"board: {board}")
+
+    error_type = get_error_category(
+        game_moves, error_move, number_of_plies_until_error, board, notation
+    )
+
+    evaluation = []
+    update_evaluation(
+        debug,
+        evaluation,
+        game,
+        number_of_plies_until_error,
+        error_type,
+        error_move,
+        game_moves,
+        token_sequence,
+    )
+    return evaluation[0]
+
+
+def evaluate_sequence(
+    game_sequences,
+    token_sequences,
+    debug=False,
+    notation="xLAN",
+    num_processes=None,
+    chunk_size=64,
+):
     """
     Evaluates sequences of tokens of an aritrary number of chess games.
     The moves in each generated sequence are evaluated until a wrong move is made or the game ends.
@@ -576,50 +653,196 @@ def evaluate_sequence(game_sequences, token_sequences, debug=False, notation="xL
         *Max Length:* The game reached the max sequence length.
         *No Error:* The game ended without any errors.
 
+    The games are independent of each other, so they are evaluated in chunks of `chunk_size` games by a
+    pool of `num_processes` processes. The evaluation is returned in the order of the games either way.
+
     Args:
         game_sequences (list): The list of games in xLAN format.
-        token_sequences (list): The list of token sequences corresponding to the games.
-        debug (bool): If True, the board is displayed after each move.
+        token_sequences (list): The list of token sequences corresponding to the games. Can be empty.
+        debug (bool): If True, the board is displayed after each move. Debugging always runs in this process.
         notation (str): The notation used for the game sequences.
+        num_processes (int): The number of processes. Default is the number of CPU cores, 1 evaluates in this process.
+        chunk_size (int): The number of games sent to a process at once. Default is 64.
 
     Return:
         evaluation (list): The list of tuples containing (game_as_string, number_of_moves_until_error, error_type , first_illegal_move).
     """
+    if len(token_sequences) == 0:
+        token_sequences = [None] * len(game_sequences)
+    num_processes = num_processes or multiprocessing.cpu_count()
+    # a pool only pays off once every process gets at least one full chunk
+    num_processes = min(num_processes, len(game_sequences) // chunk_size)
+    arguments = [
+        (game_sequences[i], token_sequences[i], debug, notation)
+        for i in range(len(game_sequences))
+    ]
 
-    evaluation = []
+    if debug or num_processes <= 1:
+        evaluation = [evaluate_game(*game_arguments) for game_arguments in arguments]
+    else:
+        with multiprocessing.Pool(num_processes) as pool:
+            evaluation = pool.starmap(evaluate_game, arguments, chunksize=chunk_size)
+    if debug:
+        print(f"evaluation: {evaluation}")
 
-    for game in game_sequences:
-        if not len(token_sequences) == 0:
-            token_sequence = token_sequences[game_sequences.index(game)]
-        game_moves = game.split()
+    return evaluation
 
-        (
-            error_move,
-            number_of_plies_until_error,
-            board,
-        ) = get_legal_sequence_length(debug, game_moves, notation)
-        if debug:
-            print(f"error_move: {error_move}")
-            print(f"number_of_plies_until_error: {number_of_plies_until_error}")
-            print(f"board: {board}")
 
+class OnlineEvaluation:
+    """
+    Evaluates a game while it is generated, token by token, with the same rules as `evaluate_game`.
+
+    The tokens are assembled into moves like `detokenize_data` does: a piece (or any other token
+    that starts a word) starts a new move, squares and indicators are appended to the current one.
+    A move is played once the next move starts. The game is finished once further tokens cannot
+    change the evaluation: when the move after the first wrong move starts, when the move after
+    the end of the game is complete, or when a game separator is generated.
+
+    Attributes:
+    - notation (str): The notation of the tokens.
+    - token_ids (list[int]): The tokens of the game so far.
+    - finished (bool): True once the evaluation is final.
+
+    Example:
+        >>> game = OnlineEvaluation("xLANplus")
+        >>> finished = game.add_token(75)
+        >>> evaluation = game.evaluation()
+    """
+
+    def __init__(self, notation="xLAN"):
+        self.notation = notation
+        self.token_categories = token_categories(notation)
+
+        self.token_ids = []
+        self.board = chess.Board()
+        self.game_moves = []
+        self.word = None
+        self.error_move = ""
+        self.number_of_plies_until_error = 0
+        self.stopped = False
+        self.finished = False
+
+    def add_token(self, token_id):
+        """
+        Adds the next token of the game.
+
+        Returns:
+            bool: True if the game is finished.
+        """
+        self.token_ids.append(token_id)
+        category, buffer = self.token_categories.get(token_id, (None, None))
+        if category is None or category == "paddingToken":
+            return self.finished
+        if category == "gameSeparator":
+            self.end_move()
+            self.finished = True
+        elif category in ("squares", "plusTokens"):
+            self.word = (self.word or "") + buffer
+        else:
+            self.end_move()
+            self.word = buffer
+            # the evaluation also shows the move after the last correct one
+            if self.stopped and len(self.game_moves) > self.number_of_plies_until_error:
+                self.finished = True
+        return self.finished
+
+    def end_move(self):
+        if self.word is None:
+            return
+        move, self.word = self.word, None
+        self.game_moves.append(move)
+        if self.stopped:
+            return
+        self.error_move = move
+        if not push_generated_move(self.board, move, self.notation):
+            self.stopped = True
+            return
+        self.number_of_plies_until_error += 1
+        if self.board.outcome():
+            self.stopped = True
+
+    def evaluation(self):
+        """
+        Returns the evaluation of the game, as a tuple of `evaluate_sequence`.
+        """
+        self.end_move()
         error_type = get_error_category(
-            game_moves, error_move, number_of_plies_until_error, board, notation
+            self.game_moves,
+            self.error_move,
+            self.number_of_plies_until_error,
+            self.board,
+            self.notation,
         )
-
+        evaluation = []
         update_evaluation(
-            debug,
+            False,
             evaluation,
-            game,
-            number_of_plies_until_error,
+            detokenize_data(convert_list_to_string(self.token_ids), self.notation),
+            self.number_of_plies_until_error,
             error_type,
-            error_move,
-            game_moves,
-            token_sequence,
+            self.error_move,
+            self.game_moves,
+            convert_list_to_string(self.token_ids),
         )
-    if debug:
-        print(f"evaluation: {evaluation}")
+        return evaluation[0]
 
+
+def generate_and_evaluate(
+    model,
+    inputs,
+    num_tokens_to_generate,
+    notation="xLANplus",
+    temperature=0.7,
+    seed=None,
+    max_batch_size=30,
+):
+    """
+    Generates games and evaluates them while they are generated. A game stops being generated as
+    soon as its evaluation is final, i.e. after its first wrong move or the end of the game,
+    instead of always generating `num_tokens_to_generate` tokens.
+
+    Args:
+        model (Model): The chess model to be evaluated.
+        inputs (list): The input prefix of every game.
+        num_tokens_to_generate (int): The maximum number of tokens to generate for each game.
+        notation (str): The notation used for the game sequences.
+        temperature (float): The temperature setting for the sampling. Default is 0.7.
+        seed (int): The seed to be used for generation. Incremented for every batch.
+        max_batch_size (int): The maximum batch size for generation.
+
+    Returns:
+        evaluation (list): The list of tuples containing (game_as_string, number_of_moves_until_error, error_type , first_illegal_move, token_sequence).
+        The games end with the token that finished them, so `evaluate_sequence` gives the same evaluation for them.
+    """
+    original_device = next(model.parameters()).device
+    model.to("cuda" if torch.cuda.is_available() else "cpu")
+
+    evaluation = []
+    for start in range(0, len(inputs), max_batch_size):
+        if seed is not None:
+            torch.manual_seed(seed)
+            seed += 1
+
+        games = [
+            OnlineEvaluation(notation) for _ in inputs[start : start + max_batch_size]
+        ]
+        token_lists = []
+        for game, input in zip(games, inputs[start : start + max_batch_size]):
+            for token_id in convert_string_to_list(tokenize_data(input, notation)):
+                game.add_token(token_id)
+            token_lists.append(list(game.token_ids))
+        unfinished = [index for index, game in enumerate(games) if not game.finished]
+
+        generate_until_finished(
+            model,
+            [token_lists[index] for index in unfinished],
+            num_tokens_to_generate,
+            lambda index, token_id: games[unfinished[index]].add_token(token_id),
+            temperature=temperature,
+        )
+        evaluation.extend(game.evaluation() for game in games)
+
+    model.to(original_device)
     return evaluation
 
 
@@ -665,6 +888,7 @@ def validate_sequence(
     tokens_per_ply=3,
     notation="xLANplus",
     left_padding=False,
+    online=False,
 ):
     """
     Generates a batch of predictions and evaluates the generated sequences.
@@ -678,12 +902,26 @@ def validate_sequence(
         seed (int): The seed to be used for generation.
         tokens_per_ply (int): Number of tokens to generate per ply.
         left_padding (bool): If True, the model uses left padding.
+        online (bool): If True, every game is evaluated while it is generated and stops at its first wrong move, see `generate_and_evaluate`.
 
     Returns:
         average_correct_plies (float): The average number of correct plies in the generated sequences.
         error_frequencies (list): A list of tuples containing (error_type, frequency).
         evaluation (list): The list of tuples containing (game_as_string, number_of_moves_until_error, error_type , first_illegal_move).
     """
+    if online:
+        evaluation = generate_and_evaluate(
+            model,
+            [input_prefix] * number_of_games,
+            number_of_plies_to_generate * tokens_per_ply,
+            notation=notation,
+            temperature=0.7,
+            seed=seed,
+            max_batch_size=max_batch_size,
+        )
+        average_correct_plies, error_frequencies = analyze_evaluation(evaluation)
+        return average_correct_plies, error_frequencies, evaluation
+
     output_batch, tokens_batch, _ = generate_batch_predictions(
         inputs=[input_prefix] * number_of_games,
         num_tokens_to_generate=number_of_plies_to_generate * tokens_per_ply,
@@ -0,0 +1,66 @@
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel, MambaConfig, MambaForCausalLM
+
+from src.generate_prediction import convert_string_to_list
+from src.tokenizer.detokenizer import detokenize_data
+from src.tokenizer.tokenizer import tokenize_data
+from src.validation.validate_sequence import (
+    OnlineEvaluation,
+    evaluate_game,
+    evaluate_sequence,
+    generate_and_evaluate,
+)
+
+GAMES = [
+    # checkmate followed by further moves
+    "Pe2e4 Pe7e5 Bf1c4 Nb8c6 Qd1h5 Ng8f6 Qh5f7 Ke8e7 Pa2a3",
+    # checkmate at the end of the sequence
+    "Pe2e4 Pe7e5 Bf1c4 Nb8c6 Qd1h5 Ng8f6 Qh5f7",
+    "Pe2e4 Pe7e5 Bf1c4 Nb8c6 Qd1h5 Ng8f6 Qh5f7 1-0",
+    # illegal move
+    "Pe2e4 Pe7e5 Ke1e3 Pd7d6 Pd2d4",
+    "Pe2e4 Pe7e5 Ke1e3",
+    # squares without a piece are appended to the previous move
+    "Pe2e4 e7e5 Pd2d4",
+    "Pe2e4 Pe7e5 Ng1f3",
+]
+
+
+def test_online_evaluation_matches_offline_evaluation():
+    for game in GAMES:
+        token_ids = convert_string_to_list(tokenize_data(game, "xLAN"))
+        online = OnlineEvaluation("xLAN")
+        for token_id in token_ids:
+            if online.add_token(token_id):
+                break
+        evaluation = online.evaluation()
+
+        # the game stops after the token that finished it
+        assert evaluation == evaluate_game(
+            evaluation[0], evaluation[4], notation="xLAN"
+        )
+        full_game = detokenize_data(tokenize_data(game, "xLAN"), "xLAN")
+        assert evaluation[1:4] == evaluate_game(full_game, notation="xLAN")[1:4]
+
+
+def test_generate_and_evaluate_matches_evaluate_sequence():
+    torch.manual_seed(0)
+    models = [
+        GPT2LMHeadModel(GPT2Config(vocab_size=76, n_layer=2, n_head=2, n_embd=32)),
+        MambaForCausalLM(
+            MambaConfig(vocab_size=76, hidden_size=32, num_hidden_layers=2)
+        ),
+    ]
+    for model in models:
+        evaluation = generate_and_evaluate(
+            model,
+            ["", "Pe2e4 Pe7e5", ""],
+            num_tokens_to_generate=30,
+            notation="xLAN",
+            seed=0,
+            max_batch_size=2,
+        )
+
+        games = [result[0] for result in evaluation]
+        tokens = [result[4] for result in evaluation]
+        assert evaluation == evaluate_sequence(games, tokens, notation="xLAN")
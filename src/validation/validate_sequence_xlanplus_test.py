@@ -301,5 +301,24 @@ def test_evaluate_sequence():
     )
 
 
+def test_evaluate_sequence_in_parallel_keeps_the_order_of_the_games():
+    games = [
+        "Pe2e4 Pe7e5 Ng1f3 Nb8c6",
+        "Pe2e4 Pe7e5 Ke1e3",
+        "Pe2e4 Pe7e5 Ng1f3 Nb8c6",
+    ] * 20
+    tokens = [[i] for i in range(len(games))]
+
+    serial = evaluate_sequence(games, tokens, notation="xLAN", num_processes=1)
+    parallel = evaluate_sequence(
+        games, tokens, notation="xLAN", num_processes=2, chunk_size=8
+    )
+
+    assert parallel == serial
+    # identical games keep their own tokens
+    assert [result[4] for result in parallel] == tokens
+    assert [result[1] for result in parallel[:3]] == [4, 2, 4]
+
+
 # Run the test function
 test_evaluate_sequence()